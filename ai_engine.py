@@ -0,0 +1,316 @@
+# ai_engine.py - asyncio AI 请求引擎（可选）
+# 一个事件循环线程 + 一个连接池，信号量限制并发，指数退避 + 抖动重试
+
+import re
+import queue
+import random
+import asyncio
+import threading
+import concurrent.futures
+
+import common
+
+try:
+    import httpx
+    from openai import AsyncOpenAI, APIStatusError, APIConnectionError, APITimeoutError
+except ImportError:
+    httpx = None
+    AsyncOpenAI = None
+
+
+class EngineClosed(Exception):
+    pass
+
+
+class StreamIncomplete(Exception):
+    """流式响应没有以 finish_reason=stop 结束（连接断开或输出被截断）"""
+
+
+def parse_retry_after(headers):
+    """解析 retry-after-ms / Retry-After（秒），返回需要等待的秒数或 None"""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return None
+
+
+_DURATION_RE = re.compile(r'([\d.]+)(ms|s|m|h)?')
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "": 1}
+
+
+def parse_reset_seconds(value):
+    """x-ratelimit-reset-requests 形如 '1s' / '250ms' / '1m30s'"""
+    if not value:
+        return None
+    try:
+        parts = _DURATION_RE.findall(value.strip())
+        return sum(float(num) * _DURATION_UNITS[unit] for num, unit in parts) if parts else None
+    except ValueError:
+        return None
+
+
+class CSVRowStream:
+    """把流式返回的文本增量切成完整的 CSV 行；跳过代码块标记和不含逗号的行"""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def _accept(self, line):
+        line = line.strip()
+        if not line or line.startswith("```") or "," not in line:
+            return None
+        return line
+
+    def feed(self, text):
+        self.buffer += text
+        *complete, self.buffer = self.buffer.split("\n")
+        return [line for line in (self._accept(l) for l in complete) if line]
+
+    def finish(self):
+        line = self._accept(self.buffer)
+        self.buffer = ""
+        return [line] if line else []
+
+
+class AsyncAIEngine:
+    """在后台线程运行的 asyncio 客户端，对外提供线程安全的阻塞/Future 接口"""
+
+    def __init__(self, api_key, base_url, model, max_concurrency=4, retry_times=3,
+                 base_delay=1.0, max_delay=60.0, timeout=60.0):
+        if AsyncOpenAI is None:
+            raise RuntimeError("openai/httpx not installed")
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.max_concurrency = max_concurrency
+        # 至少请求一次；retry_times=0 按不重试处理
+        self.retry_times = max(1, retry_times)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+        self.metrics_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.rate_limited = 0
+
+        self.closed = False
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run_loop, name="ai-engine", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        # 限流时所有请求共享的恢复时间点（loop.time()）
+        self.resume_at = 0.0
+        self.tasks = set()
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency),
+            timeout=self.timeout)
+        self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                  http_client=self.http_client, max_retries=0)
+        self.ready.set()
+        self.loop.run_forever()
+
+    def submit(self, messages, temperature=0.3):
+        """提交一次 chat 请求，返回 concurrent.futures.Future[str]"""
+        if self.closed:
+            raise EngineClosed("engine is shut down")
+        return asyncio.run_coroutine_threadsafe(self._track(self._complete(messages, temperature)), self.loop)
+
+    def complete(self, messages, temperature=0.3, timeout=None):
+        return self.submit(messages, temperature).result(timeout)
+
+    async def _track(self, coro):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            return await coro
+        finally:
+            self.tasks.discard(task)
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay *= random.uniform(0.5, 1.5)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _note_rate_limit(self, headers):
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is not None and remaining.strip() == "0":
+            reset = parse_reset_seconds(headers.get("x-ratelimit-reset-requests"))
+            if reset:
+                self.resume_at = max(self.resume_at, self.loop.time() + reset)
+
+    def _retry_delay(self, error, attempt):
+        """可重试的错误返回等待秒数，不可重试（如 400/401）返回 None"""
+        if not isinstance(error, APIStatusError):
+            return self._backoff(attempt)
+        if error.status_code < 500 and error.status_code not in (408, 409, 429):
+            return None
+        delay = self._backoff(attempt, parse_retry_after(error.response.headers))
+        if error.status_code == 429:
+            # 限流时整个引擎暂停，而不只是当前请求
+            with self.metrics_lock:
+                self.rate_limited += 1
+            self._note_rate_limit(error.response.headers)
+            self.resume_at = max(self.resume_at, self.loop.time() + delay)
+        return delay
+
+    async def _complete(self, messages, temperature):
+        last_error = None
+        for attempt in range(self.retry_times):
+            wait = self.resume_at - self.loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with self.semaphore:
+                with self.metrics_lock:
+                    self.requests += 1
+                    self.in_flight += 1
+                try:
+                    raw = await self.client.chat.completions.with_raw_response.create(
+                        model=self.model, messages=messages, temperature=temperature, stream=False)
+                    self._note_rate_limit(raw.headers)
+                    return raw.parse().choices[0].message.content
+                except (APIStatusError, APIConnectionError, APITimeoutError) as e:
+                    last_error = e
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        break
+                finally:
+                    with self.metrics_lock:
+                        self.in_flight -= 1
+            if attempt < self.retry_times - 1:
+                with self.metrics_lock:
+                    self.retries += 1
+                common.log(f"AI engine retry {attempt + 1} in {delay:.1f}s: {last_error}")
+                await asyncio.sleep(delay)
+        with self.metrics_lock:
+            self.failures += 1
+        raise last_error
+
+    def stream(self, messages, temperature=0.3):
+        """流式请求，在调用线程中逐块产出文本增量（同步生成器）"""
+        if self.closed:
+            raise EngineClosed("engine is shut down")
+        chunks = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for delta in self._stream(messages, temperature):
+                    chunks.put(delta)
+                chunks.put(done)
+            except BaseException as e:
+                chunks.put(e)
+                raise
+
+        future = asyncio.run_coroutine_threadsafe(self._track(pump()), self.loop)
+        try:
+            while True:
+                item = chunks.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    async def _stream(self, messages, temperature):
+        """只在收到第一个增量之前重试；已经输出的内容无法安全重放"""
+        last_error = None
+        for attempt in range(self.retry_times):
+            wait = self.resume_at - self.loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            started = False
+            async with self.semaphore:
+                with self.metrics_lock:
+                    self.requests += 1
+                    self.in_flight += 1
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=self.model, messages=messages, temperature=temperature, stream=True)
+                    finish_reason = None
+                    async for chunk in response:
+                        if not chunk.choices:
+                            continue
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
+                        if chunk.choices[0].delta.content:
+                            started = True
+                            yield chunk.choices[0].delta.content
+                    if finish_reason != "stop":
+                        raise StreamIncomplete(f"stream ended with finish_reason={finish_reason}")
+                    return
+                except (APIStatusError, APIConnectionError, APITimeoutError) as e:
+                    if started:
+                        raise
+                    last_error = e
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        break
+                finally:
+                    with self.metrics_lock:
+                        self.in_flight -= 1
+            if attempt < self.retry_times - 1:
+                with self.metrics_lock:
+                    self.retries += 1
+                common.log(f"AI engine retry {attempt + 1} in {delay:.1f}s: {last_error}")
+                await asyncio.sleep(delay)
+        with self.metrics_lock:
+            self.failures += 1
+        raise last_error
+
+    def get_metrics(self):
+        with self.metrics_lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "in_flight": self.in_flight,
+                "rate_limited": self.rate_limited,
+                "pending": len(self.tasks) if hasattr(self, "tasks") else 0,
+            }
+
+    def shutdown(self, timeout=30):
+        """不再接收新请求；等待已提交请求完成，超时则取消；最后关闭连接池"""
+        if self.closed:
+            return
+        self.closed = True
+
+        async def drain():
+            pending = [t for t in self.tasks if t is not asyncio.current_task()]
+            if pending:
+                done, not_done = await asyncio.wait(pending, timeout=timeout)
+                for task in not_done:
+                    task.cancel()
+                if not_done:
+                    await asyncio.gather(*not_done, return_exceptions=True)
+            await self.http_client.aclose()
+
+        try:
+            asyncio.run_coroutine_threadsafe(drain(), self.loop).result(timeout + 5)
+        except (concurrent.futures.TimeoutError, RuntimeError) as e:
+            common.log(f"AI engine drain error: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        common.log(f"AI engine stopped: {self.get_metrics()}")
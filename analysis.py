@@ -0,0 +1,322 @@
+# analysis.py - 数据处理函数
+# 不依赖 Streamlit，webui 与 benchmark 共用
+
+import io
+import os
+import threading
+
+import pandas as pd
+
+import storage
+
+FULL_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+SHORT_TIME_FORMATS = ['%H:%M:%S', '%H:%M']
+_STRPTIME_EPOCH = pd.Timestamp('1900-01-01')
+_UNIX_EPOCH = pd.Timestamp('1970-01-01')
+
+
+def parse_time_column(series, date_str):
+    """向量化解析时间列：完整日期时间直接解析，HH:MM[:SS] 以 date_str 为基准日期"""
+    notna = series.notna()
+    text = series.astype(str).str.strip()
+    result = pd.Series(pd.NaT, index=series.index, dtype='datetime64[ns]')
+
+    # 长度 > 10 视为带日期的完整时间
+    long_mask = notna & (text.str.len() > 10)
+    if long_mask.any():
+        parsed = pd.to_datetime(text[long_mask], format=FULL_TIME_FORMAT, errors='coerce')
+        failed = parsed.isna()
+        if failed.any():
+            parsed[failed] = pd.to_datetime(text[long_mask][failed], format='mixed', errors='coerce')
+        result[long_mask] = parsed
+
+    base = pd.Timestamp(date_str)
+    remaining = notna & ~long_mask
+    for fmt in SHORT_TIME_FORMATS:
+        if not remaining.any():
+            break
+        parsed = pd.to_datetime(text[remaining], format=fmt, errors='coerce')
+        ok = parsed.notna()
+        # strptime 默认日期为 1900-01-01，换算成当天的偏移量
+        result[parsed.index[ok]] = base + (parsed[ok] - _STRPTIME_EPOCH)
+        remaining[parsed.index[ok]] = False
+
+    return result
+
+
+def process_dataframe(df, date_str):
+    """处理DataFrame，添加时间列"""
+    if df is None or df.empty:
+        return None
+
+    df = df.copy()
+    df['日期'] = date_str
+    df['Start_DT'] = parse_time_column(df['开始时间'], date_str)
+    df['End_DT'] = parse_time_column(df['结束时间'], date_str)
+    df = df.dropna(subset=['Start_DT', 'End_DT'])
+
+    if df.empty:
+        return None
+
+    df['Duration_Min'] = ((df['End_DT'] - df['Start_DT']).dt.total_seconds() / 60).clip(lower=0)
+    return df
+
+
+def frame_from_columns(columns, categories):
+    """把存储层返回的列（纪元秒 + 分类编码）组装成仪表盘使用的 DataFrame"""
+    if not columns['day']:
+        return pd.DataFrame()
+
+    df = pd.DataFrame({'日期': columns['day'], '任务详情': columns['detail']})
+    codes = pd.Series(columns['category_id'])
+    df['任务分类'] = codes.map(categories).fillna('').astype(str)
+    df['Start_DT'] = pd.to_datetime(pd.Series(columns['start_ts'], dtype='int64'), unit='s')
+    df['End_DT'] = pd.to_datetime(pd.Series(columns['end_ts'], dtype='int64'), unit='s')
+    df['开始时间'] = df['Start_DT'].dt.strftime('%H:%M:%S')
+    df['结束时间'] = df['End_DT'].dt.strftime('%H:%M:%S')
+    df['Duration_Min'] = ((df['End_DT'] - df['Start_DT']).dt.total_seconds() / 60).clip(lower=0)
+    return df[['开始时间', '结束时间', '任务分类', '任务详情', '日期', 'Start_DT', 'End_DT', 'Duration_Min']]
+
+
+def merge_live_rows(df, rows, start_str, end_str):
+    """把实时推送的 [(日期, 行)] 合并进已载入的明细，返回 (合并后的明细, 新增部分)
+
+    载入磁盘数据与记下推送位置之间写入的记录两边都有，按 (日期, 开始, 结束, 分类) 去重。
+    """
+    by_date = {}
+    for date_str, row in rows:
+        if start_str <= date_str <= end_str:
+            by_date.setdefault(date_str, []).append(row)
+    frames = [process_dataframe(pd.DataFrame([list(row[:4]) for row in day_rows], columns=CSVTailCache.HEADER),
+                                date_str)
+              for date_str, day_rows in by_date.items()]
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        return df, pd.DataFrame()
+
+    live_df = pd.concat(frames, ignore_index=True)
+    key = ['日期', 'Start_DT', 'End_DT', '任务分类']
+    live_df = live_df.drop_duplicates(key)
+    if not df.empty:
+        # 增量只有几行，只和不早于其最早开始时间的已载入记录比较
+        recent = df[df['Start_DT'] >= live_df['Start_DT'].min()]
+        seen = set(zip(*(recent[col] for col in key)))
+        live_df = live_df[[row not in seen for row in zip(*(live_df[col] for col in key))]]
+    if live_df.empty:
+        return df, live_df
+    if df.empty:
+        return live_df.reset_index(drop=True), live_df
+    return pd.concat([df, live_df], ignore_index=True), live_df
+
+
+def rollup_frames(df):
+    """由明细计算与存储层汇总同格式的 (按天, 按小时) DataFrame，用于叠加实时增量"""
+    daily_rows, hourly_rows = [], []
+    if not df.empty:
+        for date_str, group in df.groupby('日期'):
+            starts = (group['Start_DT'] - _UNIX_EPOCH) // pd.Timedelta(seconds=1)
+            ends = (group['End_DT'] - _UNIX_EPOCH) // pd.Timedelta(seconds=1)
+            daily, hourly = storage.compute_rollup(zip(starts, ends, group['任务分类']))
+            daily_rows.extend((date_str, cat, minutes) for cat, minutes in daily.items())
+            hourly_rows.extend((date_str, hour, cat, minutes) for (hour, cat), minutes in hourly.items())
+    return (pd.DataFrame(daily_rows, columns=['日期', '分类', '分钟']),
+            pd.DataFrame(hourly_rows, columns=['日期', '小时', '分类', '分钟']))
+
+
+TIMELINE_PIXELS = 1200
+TIMELINE_FULL_ROWS = 1500
+
+
+def downsample_timeline(df, view_start=None, view_end=None, pixels=TIMELINE_PIXELS,
+                        max_full_rows=TIMELINE_FULL_ROWS):
+    """时间轴按可见范围分级合并，返回 (timeline_df, resolution_seconds)
+
+    可见范围内记录不超过 max_full_rows 时原样返回明细（resolution 为 0）；
+    否则按每像素代表的秒数合并：同一分类中间隔不超过一个像素的相邻片段并为一段，
+    不足一个像素的零碎片段因此落入同一段，条数最多约为 分类数 × pixels。
+    合并后的 Duration_Min 为实际记录时长之和，任务详情取段内最长的记录，记录数为合并条数。
+    """
+    if view_start is not None:
+        df = df[df['End_DT'] >= view_start]
+    if view_end is not None:
+        df = df[df['Start_DT'] <= view_end]
+    if df.empty or len(df) <= max_full_rows:
+        return df.assign(记录数=1), 0
+
+    start = view_start if view_start is not None else df['Start_DT'].min()
+    end = view_end if view_end is not None else df['End_DT'].max()
+    resolution = max((end - start).total_seconds() / pixels, 1)
+    gap = pd.Timedelta(seconds=resolution)
+
+    df = df.sort_values(['任务分类', 'Start_DT'])
+    category = df['任务分类']
+    # 同一分类内到上一条为止的最晚结束时间；新分类或间隔超过一个像素时开始新的一段
+    reach = df.groupby(category, sort=False)['End_DT'].cummax()
+    prev_reach = reach.groupby(category, sort=False).shift()
+    new_segment = prev_reach.isna() | (df['Start_DT'] - prev_reach > gap)
+    segment = new_segment.cumsum().to_numpy()
+
+    grouped = df.groupby(segment, sort=False)
+    merged = grouped.agg(任务分类=('任务分类', 'first'), 日期=('日期', 'first'),
+                         Start_DT=('Start_DT', 'min'), End_DT=('End_DT', 'max'),
+                         Duration_Min=('Duration_Min', 'sum'), 记录数=('任务分类', 'size'))
+    longest = df['Duration_Min'].to_numpy().argsort(kind='stable')
+    detail = pd.Series(df['任务详情'].to_numpy()[longest], index=segment[longest])
+    merged['任务详情'] = detail.groupby(level=0).last()
+    merged['开始时间'] = merged['Start_DT'].dt.strftime('%H:%M:%S')
+    merged['结束时间'] = merged['End_DT'].dt.strftime('%H:%M:%S')
+    merged = merged.sort_values('Start_DT').reset_index(drop=True)
+    return merged, resolution
+
+
+EDIT_COLUMNS = ['日期', '开始时间', '结束时间', '任务分类', '任务详情']
+
+
+def diff_edits(original, edited, default_date=None):
+    """对比编辑前后的明细，返回 ({日期: (删除键列表, 新增行列表)}, 无效行数)
+
+    original 为编辑器载入的行（需含 Start_DT / End_DT），edited 为编辑器返回的行，按索引对应：
+    索引消失的行是删除，新索引是新增，内容变化的行记为删除旧行 + 新增新行（日期也可能变化）。
+    删除键与 storage.row_key 一致；新增行为 [开始时间, 结束时间, 任务分类, 任务详情]。
+    """
+    before = original[EDIT_COLUMNS].fillna('').astype(str)
+    after = edited[EDIT_COLUMNS].fillna('').astype(str)
+
+    common_index = before.index.intersection(after.index)
+    differs = (before.loc[common_index] != after.loc[common_index]).any(axis=1)
+    changed = common_index[differs.to_numpy()]
+    removed = before.index[~before.index.isin(after.index) | before.index.isin(changed)]
+    added = after[~after.index.isin(before.index) | after.index.isin(changed)]
+
+    changes = {}
+    if len(removed):
+        old = original.loc[removed]
+        # 不依赖 datetime64 的精度单位（CSV 为 ns，列式存储为 s）
+        starts = (old['Start_DT'] - _UNIX_EPOCH) // pd.Timedelta(seconds=1)
+        ends = (old['End_DT'] - _UNIX_EPOCH) // pd.Timedelta(seconds=1)
+        for day, start_ts, end_ts, category, detail in zip(
+                before.loc[removed, '日期'], starts, ends,
+                before.loc[removed, '任务分类'], before.loc[removed, '任务详情']):
+            changes.setdefault(day, ([], []))[0].append(
+                (int(start_ts), int(end_ts), category.strip(), detail))
+
+    invalid = 0
+    for day, start, end, category, detail in added.itertuples(index=False):
+        if not (start or end or category or detail):
+            # 新增后未填写的空行
+            continue
+        day = day or default_date
+        if not day or storage.to_epoch(day, start) is None or storage.to_epoch(day, end) is None:
+            invalid += 1
+            continue
+        changes.setdefault(day, ([], []))[1].append([start.strip(), end.strip(), category.strip(), detail])
+    return changes, invalid
+
+
+class CSVTailCache:
+    """按 (path, mtime, size) 缓存的增量 CSV 读取器
+
+    文件只追加时，只解析上次读取位置之后新增的完整行并拼接到缓存帧上；
+    文件被截断或改写（上次末尾的字节对不上）时整文件重读。
+    """
+    HEADER = ['开始时间', '结束时间', '任务分类', '任务详情']
+    ENCODINGS = ['utf-8-sig', 'utf-8', 'gbk']
+    SIG_BYTES = 64
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def load(self, path):
+        """返回该文件当前的原始 DataFrame（只含四列），读不到时返回 None"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry['key'] == key:
+                return entry['frame']
+            if entry and stat.st_size >= entry['offset'] and self._same_prefix(path, entry):
+                frame = self._read_tail(path, entry)
+            else:
+                frame = self._read_full(path)
+            if frame is None:
+                self.entries.pop(path, None)
+                return None
+            self.entries[path]['key'] = key
+            return frame
+
+    def invalidate(self, path=None):
+        with self.lock:
+            if path is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(path, None)
+
+    def _same_prefix(self, path, entry):
+        start = max(entry['offset'] - self.SIG_BYTES, 0)
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return f.read(entry['offset'] - start) == entry['sig']
+
+    def _parse(self, text, header):
+        df = pd.read_csv(io.StringIO(text), header=0 if header else None,
+                         on_bad_lines='skip', dtype=str, keep_default_na=False)
+        if len(df.columns) < 4:
+            return None
+        df = df.iloc[:, :4]
+        df.columns = self.HEADER
+        return df
+
+    def _remember(self, path, data, offset, frame, encoding):
+        sig_start = max(offset - self.SIG_BYTES, 0)
+        self.entries[path] = {
+            'offset': offset,
+            'sig': data[sig_start:offset],
+            'frame': frame,
+            'encoding': encoding,
+            'key': None,
+        }
+
+    def _read_full(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        # 只消费到最后一个换行符，半行留给下一次
+        offset = data.rfind(b'\n') + 1
+        for encoding in self.ENCODINGS:
+            try:
+                text = data[:offset].decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            return None
+        if not text.strip():
+            return None
+        frame = self._parse(text, header=True)
+        if frame is None:
+            return None
+        # BOM 只出现在文件开头，后续增量按 utf-8 解码
+        self._remember(path, data, offset, frame, 'utf-8' if encoding == 'utf-8-sig' else encoding)
+        return frame
+
+    def _read_tail(self, path, entry):
+        with open(path, 'rb') as f:
+            f.seek(entry['offset'])
+            chunk = f.read()
+        end = chunk.rfind(b'\n') + 1
+        if end == 0:
+            return entry['frame']
+        try:
+            text = chunk[:end].decode(entry['encoding'])
+        except UnicodeDecodeError:
+            return self._read_full(path)
+        tail = self._parse(text, header=False)
+        frame = entry['frame'] if tail is None else pd.concat([entry['frame'], tail], ignore_index=True)
+        offset = entry['offset'] + end
+        sig = (entry['sig'] + chunk[:end])[-self.SIG_BYTES:]
+        entry.update(offset=offset, sig=sig, frame=frame)
+        return frame
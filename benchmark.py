@@ -0,0 +1,1215 @@
+# benchmark.py - 性能基准测试
+# Run: python benchmark.py <name> [--sizes N1,N2,...]
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import analysis
+import common
+
+
+def timed(func, *args, repeat=1):
+    """返回多次运行中的最短耗时（秒）与最后一次结果"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def make_day_frame(rows, seed=0):
+    """生成一天格式混杂的原始 CSV 数据（HH:MM:SS / HH:MM / 完整时间 / 坏行）"""
+    rng = random.Random(seed)
+    starts, ends = [], []
+    for _ in range(rows):
+        s = rng.randrange(0, 86000)
+        e = min(s + rng.randrange(2, 3600), 86399)
+        kind = rng.random()
+        if kind < 0.9:
+            starts.append(f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}")
+            ends.append(f"{e // 3600:02d}:{e // 60 % 60:02d}:{e % 60:02d}")
+        elif kind < 0.95:
+            starts.append(f"{s // 3600:02d}:{s // 60 % 60:02d}")
+            ends.append(f"{e // 3600:02d}:{e // 60 % 60:02d}")
+        elif kind < 0.99:
+            starts.append(f"2024-01-15 {s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}")
+            ends.append(f"2024-01-15 {e // 3600:02d}:{e // 60 % 60:02d}:{e % 60:02d}")
+        else:
+            starts.append("??")
+            ends.append("")
+    return pd.DataFrame({
+        '开始时间': starts,
+        '结束时间': ends,
+        '任务分类': [rng.choice(["开发", "学习", "社交", "娱乐"]) for _ in range(rows)],
+        '任务详情': ["detail"] * rows,
+    })
+
+
+def process_dataframe_rowwise(df, date_str):
+    """旧版逐行实现（parse_time + apply），仅作对照"""
+    if df is None or df.empty:
+        return None
+
+    df = df.copy()
+    df['日期'] = date_str
+    base_date = datetime.strptime(date_str, "%Y-%m-%d")
+
+    def parse_time(t_str):
+        if pd.isna(t_str):
+            return None
+        t_str = str(t_str).strip()
+        for fmt in ['%Y-%m-%d %H:%M:%S', '%H:%M:%S', '%H:%M']:
+            try:
+                if len(t_str) > 10:
+                    return pd.to_datetime(t_str)
+                t = datetime.strptime(t_str, fmt).time()
+                return datetime.combine(base_date, t)
+            except:
+                continue
+        return None
+
+    df['Start_DT'] = df['开始时间'].apply(parse_time)
+    df['End_DT'] = df['结束时间'].apply(parse_time)
+    df = df.dropna(subset=['Start_DT', 'End_DT'])
+
+    if df.empty:
+        return None
+
+    df['Duration_Min'] = (df['End_DT'] - df['Start_DT']).apply(
+        lambda x: max(x.total_seconds() / 60, 0) if pd.notna(x) else 0
+    )
+    return df
+
+
+def bench_parse(sizes):
+    """process_dataframe：逐行 apply vs 向量化"""
+    print(f"{'rows':>10} {'rowwise(s)':>12} {'vector(s)':>12} {'speedup':>9}")
+    for n in sizes:
+        raw = make_day_frame(n)
+        t_row, old = timed(process_dataframe_rowwise, raw, "2024-01-15")
+        t_vec, new = timed(analysis.process_dataframe, raw, "2024-01-15", repeat=3)
+        print(f"{n:>10} {t_row:>12.3f} {t_vec:>12.3f} {t_row / t_vec:>8.1f}x")
+
+
+class StubChatServer:
+    """本地模拟 /chat/completions 的 HTTP 服务，用于离线测试 AI 引擎
+
+    latency: 每次请求的延迟（秒）；rate_limit_every: 每 N 个请求返回一次 429 + Retry-After
+    row_latency: 生成每一行结果的耗时（模拟逐 token 输出）；stream_break_after: 流式响应发出 N 行后断开
+    """
+
+    def __init__(self, latency=0.05, rate_limit_every=0, retry_after=0.2, row_latency=0.0,
+                 stream_break_after=0):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.row_latency = row_latency
+        self.stream_break_after = stream_break_after
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+                with server.lock:
+                    server.requests += 1
+                    count = server.requests
+                    server.concurrent += 1
+                    server.max_concurrent = max(server.max_concurrent, server.concurrent)
+                try:
+                    if server.rate_limit_every and count % server.rate_limit_every == 0:
+                        self._send(429, {"error": {"message": "rate limited"}},
+                                   {"Retry-After": str(server.retry_after)})
+                        return
+                    time.sleep(server.latency)
+                    request = json.loads(body)
+                    content = server.answer(request["messages"][-1]["content"])
+                    if request.get("stream"):
+                        self._send_stream(count, request, content)
+                        return
+                    time.sleep(server.row_latency * content.count("\n"))
+                    self._send(200, {
+                        "id": f"stub-{count}", "object": "chat.completion", "created": int(time.time()),
+                        "model": request.get("model", "stub"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": content}}],
+                    }, {"x-ratelimit-remaining-requests": "100"})
+                finally:
+                    with server.lock:
+                        server.concurrent -= 1
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, count, request, content):
+                """SSE 逐行输出；stream_break_after 行后直接断开连接"""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for i, line in enumerate(content.splitlines(keepends=True)):
+                    if server.stream_break_after and i > server.stream_break_after:
+                        return
+                    time.sleep(server.row_latency)
+                    chunk = {
+                        "id": f"stub-{count}", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": request.get("model", "stub"),
+                        "choices": [{"index": 0, "finish_reason": None, "delta": {"content": line}}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                chunk["choices"] = [{"index": 0, "finish_reason": "stop", "delta": {}}]
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def answer(user_content):
+        """按日志行的时间段逐行返回 CSV，分类固定为「开发」"""
+        rows = []
+        for line in user_content.splitlines():
+            if line.startswith("[") and " - " in line:
+                start = line[12:20]
+                end = line[34:42]
+                rows.append(f"{start},{end},开发,stub")
+        return "```csv\n" + "\n".join(rows) + "\n```"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def make_log_lines(count, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        s = rng.randrange(0, 80000)
+        e = s + rng.randrange(30, 3600)
+        lines.append(f"[2024-01-15 {s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d} - "
+                     f"2024-01-15 {e // 3600:02d}:{e // 60 % 60:02d}:{e % 60:02d}] "
+                     f"<code.exe> [活跃度:高]  VSCode - tracker.py")
+    return lines
+
+
+def bench_ai(sizes):
+    """AI 请求：同步客户端逐个请求 vs asyncio 引擎（并发 4，每 10 次限流一次）"""
+    from openai import OpenAI
+    import ai_engine
+
+    messages = [{"role": "system", "content": "stub"},
+                {"role": "user", "content": "\n".join(make_log_lines(5))}]
+    print(f"{'requests':>9} {'sync(s)':>9} {'engine(s)':>10} {'req/s':>8} {'retries':>8} {'429':>5} {'peak':>5}")
+    for n in sizes:
+        server = StubChatServer(latency=0.05, rate_limit_every=10, retry_after=0.1)
+        client = OpenAI(api_key="stub", base_url=server.base_url, max_retries=5)
+        t_sync, _ = timed(lambda: [client.chat.completions.create(model="stub", messages=messages)
+                                   for _ in range(n)])
+        engine = ai_engine.AsyncAIEngine("stub", server.base_url, "stub", max_concurrency=4,
+                                         retry_times=5, base_delay=0.05)
+        t_engine, _ = timed(lambda: [f.result() for f in [engine.submit(messages) for _ in range(n)]])
+        metrics = engine.get_metrics()
+        engine.shutdown()
+        print(f"{n:>9} {t_sync:>9.2f} {t_engine:>10.2f} {n / t_engine:>8.1f} "
+              f"{metrics['retries']:>8} {metrics['rate_limited']:>5} {server.max_concurrent:>5}")
+        server.close()
+
+
+def bench_stream(sizes):
+    """AI 结果：整段返回后解析 vs 流式逐行解析（首行时间与总耗时，每行生成 20ms）"""
+    from openai import OpenAI
+    import ai_engine
+
+    print(f"{'rows':>6} {'full(s)':>9} {'stream-first(s)':>16} {'stream-total(s)':>16}")
+    server = StubChatServer(latency=0.05, row_latency=0.02)
+    client = OpenAI(api_key="stub", base_url=server.base_url)
+    for n in sizes:
+        messages = [{"role": "system", "content": "stub"},
+                    {"role": "user", "content": "\n".join(make_log_lines(n))}]
+
+        t0 = time.perf_counter()
+        content = client.chat.completions.create(model="stub", messages=messages).choices[0].message.content
+        full_rows = [l for l in content.split("\n") if "," in l]
+        t_full = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        first = None
+        parser = ai_engine.CSVRowStream()
+        stream_rows = []
+        for chunk in client.chat.completions.create(model="stub", messages=messages, stream=True):
+            if chunk.choices and chunk.choices[0].delta.content:
+                stream_rows.extend(parser.feed(chunk.choices[0].delta.content))
+                if stream_rows and first is None:
+                    first = time.perf_counter() - t0
+        stream_rows.extend(parser.finish())
+        t_stream = time.perf_counter() - t0
+        assert len(stream_rows) == len(full_rows) == n
+        print(f"{n:>6} {t_full:>9.2f} {first:>16.2f} {t_stream:>16.2f}")
+    server.close()
+
+
+def make_window_script(minutes, seed=0):
+    """模拟使用：平均每 2 分钟切换一次窗口，每分钟 1~2 次标题变化"""
+    rng = random.Random(seed)
+    apps = [("code.exe", "tracker.py - VSCode"), ("chrome.exe", "GitHub - Chrome"),
+            ("wechat.exe", "微信"), ("explorer.exe", "下载")]
+    script, t = [], 0.0
+    process, title = apps[0]
+    while t < minutes * 60:
+        delay = rng.expovariate(1 / 40)
+        t += delay
+        if rng.random() < 0.33:
+            process, title = rng.choice(apps)
+        else:
+            title = f"{title.split(' #')[0]} #{rng.randrange(100)}"
+        script.append((delay, title, process, ""))
+    return script
+
+
+def bench_window(sizes):
+    """前台窗口跟踪：每秒轮询 vs 事件驱动（时间加速 60 倍，换算为每小时唤醒次数与 CPU 时间）"""
+    import queue
+    import desktop
+
+    speed = 60.0
+    print(f"{'minutes':>8} {'mode':>7} {'wakeups/h':>10} {'cpu ms/h':>9} {'events':>7}")
+    for minutes in sizes:
+        script = make_window_script(minutes)
+        duration = minutes * 60 / speed
+
+        # 现有循环：每秒醒来一次调用探测函数
+        cpu0, t0, wakeups = time.process_time(), time.monotonic(), 0
+        while time.monotonic() - t0 < duration:
+            time.sleep(1 / speed)
+            wakeups += 1
+            desktop.PollingSource._win32_probe()
+        cpu = time.process_time() - cpu0
+        per_hour = 60 / minutes
+        print(f"{minutes:>8} {'poll':>7} {wakeups * per_hour:>10.0f} {cpu * 1000 * per_hour:>9.1f} {'-':>7}")
+
+        # 事件驱动：只有窗口事件或最长等待（30s）到期才醒来
+        events = queue.Queue()
+        source = desktop.ScriptedSource(script, speed=speed)
+        cpu0, t0, wakeups, received = time.process_time(), time.monotonic(), 0, 0
+        source.start(events.put)
+        while time.monotonic() - t0 < duration:
+            try:
+                events.get(timeout=30 / speed)
+                received += 1
+            except queue.Empty:
+                pass
+            wakeups += 1
+        source.stop()
+        cpu = time.process_time() - cpu0
+        print(f"{minutes:>8} {'event':>7} {wakeups * per_hour:>10.0f} {cpu * 1000 * per_hour:>9.1f} {received:>7}")
+
+
+def make_usage_timeline(days, seed=0):
+    """模拟多天使用的回放时间线：夜间睡眠、午休空闲、短暂切换、偶尔跨过零点"""
+    rng = random.Random(seed)
+    apps = [("code.exe", "tracker.py - VSCode", ""), ("chrome.exe", "GitHub - Chrome", "github.com/x"),
+            ("chrome.exe", "Bilibili - Chrome", "bilibili.com"), ("wechat.exe", "微信", ""),
+            ("notepad.exe", "notes.txt - 记事本", ""), ("explorer.exe", "下载", "")]
+    timeline = [(0.0, "window", (apps[0][1], apps[0][0], apps[0][2]))]
+    t = 8 * 3600.0
+    timeline.append((1.0, "suspend", t - 1))
+    for day in range(days):
+        day_end = (day + 1) * 86400 + (1800 if rng.random() < 0.2 else -1800)
+        while t < day_end:
+            process, title, url = rng.choice(apps)
+            timeline.append((t, "window", (title, process, url)))
+            segment_end = t + rng.expovariate(1 / 480)
+            while t < segment_end:
+                t += rng.uniform(5, 40)
+                timeline.append((t, "input", rng.randrange(1, 10)))
+                if rng.random() < 0.02:
+                    # 短暂切换到别的窗口又切回来（防抖应丢弃）
+                    other = rng.choice(apps)
+                    timeline.append((t + 1, "window", (other[1], other[0], other[2])))
+                    t += rng.uniform(3, 20)
+                    timeline.append((t, "window", (title, process, url)))
+            if rng.random() < 0.08:
+                t += rng.uniform(360, 1800)  # 离开电脑，触发空闲
+        wake = (day + 1) * 86400 + 8 * 3600 + rng.uniform(0, 3600)
+        timeline.append((t + 1, "suspend", wake - t - 1))
+        t = wake
+    return timeline
+
+
+class RecordingAI:
+    """回放基准用的分类提交端：只计数，不保存、不请求"""
+    on_request_done = None
+
+    def __init__(self):
+        self.batches = 0
+        self.lines = 0
+        self.local = 0
+
+    def process_logs_async(self, log_lines, on_done=None, recovered=False):
+        self.batches += 1
+        self.lines += len(log_lines)
+        if on_done:
+            on_done()
+
+    def save_local(self, log_line, date_str, row):
+        self.local += 1
+
+    def shutdown(self, timeout=None):
+        pass
+
+
+def bench_replay(sizes):
+    """SmartTracker 完整回放：防抖 / 空闲 / 睡眠 / 跨天逻辑（虚拟时钟，快于实时）"""
+    from collections import Counter
+    import desktop
+    import tracker
+    import journal
+    import metrics
+
+    events = Counter()
+    common.log = lambda msg, level="INFO": events.update([msg.split(":")[0].split(" (")[0]])
+    tmp = tempfile.mkdtemp(dir=common.LOG_DIR)
+    start = datetime(2024, 1, 1).timestamp()
+    print(f"{'days':>5} {'entries':>9} {'records':>8} {'switch':>7} {'skip':>6} {'idle':>5} "
+          f"{'sleep':>6} {'split':>6} {'batches':>8} {'wall(s)':>8} {'speedup':>9}")
+    for days in sizes:
+        events.clear()
+        timeline = make_usage_timeline(days)
+        backend = desktop.ReplayBackend(timeline, start_time=start)
+        ai = RecordingAI()
+        t0 = time.perf_counter()
+        wal = journal.LogJournal(os.path.join(tmp, f"journal_{days}.log"), fsync_interval=-1)
+        tracker.SmartTracker(backend=backend, ai=ai, journal=wal, metrics=metrics.MetricsRegistry()).run()
+        wall = time.perf_counter() - t0
+        print(f"{days:>5} {len(timeline):>9} {events['Record']:>8} {events['Switch']:>7} "
+              f"{events['Skip short switch']:>6} {events['Idle start']:>5} {events['Sleep detected']:>6} "
+              f"{events['Day split']:>6} {ai.batches:>8} {wall:>8.2f} {days * 86400 / wall:>8.0f}x")
+
+
+class SimulatedURLProbe:
+    """模拟 UIA 地址栏探测：树搜索 150~400ms；cache_controls 时同一窗口之后读值约 3ms"""
+
+    def __init__(self, cache_controls=True, seed=0):
+        self.rng = random.Random(seed)
+        self.cache_controls = cache_controls
+        self.known = set()
+        self.searches = 0
+        self.cached_reads = 0
+
+    def thread_context(self):
+        import contextlib
+        return contextlib.nullcontext()
+
+    def read(self, hwnd, process_name):
+        if self.cache_controls and hwnd in self.known:
+            self.cached_reads += 1
+            time.sleep(0.003)
+        else:
+            self.searches += 1
+            time.sleep(self.rng.uniform(0.15, 0.4))
+            self.known.add(hwnd)
+        return f"https://example.com/{hwnd}"
+
+
+def bench_url(sizes):
+    """浏览器 URL：主线程同步树搜索 vs 后台探测 + 按窗口缓存（6 个窗口，标题变化 + 重复查询）"""
+    import desktop
+
+    print(f"{'events':>7} {'mode':>6} {'main-thread(s)':>15} {'p50(ms)':>8} {'p90(ms)':>8} "
+          f"{'p99(ms)':>8} {'hit%':>6} {'searches':>9}")
+    for n in sizes:
+        rng = random.Random(n)
+        lookups = []
+        titles = {}
+        for _ in range(n):
+            hwnd = rng.randrange(1, 7)
+            if rng.random() < 0.5:
+                titles[hwnd] = f"page {rng.randrange(1000)}"
+            lookups.append((hwnd, titles.setdefault(hwnd, "start")))
+
+        # 现有实现：每次都在主线程做树搜索
+        probe = SimulatedURLProbe(cache_controls=False)
+        latencies = []
+        for hwnd, title in lookups:
+            t0 = time.perf_counter()
+            probe.read(hwnd, "chrome.exe")
+            latencies.append(time.perf_counter() - t0)
+        latencies.sort()
+        pct = lambda p: latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+        print(f"{n:>7} {'sync':>6} {sum(latencies):>15.2f} {pct(0.5):>8.1f} {pct(0.9):>8.1f} "
+              f"{pct(0.99):>8.1f} {0:>6.0f} {probe.searches:>9}")
+
+        results = []
+        prober = desktop.BrowserURLProber(SimulatedURLProbe(), on_result=results.append)
+        main_thread = 0.0
+        for hwnd, title in lookups:
+            t0 = time.perf_counter()
+            prober.lookup(time.time(), hwnd, "chrome.exe", title)
+            main_thread += time.perf_counter() - t0
+            time.sleep(0.05)
+        prober.stop()
+        stats = prober.get_stats()
+        print(f"{n:>7} {'async':>6} {main_thread:>15.4f} {stats['p50_ms']:>8.1f} {stats['p90_ms']:>8.1f} "
+              f"{stats['p99_ms']:>8.1f} {stats['hit_ratio'] * 100:>6.0f} {stats['searches']:>9}")
+
+
+def bench_proc(sizes):
+    """进程名缓存：PID 复用下的正确性与内存（旧版按 pid 的无界 dict vs (pid, 创建时间) LRU）"""
+    import os
+    import psutil
+    import desktop
+
+    cache = desktop.ProcessNameCache()
+    t0 = time.perf_counter()
+    warmed = cache.warm()
+    print(f"warm: {warmed} processes in {(time.perf_counter() - t0) * 1000:.1f} ms")
+    pids = [p.pid for p in psutil.process_iter()]
+    t_raw, _ = timed(lambda: [psutil.Process(pid).name() for pid in pids], repeat=3)
+    t_hit, _ = timed(lambda: [cache.get(pid) for pid in pids], repeat=3)
+    print(f"lookup: uncached {t_raw / len(pids) * 1e6:.1f} us, cached {t_hit / len(pids) * 1e6:.1f} us, "
+          f"own pid -> {cache.get(os.getpid())}")
+
+    # 模拟长时间运行：进程不断创建退出，PID 在 1~32768 内循环复用
+    print(f"{'spawns':>9} {'old-size':>9} {'old-KB':>8} {'old-stale':>10} {'new-size':>9} {'new-KB':>8} {'reused':>7}")
+    for n in sizes:
+        rng = random.Random(n)
+        old = {}
+        cache = desktop.ProcessNameCache()
+        stale = 0
+        names = [f"app{i}.exe" for i in range(200)]
+        for i in range(n):
+            pid = rng.randrange(1, 32768)
+            name = rng.choice(names)
+            if pid in old and old[pid] != name:
+                stale += 1  # 旧实现会返回之前那个进程的名字
+            old.setdefault(pid, name)
+            cache.put(pid, float(i), name)
+        old_bytes = sys.getsizeof(old) + sum(sys.getsizeof(k) for k in old) + \
+            sum(sys.getsizeof(v) for v in set(old.values()))
+        stats = cache.get_stats()
+        print(f"{n:>9} {len(old):>9} {old_bytes / 1024:>8.1f} {stale:>10} {stats['size']:>9} "
+              f"{stats['approx_kb']:>8.1f} {stats['pid_reused']:>7}")
+
+
+class LegacyInputCounter:
+    """旧版 InputMonitor 的计数路径（每个事件加锁 + time.time()），仅作对照"""
+
+    def __init__(self):
+        self.click_count = 0
+        self.key_count = 0
+        self.lock = threading.Lock()
+        self.last_activity_time = time.time()
+
+    def _on_move(self, x, y):
+        with self.lock:
+            self.last_activity_time = time.time()
+
+    def _on_key(self, key):
+        with self.lock:
+            self.key_count += 1
+            self.last_activity_time = time.time()
+
+
+class _ListenerOnlyBackend:
+    def __init__(self):
+        import desktop
+        self.clock = desktop.SystemClock()
+
+    def start_input(self, on_click, on_move, on_key):
+        pass
+
+
+def bench_input(sizes):
+    """输入监听线程 CPU：每事件加锁 vs 无锁 + 移动采样（鼠标移动洪泛，每 10 次移动 1 次按键）"""
+    import tracker
+
+    def flood(monitor, n):
+        def run():
+            cpu0 = time.thread_time()
+            for i in range(n):
+                monitor._on_move(i, i)
+                if i % 10 == 0:
+                    monitor._on_key(None)
+            result.append(time.thread_time() - cpu0)
+        result = []
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return result[0]
+
+    class NoOp:
+        def _on_move(self, x, y):
+            pass
+
+        def _on_key(self, key):
+            pass
+
+    print(f"{'events':>9} {'legacy cpu(s)':>14} {'new cpu(s)':>11} {'handler ns/event':>17} {'active s':>9}")
+    for n in sizes:
+        base = flood(NoOp(), n)
+        t_old = flood(LegacyInputCounter(), n)
+        monitor = tracker.InputMonitor(_ListenerOnlyBackend())
+        t0 = time.time()
+        t_new = flood(monitor, n)
+        stats = monitor.segment_stats(t0, time.time() + 1)
+        # 扣除循环与空函数调用本身的开销，只比较事件处理代价
+        per_event = n * 1.1 / 1e9
+        print(f"{n:>9} {t_old:>14.3f} {t_new:>11.3f} {(t_old - base) / per_event:>8.0f} -> {(t_new - base) / per_event:<6.0f} "
+              f"{stats.active_seconds:>9}")
+
+
+def legacy_log(path, msg):
+    """旧版 common.log：每条日志 ensure_dirs + 打开/追加/关闭文件 + print"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    line = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}"
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line + "\n")
+    print(line)
+
+
+def bench_log(sizes):
+    """运行日志：每条同步写文件 vs 后台批量写入（调用方耗时，终端输出重定向到空设备）"""
+    import io
+    import contextlib
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'calls':>9} {'legacy/s':>11} {'buffered/s':>11} {'flush ms':>9} {'lines':>8}")
+        for n in sizes:
+            sink = io.StringIO()
+            legacy_path = os.path.join(tmp, f"legacy_{n}.log")
+            with contextlib.redirect_stdout(sink):
+                t_old, _ = timed(lambda: [legacy_log(legacy_path, f"event {i}") for i in range(n)])
+                logger = common.RuntimeLogger(path=os.path.join(tmp, f"runtime_{n}.log"),
+                                              max_bytes=1 << 30, echo=False)
+                t_new, _ = timed(lambda: [logger.log(f"event {i}") for i in range(n)])
+                t_flush, _ = timed(logger.flush)
+                logger.close()
+            with open(logger.path, encoding='utf-8') as f:
+                lines = sum(1 for _ in f)
+            print(f"{n:>9} {n / t_old:>11.0f} {n / t_new:>11.0f} {t_flush * 1000:>9.1f} {lines:>8}")
+
+        # 轮转：64KB 上限，保留 3 个压缩备份
+        logger = common.RuntimeLogger(path=os.path.join(tmp, "rotate", "runtime.log"),
+                                      max_bytes=64 * 1024, backup_count=3, batch_size=500, echo=False)
+        for i in range(max(sizes)):
+            logger.log(f"rotating event {i} " + "x" * 40)
+        logger.close()
+        files = sorted(os.listdir(os.path.dirname(logger.path)))
+        total = sum(os.path.getsize(os.path.join(os.path.dirname(logger.path), f)) for f in files)
+        print(f"rotation: {len(files)} files ({', '.join(f.rsplit('.', 2)[-1] if f.endswith('.gz') else f for f in files)}), "
+              f"{total / 1024:.1f} KB on disk")
+
+
+def bench_journal(sizes):
+    """日志缓冲预写日志：不同 fsync 策略下每行追加耗时，以及模拟崩溃后的重放"""
+    import journal
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'lines':>7} {'fsync':>8} {'us/line':>8} {'fsyncs':>7} {'recovered':>10} {'expected':>9} {'reopen ms':>10}")
+        for n in sizes:
+            for interval, label in ((-1, "off"), (1.0, "1s"), (0, "always")):
+                path = os.path.join(tmp, f"journal_{n}_{label}.log")
+                wal = journal.LogJournal(path, fsync_interval=interval)
+                expected = 0
+                t0 = time.perf_counter()
+                for i in range(n):
+                    wal.append(f"[2024-01-01 10:00:00 - 2024-01-01 10:01:00] <app{i % 7}.exe> [活跃度:中] title {i}")
+                    if i % 10 == 9:
+                        batch = wal.take_batch()
+                        # 每 3 个批次有 1 个在崩溃前还没处理完
+                        if i % 30 == 29:
+                            expected += 10
+                        else:
+                            wal.ack(batch)
+                elapsed = time.perf_counter() - t0
+                expected += n % 10
+                fsyncs = wal.get_stats()["fsyncs"]
+                # 模拟进程被强制结束：不调用 close，直接重新打开
+                wal.closed.set()
+                t0 = time.perf_counter()
+                reopened = journal.LogJournal(path, fsync_interval=-1)
+                reopen = time.perf_counter() - t0
+                print(f"{n:>7} {label:>8} {elapsed / n * 1e6:>8.1f} {fsyncs:>7} {len(reopened.recovered):>10} "
+                      f"{expected:>9} {reopen * 1000:>10.1f}")
+                reopened.close()
+
+
+def make_csv_dir(path, days, seed=0):
+    """生成多年的每日 CSV：约 1/4 为 GBK 编码、含坏行和未加引号逗号的旧文件"""
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    for day in range(days):
+        date_str = f"{2020 + day // 336}-{1 + day // 28 % 12:02d}-{1 + day % 28:02d}"
+        rows = [[f"{h:02d}:{m:02d}:00", f"{h:02d}:{m:02d}:50", rng.choice(["开发", "学习", "社交"]),
+                 f"task, detail {rng.randrange(1000)}"] for h in range(8, 20) for m in range(0, 60, 2)]
+        file_path = os.path.join(path, f"{date_str}.csv")
+        if day % 4:
+            with open(file_path, "w", encoding="utf-8-sig", newline="") as f:
+                csv.writer(f).writerows([["开始时间", "结束时间", "任务分类", "任务详情"]] + rows)
+        else:
+            with open(file_path, "w", encoding="gbk", newline="") as f:
+                f.write("开始时间,结束时间,任务分类,任务详情\n")
+                f.writelines(",".join(row) + "\n" for row in rows)
+                f.write("garbage line\n")
+
+
+def legacy_fix_dir(path):
+    """旧版 fix_csv.main 的处理方式：整目录备份，逐个文件多编码 readlines 后原地重写"""
+    import fix_csv
+
+    backup = os.path.join(path, "backup_before_fix")
+    os.makedirs(backup, exist_ok=True)
+    names = sorted(f for f in os.listdir(path) if f.endswith(".csv"))
+    for name in names:
+        shutil.copy2(os.path.join(path, name), os.path.join(backup, name))
+    for name in names:
+        file_path = os.path.join(path, name)
+        content = None
+        for encoding in ["utf-8-sig", "utf-8", "gbk", "gb2312"]:
+            try:
+                with open(file_path, "r", encoding=encoding) as f:
+                    content = f.readlines()
+                break
+            except Exception:
+                continue
+        rows = [r for r in (fix_csv.clean_csv_line(l) for l in content[1:])
+                if r and fix_csv.is_valid_time(r[0]) and fix_csv.is_valid_time(r[1])]
+        with open(file_path, "w", encoding="utf-8-sig", newline="") as f:
+            csv.writer(f).writerows([fix_csv.HEADER] + rows)
+
+
+def dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def bench_fixcsv(sizes):
+    """CSV 修复：串行整文件读取 + 全量备份 vs 流式 + 进程池 + 哈希跳过（首次 / 再次运行）"""
+    import fix_csv
+
+    print(f"{'days':>6} {'data MB':>8} {'legacy(s)':>10} {'+backup MB':>11} {'new(s)':>7} {'+backup MB':>11} "
+          f"{'rerun(s)':>9} {'dry-run(s)':>11}")
+    for days in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "src")
+            make_csv_dir(src, days)
+            size = dir_bytes(src)
+            old_dir, new_dir = os.path.join(tmp, "old"), os.path.join(tmp, "new")
+            shutil.copytree(src, old_dir)
+            shutil.copytree(src, new_dir)
+            t_old, _ = timed(legacy_fix_dir, old_dir)
+            t_dry, _ = timed(lambda: fix_csv.repair_directory(new_dir, dry_run=True))
+            t_new, _ = timed(lambda: fix_csv.repair_directory(new_dir))
+            t_rerun, _ = timed(lambda: fix_csv.repair_directory(new_dir))
+            print(f"{days:>6} {size / 1e6:>8.1f} {t_old:>10.2f} {(dir_bytes(old_dir) - size) / 1e6:>11.1f} "
+                  f"{t_new:>7.2f} {(dir_bytes(new_dir) - size) / 1e6:>11.1f} {t_rerun:>9.3f} {t_dry:>11.2f}")
+
+
+def make_raw_days(raw_dir, days, lines_per_day=200, seed=0):
+    """生成原始日志：每天约 30 种活动反复出现，约 10% 为完全重复的行（重放/重复保存）"""
+    rng = random.Random(seed)
+    os.makedirs(raw_dir, exist_ok=True)
+    activities = [("code.exe", "", f"module{i % 12}.py - Visual Studio Code") for i in range(12)] + \
+        [("chrome.exe", f"https://site{i}.com/page", f"Site {i} article - Google Chrome") for i in range(14)] + \
+        [("wechat.exe", "", "微信"), ("notepad.exe", "", "notes.txt - 记事本"),
+         ("vlc.exe", "", "movie.mkv - VLC"), ("acrobat.exe", "", "paper.pdf - Adobe Acrobat")]
+    dates = []
+    for day in range(days):
+        date_str = (datetime(2024, 1, 1) + timedelta(days=day)).strftime("%Y-%m-%d")
+        dates.append(date_str)
+        lines = []
+        t = 8 * 3600
+        for _ in range(lines_per_day):
+            process, url, title = rng.choice(activities)
+            end = t + rng.randrange(30, 200)
+            url_part = f"[URL: {url}]" if url else ""
+            line = (f"[{date_str} {t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d} - "
+                    f"{date_str} {end // 3600:02d}:{end // 60 % 60:02d}:{end % 60:02d}] "
+                    f"<{process}> [活跃度:中 20/60s] {url_part} {title}")
+            lines.append(line)
+            if rng.random() < 0.1:
+                lines.append(line)
+            t = end + 1
+        with open(os.path.join(raw_dir, f"{date_str}_raw.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    return dates
+
+
+def bench_reclassify(sizes):
+    """历史重分类：逐批 50 行串行请求 vs 去重 + token 装箱 + 并发 4（每请求 100ms + 每行 2ms），含断点续跑"""
+    import ai_engine
+    import storage
+    import classifier
+    import reclassify
+
+    server = StubChatServer(latency=0.1, row_latency=0.002)
+    prompt = reclassify.PROMPT_PREFIX
+    print(f"{'days':>5} {'lines':>7} {'naive req':>10} {'naive s':>8} {'new req':>8} {'new s':>6} "
+          f"{'tokens':>15} {'rows ok':>8} {'resume s':>9}")
+    try:
+        for days in sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                common.RAW_LOG_DIR = os.path.join(tmp, "raw")
+                dates = make_raw_days(common.RAW_LOG_DIR, days)
+                store = storage.SQLiteStore(os.path.join(tmp, "t.db"))
+                engine = ai_engine.AsyncAIEngine("stub", server.base_url, "stub", max_concurrency=4)
+
+                # 对照：与 tracker 相同的做法，每 50 行一个请求，逐个串行
+                naive_requests = 0
+                naive_tokens = 0
+                t0 = time.perf_counter()
+                for date_str in dates:
+                    lines = classifier.read_raw_lines(date_str)
+                    for i in range(0, len(lines), 50):
+                        content = prompt + "\n".join(lines[i:i + 50])
+                        naive_tokens += reclassify.tracker.AdaptiveBatcher.estimate_tokens(content) + 400
+                        engine.complete([{"role": "user", "content": content}])
+                        naive_requests += 1
+                t_naive = time.perf_counter() - t0
+
+                out = []
+                state_path = os.path.join(tmp, "state.json")
+                worker = reclassify.Reclassifier(engine, store, "stub", state_path=state_path, out=out.append,
+                                                 max_lines=50)
+                start = datetime.strptime(dates[0], "%Y-%m-%d").date()
+                end = datetime.strptime(dates[-1], "%Y-%m-%d").date()
+                dry = reclassify.Reclassifier(None, store, "stub", state_path=state_path, out=out.append,
+                                              max_lines=50).run(start, end, dry_run=True)
+                t0 = time.perf_counter()
+                totals = worker.run(start, end)
+                t_new = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                resumed = worker.run(start, end)
+                t_resume = time.perf_counter() - t0
+                stored = sum(len(store.read_rows(d)) for d in dates)
+                engine.shutdown()
+                print(f"{days:>5} {totals['lines']:>7} {naive_requests:>10} {t_naive:>8.2f} {totals['requests']:>8} "
+                      f"{t_new:>6.2f} {naive_tokens:>7}->{dry['tokens']:<7} {stored == totals['lines']!s:>8} "
+                      f"{t_resume:>9.3f}")
+                assert resumed["days"] == 0
+    finally:
+        server.close()
+
+
+def make_range_frame(days, per_day=400, seed=0):
+    """仪表盘格式的多日记录：每天 8 点起约 400 条连续片段，7 个分类"""
+    rng = random.Random(seed)
+    rows = []
+    for day in range(days):
+        t = pd.Timestamp("2024-01-01") + pd.Timedelta(days=day, hours=8)
+        for i in range(per_day):
+            d = pd.Timedelta(seconds=rng.randrange(20, 300))
+            rows.append((t, t + d, rng.choice(["开发", "AI", "学习", "办公", "社交", "娱乐", "系统"]),
+                         f"detail {i}", str(t.date())))
+            t = t + d + pd.Timedelta(seconds=rng.randrange(0, 30))
+    df = pd.DataFrame(rows, columns=["Start_DT", "End_DT", "任务分类", "任务详情", "日期"])
+    df["Duration_Min"] = (df["End_DT"] - df["Start_DT"]).dt.total_seconds() / 60
+    return df
+
+
+def bench_timeline(sizes):
+    """时间轴：全部明细 vs 按可见范围分级合并（图表 JSON 大小与构建 + 序列化耗时）"""
+    import plotly.express as px
+
+    def render(frame, hover):
+        fig = px.timeline(frame, x_start="Start_DT", x_end="End_DT", y="任务分类", color="任务分类",
+                          hover_data=hover)
+        return len(fig.to_json())
+
+    print(f"{'days':>5} {'rows':>7} {'full bars':>10} {'full KB':>9} {'full ms':>8} "
+          f"{'lod bars':>9} {'lod KB':>7} {'lod ms':>7} {'zoom 1d bars':>13}")
+    for days in sizes:
+        df = make_range_frame(days)
+        t_full, full_bytes = timed(render, df, ["日期", "任务详情", "Duration_Min"])
+
+        def lod():
+            frame, resolution = analysis.downsample_timeline(df)
+            hover = ["日期", "任务详情", "Duration_Min"] + (["记录数"] if resolution else [])
+            return len(frame), render(frame, hover)
+
+        t_lod, (bars, lod_bytes) = timed(lod)
+        mid = df["Start_DT"].iloc[len(df) // 2].normalize()
+        zoomed, _ = analysis.downsample_timeline(df, mid, mid + pd.Timedelta(days=1))
+        print(f"{days:>5} {len(df):>7} {len(df):>10} {full_bytes / 1024:>9.0f} {t_full * 1000:>8.0f} "
+              f"{bars:>9} {lod_bytes / 1024:>7.0f} {t_lod * 1000:>7.0f} {len(zoomed):>13}")
+
+
+def bench_edit(sizes):
+    """明细保存：按日期整天重写已过滤的编辑结果 vs 行级 diff 只写改动行（改一页中的 5 行）"""
+    import storage
+
+    def range_rows(days):
+        frame = make_range_frame(days, per_day=400)
+        rows = {}
+        for day, start, end, category, detail in zip(frame["日期"], frame["Start_DT"], frame["End_DT"],
+                                                     frame["任务分类"], frame["任务详情"]):
+            rows.setdefault(day, []).append([start.strftime("%H:%M:%S"), end.strftime("%H:%M:%S"),
+                                             category, detail])
+        return rows
+
+    def edit_page(page):
+        edited = page[analysis.EDIT_COLUMNS].copy()
+        for index in page.index[::40][:5]:
+            edited.loc[index, "任务分类"] = "学习"
+        return edited
+
+    print(f"{'store':>6} {'days':>5} {'rows':>7} {'legacy(s)':>10} {'lost rows':>10} {'diff(s)':>8} "
+          f"{'days written':>13} {'lost rows':>10}")
+    for days in sizes:
+        rows = range_rows(days)
+        for name in ["csv", "sqlite"]:
+            results = []
+            for legacy in [True, False]:
+                with tempfile.TemporaryDirectory() as tmp:
+                    store = (storage.CSVStore(tmp) if name == "csv"
+                             else storage.SQLiteStore(os.path.join(tmp, "bench.db")))
+                    for day, day_rows in rows.items():
+                        store.replace_rows(day, day_rows)
+                    if name == "sqlite":
+                        frame = analysis.frame_from_columns(*store.read_range(min(rows), max(rows)))
+                    else:
+                        frame = pd.concat([analysis.process_dataframe(
+                            pd.DataFrame(store.read_rows(day), columns=storage.HEADER), day) for day in rows],
+                            ignore_index=True)
+                    # 分类筛选去掉「娱乐」，用户在第一页改了几条分类
+                    filtered = frame[frame["任务分类"] != "娱乐"]
+                    if legacy:
+                        edited = filtered[analysis.EDIT_COLUMNS].copy()
+                        edited.update(edit_page(filtered.iloc[:200]))
+
+                        def save():
+                            for day, group in edited.groupby("日期"):
+                                store.replace_rows(day, group[analysis.EDIT_COLUMNS[1:]].values.tolist())
+                            return len(rows)
+                    else:
+                        page = filtered.iloc[:200]
+
+                        def save():
+                            changes, _ = analysis.diff_edits(page, edit_page(page))
+                            for day, (deleted, inserted) in changes.items():
+                                store.apply_changes(day, deleted, inserted)
+                            return len(changes)
+
+                    elapsed, written = timed(save)
+                    lost = len(frame) - sum(len(store.read_rows(day)) for day in rows)
+                    results.append((elapsed, written, lost))
+            (t_old, _, lost_old), (t_new, written, lost_new) = results
+            print(f"{name:>6} {days:>5} {len(frame):>7} {t_old:>10.3f} {lost_old:>10} {t_new:>8.3f} "
+                  f"{written:>13} {lost_new:>10}")
+
+
+def bench_live(sizes):
+    """新记录到达仪表盘：重读存储（轮询 / 刷新）vs 推送增量合并进已缓存的明细（4 个订阅端）"""
+    import statistics
+    import storage
+    import live
+
+    subscribers_count = 4
+    print(f"{'days':>5} {'rows':>7} {'reload ms':>10} {'poll lag s':>11} {'push p50 ms':>12} "
+          f"{'push p99 ms':>12} {'publish us':>11} {'merge ms':>9}")
+    for days in sizes:
+        frame = make_range_frame(days)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = storage.SQLiteStore(os.path.join(tmp, "bench.db"))
+            for day, group in frame.groupby("日期"):
+                store.replace_rows(day, [[s.strftime("%H:%M:%S"), e.strftime("%H:%M:%S"), c, d] for s, e, c, d in
+                                         zip(group["Start_DT"], group["End_DT"], group["任务分类"], group["任务详情"])])
+            first, last = min(frame["日期"]), max(frame["日期"])
+
+            # 轮询：每次有新记录，版本号变化后整段范围重新读取组装（缓存 ttl=30 时平均滞后 15 秒）
+            def reload():
+                return analysis.frame_from_columns(*store.read_range(first, last))
+
+            t_reload, cached = timed(reload, repeat=5)
+
+            publisher = live.LivePublisher(port=0)
+            subscribers = [live.LiveSubscriber(port=publisher.port, token=publisher.token, retry=0.1)
+                           for _ in range(subscribers_count)]
+            while not all(sub.connected for sub in subscribers):
+                time.sleep(0.01)
+            latencies, publish_cost = [], []
+            t = pd.Timestamp(last) + pd.Timedelta(hours=20)
+            for i in range(200):
+                row = [t.strftime("%H:%M:%S"), (t + pd.Timedelta(seconds=50)).strftime("%H:%M:%S"), "开发", f"live {i}"]
+                t += pd.Timedelta(minutes=1)
+                t0 = time.perf_counter()
+                publisher.publish_rows(last, [row])
+                publish_cost.append(time.perf_counter() - t0)
+                for sub in subscribers:
+                    sub.wait(i, 2)
+                latencies.append(time.perf_counter() - t0)
+            generation, _ = subscribers[0].position()
+            rows = subscribers[0].rows_since(generation, 190)
+            t_merge, (merged, _) = timed(analysis.merge_live_rows, cached, rows, first, last, repeat=5)
+            assert len(merged) == len(cached) + 10
+            for sub in subscribers:
+                sub.close()
+            publisher.close()
+
+        latencies.sort()
+        print(f"{days:>5} {len(cached):>7} {t_reload * 1000:>10.1f} {15:>11} "
+              f"{latencies[len(latencies) // 2] * 1000:>12.2f} {latencies[int(len(latencies) * 0.99)] * 1000:>12.2f} "
+              f"{statistics.mean(publish_cost) * 1e6:>11.0f} {t_merge * 1000:>9.1f}")
+
+
+class PickleCache:
+    """模拟 st.cache_data：按键只计算一次（键级锁），命中时返回反序列化出的新副本"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.values = {}
+
+    def get(self, key, func):
+        import pickle
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self.values:
+                self.values[key] = pickle.dumps(func())
+        return pickle.loads(self.values[key])
+
+
+class LegacyDashboard:
+    """改造前的 webui 取数流程：每个会话每次重跑各自取一份缓存副本，CSV 每天重新组装"""
+
+    def __init__(self, store):
+        self.store = store
+        self.cache = PickleCache()
+
+    def rerun(self, start_str, end_str, hidden):
+        import query
+        store = self.store
+        revision = store.range_revision(start_str, end_str)
+        if store.name != "csv":
+            df = self.cache.get(("range", start_str, end_str, revision),
+                                lambda: analysis.frame_from_columns(*store.read_range(start_str, end_str)))
+        else:
+            frames = []
+            for day in pd.date_range(start_str, end_str).strftime("%Y-%m-%d"):
+                path = store.day_path(day)
+                if not os.path.exists(path):
+                    continue
+                stat = os.stat(path)
+                raw = self.cache.get(("csv", path, stat.st_mtime_ns, stat.st_size),
+                                     lambda: query.read_csv_day(path))
+                frame = analysis.process_dataframe(raw, day)
+                if frame is not None:
+                    frames.append(frame)
+            df = pd.concat(frames, ignore_index=True)
+        rollup = self.cache.get(("rollup", start_str, end_str, revision), lambda: pd.DataFrame(
+            store.read_rollup(start_str, end_str), columns=["日期", "分类", "分钟"]))
+        hourly = self.cache.get(("hourly", start_str, end_str, revision), lambda: pd.DataFrame(
+            store.read_hourly_rollup(start_str, end_str), columns=["日期", "小时", "分类", "分钟"]))
+        selected = [c for c in sorted(df["任务分类"].unique()) if c != hidden]
+        filtered = df[df["任务分类"].isin(selected)]
+        totals = rollup[rollup["分类"].isin(selected)].groupby("分类")["分钟"].sum().to_dict()
+        return filtered, totals, hourly[hourly["分类"].isin(selected)]
+
+
+def bench_query(sizes):
+    """N 个会话并发重跑仪表盘（30 天范围 + 分类筛选 + 汇总）：各会话独立取缓存副本 vs 共享查询服务"""
+    import tracemalloc
+    import storage
+    import query
+
+    days, reruns = 30, 10
+    frame = make_range_frame(days)
+    start_str, end_str = min(frame["日期"]), max(frame["日期"])
+
+    def legacy(store):
+        dashboard = LegacyDashboard(store)
+        return lambda hidden: dashboard.rerun(start_str, end_str, hidden)
+
+    def shared(store):
+        service = query.QueryService(store)
+
+        def rerun(hidden):
+            data = service.range(start_str, end_str)
+            data = service.select(data, [c for c in data.categories if c != hidden])
+            return data.frame, service.totals(data), data.hourly
+        return rerun
+
+    def sessions(count, rerun, repeat, keep=False):
+        """count 个线程同时开始，每个重跑 repeat 次；keep 时保留结果（模拟各会话同时持有）；返回墙钟时间"""
+        barrier = threading.Barrier(count)
+        kept = []
+
+        def session():
+            barrier.wait()
+            for _ in range(repeat):
+                result = rerun("娱乐")
+                if keep:
+                    kept.append(result)
+
+        threads = [threading.Thread(target=session) for _ in range(count)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - t0
+
+    print(f"{'store':>6} {'sessions':>9} {'legacy cold s':>14} {'legacy rerun/s':>15} {'legacy MB':>10} "
+          f"{'shared cold s':>14} {'shared rerun/s':>15} {'shared MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = [storage.CSVStore(os.path.join(tmp, "csv")), storage.SQLiteStore(os.path.join(tmp, "bench.db"))]
+        os.makedirs(stores[0].log_dir)
+        for store in stores:
+            for day, group in frame.groupby("日期"):
+                store.replace_rows(day, [[s.strftime("%H:%M:%S"), e.strftime("%H:%M:%S"), c, d] for s, e, c, d in
+                                         zip(group["Start_DT"], group["End_DT"], group["任务分类"], group["任务详情"])])
+
+        for store in stores:
+            for count in sizes:
+                results = []
+                for make in [legacy, shared]:
+                    # 冷启动：所有会话同时打开页面
+                    rerun = make(store)
+                    cold = sessions(count, rerun, 1)
+                    warm = sessions(count, rerun, reruns)
+                    # 内存：所有会话各完成一次重跑并同时持有结果时的峰值（含缓存本身）
+                    rerun = make(store)
+                    tracemalloc.start()
+                    sessions(count, rerun, 1, keep=True)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    results.append((cold, count * reruns / warm, peak / 1e6))
+                (l_cold, l_qps, l_mb), (s_cold, s_qps, s_mb) = results
+                print(f"{store.name:>6} {count:>9} {l_cold:>14.2f} {l_qps:>15.1f} {l_mb:>10.1f} "
+                      f"{s_cold:>14.2f} {s_qps:>15.1f} {s_mb:>10.1f}")
+
+
+def bench_metrics(sizes):
+    """运行指标开销：单次记录耗时、导出耗时，以及回放时主循环在采样分析开启前后的速度"""
+    import desktop
+    import tracker
+    import journal
+    import metrics
+
+    common.log = lambda msg, level="INFO": None
+    registry = metrics.MetricsRegistry()
+    registry.histogram("h", "bench")
+    registry.counter("c", "bench")
+    n = 200_000
+    t_observe, _ = timed(lambda: [registry.observe("h", 0.001) for _ in range(n)])
+    t_inc, _ = timed(lambda: [registry.inc("c", 100, day="2024-01-01", target="raw") for _ in range(n)])
+    print(f"observe {t_observe / n * 1e9:.0f} ns/op, labelled inc {t_inc / n * 1e9:.0f} ns/op")
+
+    tmp = tempfile.mkdtemp(dir=common.LOG_DIR)
+    start = datetime(2024, 1, 1).timestamp()
+    print(f"{'days':>5} {'ticks':>7} {'replay s':>9} {'profiled s':>11} {'samples':>8} "
+          f"{'prom ms':>8} {'json ms':>8} {'tick p99 us':>12}")
+    for days in sizes:
+        timeline = make_usage_timeline(days)
+        walls = []
+        for profile in (False, True):
+            backend = desktop.ReplayBackend(timeline, start_time=start)
+            wal = journal.LogJournal(os.path.join(tmp, f"journal_{days}_{profile}.log"), fsync_interval=-1)
+            registry = metrics.MetricsRegistry()
+            metrics.process_collector(registry)
+            app = tracker.SmartTracker(backend=backend, ai=RecordingAI(), journal=wal, metrics=registry)
+            profiler = metrics.SamplingProfiler(interval=0.01)
+            if profile:
+                profiler.start()
+            t0 = time.perf_counter()
+            app.run()
+            walls.append(time.perf_counter() - t0)
+            if profile:
+                profiler.stop_event.set()
+                profiler.thread.join()
+                samples = profiler.samples
+        t_prom, _ = timed(registry.render_prometheus, repeat=20)
+        t_json, _ = timed(registry.snapshot, repeat=20)
+        tick = registry.histograms["tracker_loop_tick_seconds"].snapshot()
+        print(f"{days:>5} {tick['count']:>7} {walls[0]:>9.2f} {walls[1]:>11.2f} {samples:>8} "
+              f"{t_prom * 1000:>8.2f} {t_json * 1000:>8.2f} {tick['p99_ms'] * 1000:>12.0f}")
+
+
+BENCHMARKS = {
+    "parse": (bench_parse, [10_000, 100_000, 1_000_000]),
+    "ai": (bench_ai, [50, 200]),
+    "stream": (bench_stream, [5, 20, 50]),
+    "window": (bench_window, [30, 60]),
+    "replay": (bench_replay, [7, 30, 90]),
+    "url": (bench_url, [20, 100]),
+    "proc": (bench_proc, [10_000, 100_000, 1_000_000]),
+    "input": (bench_input, [100_000, 1_000_000]),
+    "log": (bench_log, [10_000, 100_000]),
+    "journal": (bench_journal, [1_000, 10_000]),
+    "fixcsv": (bench_fixcsv, [365, 1095]),
+    "reclassify": (bench_reclassify, [7, 30]),
+    "timeline": (bench_timeline, [1, 7, 90]),
+    "edit": (bench_edit, [7, 90]),
+    "live": (bench_live, [1, 7, 30]),
+    "query": (bench_query, [1, 4, 16]),
+    "metrics": (bench_metrics, [7, 30]),
+}
+
+
+def use_temp_dirs(tmp):
+    """数据目录、数据库、journal 和运行日志都指向 tmp，基准不读写真实的 logs/"""
+    common.LOG_DIR = tmp
+    common.RAW_LOG_DIR = os.path.join(tmp, "raw")
+    common.FAILED_LOG_DIR = os.path.join(tmp, "failed")
+    common.RUNTIME_LOG_PATH = os.path.join(tmp, "runtime.log")
+    common.DB_PATH = os.path.join(tmp, "tracker.db")
+    common.CLASSIFY_CACHE_PATH = os.path.join(tmp, "classify_cache.db")
+    common.JOURNAL_PATH = os.path.join(tmp, "journal.log")
+    common.ensure_dirs()
+    common._logger = common.RuntimeLogger(path=common.RUNTIME_LOG_PATH, echo=False)
+
+
+def main(argv):
+    if not argv or argv[0] not in BENCHMARKS:
+        print(f"Usage: python benchmark.py <{'|'.join(BENCHMARKS)}> [--sizes N1,N2,...]")
+        return 1
+    func, sizes = BENCHMARKS[argv[0]]
+    if "--sizes" in argv:
+        sizes = [int(x) for x in argv[argv.index("--sizes") + 1].split(",")]
+    tmp = tempfile.mkdtemp(prefix="tracker-bench-")
+    try:
+        use_temp_dirs(tmp)
+        func(sizes)
+    finally:
+        common._logger.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
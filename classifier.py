@@ -0,0 +1,353 @@
+# classifier.py - 本地规则预分类与分类缓存
+# 明确的活动（资源管理器、系统空闲、微信等）和见过的活动直接分类，不再发送给 AI
+
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import common
+import storage
+
+LOG_LINE_RE = re.compile(
+    r'^\[(\d{4}-\d{2}-\d{2}) (\d{2}:\d{2}:\d{2}) - (\d{4}-\d{2}-\d{2}) (\d{2}:\d{2}:\d{2})\] '
+    r'<([^>]*)> \[活跃度:([^\]]*)\] (?:\[URL: (.*?)\])? ?(.*)$'
+)
+# 活跃度字段：「高」（旧版）/「高 182/300s」/「高 182/300s 强度:40/60/50/20/12」
+ACTIVITY_RE = re.compile(r'^\s*(\S+)(?: (\d+)/(\d+)s)?(?: 强度:(\d+(?:/\d+)*))?')
+
+DEFAULT_RULES = {
+    "process": {
+        "idle": "休息",
+        "explorer.exe": "系统",
+        "systemsettings.exe": "系统",
+        "taskmgr.exe": "系统",
+        "control.exe": "系统",
+        "wechat.exe": "社交",
+        "weixin.exe": "社交",
+        "qq.exe": "社交",
+        "telegram.exe": "社交",
+        "code.exe": "开发",
+        "pycharm64.exe": "开发",
+        "idea64.exe": "开发",
+        "windowsterminal.exe": "开发",
+        "obsidian.exe": "知识库",
+        "notion.exe": "知识库",
+        "winword.exe": "办公",
+        "excel.exe": "办公",
+        "powerpnt.exe": "办公",
+        "outlook.exe": "办公",
+    },
+    "domain": {
+        "github.com": "开发",
+        "stackoverflow.com": "开发",
+        "chatgpt.com": "AI",
+        "chat.openai.com": "AI",
+        "claude.ai": "AI",
+        "gemini.google.com": "AI",
+        "notion.so": "知识库",
+        "yuque.com": "知识库",
+    },
+    "title": [
+        [r"- Visual Studio Code$", "开发"],
+        [r"^系统空闲$", "休息"],
+    ],
+}
+
+
+def parse_log_line(line):
+    """解析 SmartTracker 生成的原始日志行，失败返回 None"""
+    match = LOG_LINE_RE.match(line.strip())
+    if not match:
+        return None
+    start_date, start, end_date, end, process, activity, url, title = match.groups()
+    return {
+        "date": start_date,
+        "start": start,
+        "end_date": end_date,
+        "end": end,
+        "process": process,
+        "activity": activity,
+        "url": url or "",
+        "title": title.strip(),
+    }
+
+
+def parse_activity(activity):
+    """活跃度字段 -> {"level", "active_seconds", "seconds", "histogram"}，旧格式缺少的部分为 None
+
+    histogram 为每秒按键+点击次数落在 仅鼠标 / 1 / 2-3 / 4-7 / 8+ 各档的秒数
+    """
+    match = ACTIVITY_RE.match(activity or "")
+    if not match:
+        return None
+    level, active, seconds, histogram = match.groups()
+    return {
+        "level": level,
+        "active_seconds": int(active) if active else None,
+        "seconds": int(seconds) if seconds else None,
+        "histogram": [int(n) for n in histogram.split("/")] if histogram else None,
+    }
+
+
+def url_domain(url):
+    """提取 URL 的主机名（去掉 www.），地址栏里常省略协议"""
+    if not url:
+        return ""
+    if "://" not in url:
+        url = "http://" + url
+    try:
+        host = urlsplit(url).hostname or ""
+    except ValueError:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+
+class RuleClassifier:
+    """进程名 / URL 域名 / 标题正则规则编译成的单一匹配器
+
+    优先级：进程名 > 域名（含子域名）> 标题正则。浏览器只看域名和标题。
+    """
+
+    def __init__(self, rules=None, browser_processes=()):
+        rules = rules or {}
+        self.process_rules = {k.lower(): v for k, v in DEFAULT_RULES["process"].items()}
+        self.process_rules.update({k.lower(): v for k, v in rules.get("process", {}).items()})
+        self.domain_rules = {k.lower(): v for k, v in DEFAULT_RULES["domain"].items()}
+        self.domain_rules.update({k.lower(): v for k, v in rules.get("domain", {}).items()})
+        self.browser_processes = {p.lower() for p in browser_processes}
+
+        # 所有标题规则合并成一个带命名分组的正则，一次扫描即可得到命中的规则
+        title_rules = DEFAULT_RULES["title"] + [list(r) for r in rules.get("title", [])]
+        self.title_categories = {}
+        parts = []
+        for i, (pattern, category) in enumerate(title_rules):
+            self.title_categories[f"r{i}"] = category
+            parts.append(f"(?P<r{i}>{pattern})")
+        self.title_re = re.compile("|".join(parts)) if parts else None
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def match(self, process, url, title):
+        process = (process or "").lower()
+        if process not in self.browser_processes:
+            category = self.process_rules.get(process)
+            if category:
+                return category
+
+        domain = url_domain(url)
+        while domain:
+            category = self.domain_rules.get(domain)
+            if category:
+                return category
+            _, _, domain = domain.partition(".")
+
+        if self.title_re and title:
+            m = self.title_re.search(title)
+            if m:
+                return self.title_categories[m.lastgroup]
+        return None
+
+    def classify(self, process, url, title):
+        """返回分类名，无法确定时返回 None（交给 AI）"""
+        category = self.match(process, url, title)
+        with self.lock:
+            if category:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return category
+
+    def get_stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+# ==========================================
+# 分类缓存：活动签名 -> 分类
+# ==========================================
+_TITLE_SUFFIX_RE = re.compile(
+    r'\s+[-—]\s+(google chrome|microsoft edge|mozilla firefox|opera|brave)$')
+_TITLE_UNREAD_RE = re.compile(r'^\(\d+\)\s*')
+_TITLE_DIGITS_RE = re.compile(r'\d+')
+
+
+def normalize_title(title):
+    """去掉浏览器后缀、未读计数和数字，合并空白，小写"""
+    title = (title or "").strip().lower()
+    title = _TITLE_SUFFIX_RE.sub("", title)
+    title = _TITLE_UNREAD_RE.sub("", title)
+    title = _TITLE_DIGITS_RE.sub("#", title)
+    return " ".join(title.split())
+
+
+def activity_signature(process, url, title):
+    return f"{(process or '').lower()}|{url_domain(url)}|{normalize_title(title)}"
+
+
+def line_signature(line):
+    parsed = parse_log_line(line)
+    if not parsed:
+        return None
+    return activity_signature(parsed["process"], parsed["url"], parsed["title"])
+
+
+def match_rows(date_str, parsed_lines, rows):
+    """把分类结果行（开始, 结束, 分类, ...）对应回原始日志行
+
+    以原始行时间段的中点落在哪个结果行区间内为准，AI 合并相邻记录时也能对上。
+    返回 [(parsed_line, row)]，只包含分类非空的结果行
+    """
+    intervals = []
+    for row in rows:
+        start_ts = storage.to_epoch(date_str, row[0])
+        end_ts = storage.to_epoch(date_str, row[1])
+        if start_ts is not None and end_ts is not None and str(row[2]).strip():
+            intervals.append((start_ts, end_ts, row))
+
+    matched = []
+    for parsed in parsed_lines:
+        start_ts = storage.to_epoch(date_str, parsed["start"])
+        end_ts = storage.to_epoch(date_str, parsed["end"])
+        if start_ts is None or end_ts is None:
+            continue
+        mid = (start_ts + end_ts) / 2
+        for row_start, row_end, row in intervals:
+            if row_start <= mid <= row_end:
+                matched.append((parsed, row))
+                break
+    return matched
+
+
+def match_rows_to_lines(date_str, parsed_lines, rows):
+    """返回 [(parsed_line, category)]，见 match_rows"""
+    return [(parsed, str(row[2]).strip()) for parsed, row in match_rows(date_str, parsed_lines, rows)]
+
+
+# 结果行起止与原始行相差不超过该秒数时视为同一段（AI 偶尔把秒数取整）
+LEARN_TOLERANCE = 60
+
+
+def _same_span(date_str, parsed, row, tolerance):
+    starts = storage.to_epoch(date_str, row[0]), storage.to_epoch(date_str, parsed["start"])
+    ends = storage.to_epoch(date_str, row[1]), storage.to_epoch(date_str, parsed["end"])
+    return abs(starts[0] - starts[1]) <= tolerance and abs(ends[0] - ends[1]) <= tolerance
+
+
+def learnable_matches(date_str, parsed_lines, rows, tolerance=LEARN_TOLERANCE):
+    """match_rows 中可以写入分类缓存的 [(parsed_line, category)]
+
+    AI 常把相邻记录合并成一行，合并行里的短活动按中点匹配会沿用整行的分类；
+    只有结果行恰好对应一条原始行，或结果行起止与原始行自身的时间段基本一致时才学习。
+    """
+    matched = match_rows(date_str, parsed_lines, rows)
+    lines_per_row = Counter(id(row) for _, row in matched)
+    return [(parsed, str(row[2]).strip()) for parsed, row in matched
+            if lines_per_row[id(row)] == 1 or _same_span(date_str, parsed, row, tolerance)]
+
+
+def read_raw_lines(date_str):
+    path = os.path.join(common.RAW_LOG_DIR, f"{date_str}_raw.txt")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in f if line.strip()]
+    except OSError:
+        return []
+
+
+class ClassificationCache:
+    """持久化的分类缓存（SQLite），按 last_used 做 LRU 淘汰，AI 结果超过 TTL 失效
+
+    用户在仪表盘里修正的分类（source='user'）不受 TTL 限制。
+    """
+
+    def __init__(self, path=None, max_entries=5000, ttl_days=30):
+        self.path = path or common.CLASSIFY_CACHE_PATH
+        self.max_entries = max_entries
+        self.ttl = ttl_days * 86400
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "signature TEXT PRIMARY KEY, category TEXT NOT NULL, source TEXT NOT NULL, "
+                "updated REAL NOT NULL, last_used REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_used ON cache(last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, signature):
+        now = time.time()
+        with self.lock, self._connect() as conn:
+            row = conn.execute("SELECT category, source, updated FROM cache WHERE signature = ?",
+                               (signature,)).fetchone()
+            if row and row[1] != "user" and now - row[2] > self.ttl:
+                conn.execute("DELETE FROM cache WHERE signature = ?", (signature,))
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE cache SET last_used = ? WHERE signature = ?", (now, signature))
+            self.hits += 1
+            return row[0]
+
+    def put_many(self, items, source="ai"):
+        """items: [(signature, category)]；AI 结果不覆盖用户修正"""
+        if not items:
+            return
+        now = time.time()
+        with self.lock, self._connect() as conn:
+            if source == "user":
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cache(signature, category, source, updated, last_used) "
+                    "VALUES (?, ?, 'user', ?, ?)", [(sig, cat, now, now) for sig, cat in items])
+            else:
+                conn.executemany(
+                    "INSERT INTO cache(signature, category, source, updated, last_used) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(signature) DO UPDATE SET category = excluded.category, "
+                    "updated = excluded.updated, last_used = excluded.last_used WHERE source != 'user'",
+                    [(sig, cat, source, now, now) for sig, cat in items])
+            overflow = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute("DELETE FROM cache WHERE signature IN "
+                             "(SELECT signature FROM cache ORDER BY last_used LIMIT ?)", (overflow,))
+                self.evictions += overflow
+
+    def learn(self, date_str, lines, rows, source="ai"):
+        """根据分类结果行学习这些原始日志行的签名"""
+        parsed_lines = [p for p in (parse_log_line(line) for line in lines) if p]
+        items = [(activity_signature(p["process"], p["url"], p["title"]), category)
+                 for p, category in learnable_matches(date_str, parsed_lines, rows)]
+        self.put_many(items, source)
+        return len(items)
+
+    def get_stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            }
@@ -1,6 +1,13 @@
 # common.py - v3.0 Simplified
 import os
+import sys
+import gzip
 import json
+import time
+import atexit
+import shutil
+import threading
+import collections
 from datetime import datetime, timedelta
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -9,6 +16,9 @@ RAW_LOG_DIR = os.path.join(LOG_DIR, "raw")
 FAILED_LOG_DIR = os.path.join(LOG_DIR, "failed")
 CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
 RUNTIME_LOG_PATH = os.path.join(LOG_DIR, "runtime.log")
+DB_PATH = os.path.join(LOG_DIR, "tracker.db")
+CLASSIFY_CACHE_PATH = os.path.join(LOG_DIR, "classify_cache.db")
+JOURNAL_PATH = os.path.join(LOG_DIR, "journal.log")
 GOALS_PATH = os.path.join(BASE_DIR, "goals.json")
 
 
@@ -18,33 +28,169 @@ def ensure_dirs():
     os.makedirs(FAILED_LOG_DIR, exist_ok=True)
 
 
-def log(msg):
-    """日志记录 - 写入文件并输出到终端（支持中文）"""
-    ensure_dirs()
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    line = f"[{timestamp}] {msg}"
-    
-    # 写入文件
-    try:
-        with open(RUNTIME_LOG_PATH, 'a', encoding='utf-8') as f:
-            f.write(line + "\n")
-    except:
-        pass
-    
-    # 输出到终端（处理中文编码问题）
-    try:
-        import sys
-        import io
-        # 确保stdout使用UTF-8编码
-        if sys.stdout.encoding != 'utf-8':
-            sys.stdout.reconfigure(encoding='utf-8')
-        print(line)
-    except Exception:
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+
+class RuntimeLogger:
+    """后台线程批量写入的运行日志
+
+    调用方只把 (时间, 级别, 消息) 放进队列；写线程每 flush_interval 秒或攒够 batch_size 条
+    写一次文件和终端。按大小或日期轮转，旧文件压缩为 .gz，只保留最近 backup_count 个。
+    """
+
+    def __init__(self, path=RUNTIME_LOG_PATH, level="INFO", max_bytes=5 * 1024 * 1024,
+                 backup_count=7, flush_interval=0.5, batch_size=200, echo=True):
+        self.path = path
+        self.level = LOG_LEVELS.get(str(level).upper(), 20)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.echo = echo
+        self.pending = collections.deque()
+        self.wakeup = threading.Event()
+        self.closed = False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
         try:
-            # 回退方案：强制UTF-8输出
-            print(line.encode('utf-8').decode('utf-8'))
-        except:
+            self.file_day = datetime.fromtimestamp(os.path.getmtime(path)).date()
+        except OSError:
+            self.file_day = datetime.now().date()
+        if echo:
+            try:
+                if sys.stdout and sys.stdout.encoding != 'utf-8':
+                    sys.stdout.reconfigure(encoding='utf-8')
+            except Exception:
+                pass
+        self.thread = threading.Thread(target=self._run, name="runtime-log", daemon=True)
+        self.thread.start()
+
+    def log(self, msg, level="INFO"):
+        if LOG_LEVELS.get(level, 20) < self.level or self.closed:
+            return
+        self.pending.append((time.time(), level, msg))
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    def flush(self, timeout=5):
+        """等待当前已排队的日志写出：排入一个标记，写线程写完它之前的内容后置位"""
+        marker = threading.Event()
+        self.pending.append(marker)
+        self.wakeup.set()
+        marker.wait(timeout)
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join(5)
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self._write_batch()
+        self._write_batch()
+
+    @staticmethod
+    def _format(ts, level, msg):
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+        return f"[{stamp}] {msg}" if level == "INFO" else f"[{stamp}] [{level}] {msg}"
+
+    def _write_batch(self):
+        lines = []
+        markers = []
+        while self.pending:
+            item = self.pending.popleft()
+            if isinstance(item, threading.Event):
+                markers.append(item)
+            else:
+                lines.append(self._format(*item))
+        # 按 batch_size 分块写，突发大量日志时也能按大小及时轮转
+        for i in range(0, len(lines), self.batch_size):
+            self._write_lines(lines[i:i + self.batch_size])
+        for marker in markers:
+            marker.set()
+
+    def _write_lines(self, lines):
+        text = "\n".join(lines) + "\n"
+        try:
+            self._maybe_rotate(len(text.encode('utf-8')))
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(text)
+        except Exception:
+            pass
+        if self.echo:
+            try:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            except Exception:
+                pass
+
+    def _maybe_rotate(self, incoming):
+        today = datetime.now().date()
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            self.file_day = today
+            return
+        if size and (today != self.file_day or size + incoming > self.max_bytes):
+            self._rotate()
+        self.file_day = today
+
+    def _rotate(self):
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        rotated = f"{self.path}.{stamp}"
+        try:
+            # 其他进程正持有文件时改名会失败，下次写入再试
+            os.replace(self.path, rotated)
+        except OSError:
+            return
+        try:
+            with open(rotated, 'rb') as src, gzip.open(rotated + ".gz", 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        except OSError:
             pass
+        folder, base = os.path.split(self.path)
+        backups = sorted(name for name in os.listdir(folder)
+                         if name.startswith(base + ".") and name.endswith(".gz"))
+        for name in backups[:-self.backup_count] if self.backup_count else backups:
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def get_logger():
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                config = load_config()
+                ensure_dirs()
+                _logger = RuntimeLogger(
+                    level=config.get("log_level", "INFO"),
+                    max_bytes=config.get("log_max_mb", 5) * 1024 * 1024,
+                    backup_count=config.get("log_backup_count", 7))
+                atexit.register(_logger.close)
+    return _logger
+
+
+def log(msg, level="INFO"):
+    """日志记录 - 写入文件并输出到终端（后台线程批量写入，支持中文）"""
+    get_logger().log(msg, level)
+
+
+def flush_log():
+    if _logger is not None:
+        _logger.flush()
 
 
 def load_config():
@@ -57,6 +203,8 @@ def load_config():
         "idle_timeout": 300,
         "ai_retry_times": 3,
         "ai_retry_delay": 5,
+        "storage_backend": "csv",
+        "storage_migrate_csv": False,
         "browser_processes": ["chrome.exe", "msedge.exe", "firefox.exe", "opera.exe", "brave.exe"],
     }
     if os.path.exists(CONFIG_PATH):
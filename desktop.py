@@ -0,0 +1,691 @@
+# desktop.py - 桌面平台抽象：时钟、前台窗口事件源、输入监听、浏览器 URL 探测
+# Win32Backend 对接真实桌面；ReplayBackend 用虚拟时钟回放时间线，可在任何平台上快于实时运行
+
+import sys
+import time
+import queue
+import heapq
+import threading
+import contextlib
+from collections import namedtuple, OrderedDict, deque
+
+import psutil
+
+import common
+
+try:
+    import win32gui
+    import win32process
+except ImportError:
+    win32gui = None
+    win32process = None
+
+try:
+    import uiautomation as auto
+except ImportError:
+    auto = None
+
+try:
+    from pynput import mouse, keyboard
+except ImportError:
+    mouse = None
+    keyboard = None
+
+# ts 为事件发生时刻（time.time()）；title/process/url 为 None 表示需要由采集端根据 hwnd 补全
+WindowEvent = namedtuple("WindowEvent", "ts hwnd title process url")
+
+
+def foreground_window():
+    if win32gui is None:
+        return 0
+    return win32gui.GetForegroundWindow()
+
+
+def window_text(hwnd):
+    if win32gui is None or not hwnd:
+        return ""
+    return win32gui.GetWindowText(hwnd)
+
+
+def window_pid(hwnd):
+    if win32process is None or not hwnd:
+        return None
+    return win32process.GetWindowThreadProcessId(hwnd)[1]
+
+
+class WindowSource:
+    """前台窗口事件源：start(sink) 之后在后台线程里对每次变化调用 sink(WindowEvent)"""
+
+    def start(self, sink):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+
+class WinEventSource(WindowSource):
+    """SetWinEventHook 监听前台切换和前台窗口标题变化，没有变化时不唤醒"""
+    EVENT_SYSTEM_FOREGROUND = 0x0003
+    EVENT_OBJECT_NAMECHANGE = 0x800C
+    WINEVENT_OUTOFCONTEXT = 0x0000
+    WINEVENT_SKIPOWNPROCESS = 0x0002
+    OBJID_WINDOW = 0
+    WM_QUIT = 0x0012
+
+    def __init__(self):
+        if sys.platform != "win32":
+            raise RuntimeError("WinEvent hooks require Windows")
+        self.thread = None
+        self.thread_id = None
+        self.ready = threading.Event()
+        self.error = None
+
+    def start(self, sink):
+        self.sink = sink
+        self.thread = threading.Thread(target=self._run, name="winevent", daemon=True)
+        self.thread.start()
+        self.ready.wait(5)
+        if self.error:
+            raise self.error
+
+    @staticmethod
+    def _win_api():
+        """user32 / kernel32 的函数原型；用独立的 WinDLL 实例，不改动全局 ctypes.windll 上的声明"""
+        import ctypes
+        from ctypes import wintypes
+
+        user32 = ctypes.WinDLL("user32", use_last_error=True)
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        proc_type = ctypes.WINFUNCTYPE(None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+                                       wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD)
+        prototypes = [
+            (user32.SetWinEventHook, wintypes.HANDLE,
+             [wintypes.UINT, wintypes.UINT, wintypes.HMODULE, proc_type, wintypes.DWORD, wintypes.DWORD,
+              wintypes.UINT]),
+            (user32.UnhookWinEvent, wintypes.BOOL, [wintypes.HANDLE]),
+            (user32.PostThreadMessageW, wintypes.BOOL,
+             [wintypes.DWORD, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]),
+            (user32.GetMessageW, wintypes.BOOL,
+             [ctypes.POINTER(wintypes.MSG), wintypes.HWND, wintypes.UINT, wintypes.UINT]),
+            (user32.TranslateMessage, wintypes.BOOL, [ctypes.POINTER(wintypes.MSG)]),
+            (user32.DispatchMessageW, wintypes.LPARAM, [ctypes.POINTER(wintypes.MSG)]),
+            (user32.GetForegroundWindow, wintypes.HWND, []),
+            (kernel32.GetTickCount, wintypes.DWORD, []),
+            (kernel32.GetCurrentThreadId, wintypes.DWORD, []),
+        ]
+        for func, restype, argtypes in prototypes:
+            func.restype = restype
+            func.argtypes = argtypes
+        return user32, kernel32, proc_type
+
+    def _run(self):
+        import ctypes
+        from ctypes import wintypes
+
+        user32, kernel32, proc_type = self._win_api()
+        self.user32 = user32
+
+        def callback(hook, event, hwnd, id_object, id_child, thread_id, event_ms):
+            if not hwnd or id_object != self.OBJID_WINDOW:
+                return
+            if event == self.EVENT_OBJECT_NAMECHANGE and hwnd != user32.GetForegroundWindow():
+                return
+            # dwmsEventTime 是事件发生时的 GetTickCount，换算成墙钟时间
+            age = (kernel32.GetTickCount() - event_ms) & 0xFFFFFFFF
+            if age > 60000:
+                age = 0
+            self.sink(WindowEvent(time.time() - age / 1000, hwnd, None, None, None))
+
+        # 回调对象必须保持引用，否则会被回收
+        self.proc = proc_type(callback)
+        flags = self.WINEVENT_OUTOFCONTEXT | self.WINEVENT_SKIPOWNPROCESS
+        hooks = [user32.SetWinEventHook(event, event, None, self.proc, 0, 0, flags)
+                 for event in (self.EVENT_SYSTEM_FOREGROUND, self.EVENT_OBJECT_NAMECHANGE)]
+        if not all(hooks):
+            for hook in filter(None, hooks):
+                user32.UnhookWinEvent(hook)
+            self.error = OSError(ctypes.get_last_error(), "SetWinEventHook failed")
+            self.ready.set()
+            return
+        self.thread_id = kernel32.GetCurrentThreadId()
+        self.ready.set()
+
+        msg = wintypes.MSG()
+        while user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+            user32.TranslateMessage(ctypes.byref(msg))
+            user32.DispatchMessageW(ctypes.byref(msg))
+        for hook in hooks:
+            user32.UnhookWinEvent(hook)
+
+    def stop(self):
+        if self.thread_id:
+            self.user32.PostThreadMessageW(self.thread_id, self.WM_QUIT, 0, 0)
+            self.thread.join(2)
+
+
+class PollingSource(WindowSource):
+    """按固定间隔调用 probe()，结果变化时才产生事件
+
+    probe 返回 (hwnd, title, process, url)，未知字段为 None；默认探测 Win32 前台窗口。
+    """
+
+    def __init__(self, probe=None, interval=1.0):
+        self.probe = probe or self._win32_probe
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def _win32_probe():
+        hwnd = foreground_window()
+        return (hwnd, window_text(hwnd), None, None) if hwnd else None
+
+    def start(self, sink):
+        self.sink = sink
+        self.thread = threading.Thread(target=self._run, name="window-poll", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        last = None
+        while not self.stop_event.wait(self.interval):
+            try:
+                snapshot = self.probe()
+            except Exception as e:
+                common.log(f"Window probe failed: {e}")
+                continue
+            if snapshot and snapshot != last:
+                last = snapshot
+                self.sink(WindowEvent(time.time(), *snapshot))
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(self.interval + 1)
+
+
+class ScriptedSource(WindowSource):
+    """按脚本回放事件：[(延迟秒, title, process, url), ...]，用于测试和基准
+
+    事件时间戳取实际发出时刻；speed > 1 时按比例缩短等待。
+    clock: 取时间戳和等待所用的时钟（默认系统时钟），测试中换成假时钟可让时间戳精确可控。
+    """
+
+    def __init__(self, script, speed=1.0, clock=None):
+        self.script = list(script)
+        self.speed = speed
+        self.clock = clock
+        self.stop_event = threading.Event()
+        self.done = threading.Event()
+        self.thread = None
+
+    def start(self, sink):
+        self.sink = sink
+        self.thread = threading.Thread(target=self._run, name="window-script", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        for delay, title, process, url in self.script:
+            if self._wait(delay / self.speed):
+                break
+            now = self.clock.time() if self.clock else time.time()
+            self.sink(WindowEvent(now, None, title, process, url))
+        self.done.set()
+
+    def _wait(self, seconds):
+        """等待 seconds 秒，期间被 stop() 时返回 True"""
+        if self.clock is None:
+            return self.stop_event.wait(seconds)
+        self.clock.sleep(seconds)
+        return self.stop_event.is_set()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(1)
+
+
+class ProcessNameCache:
+    """进程名缓存：键为 (pid, 创建时间)，PID 被系统复用后不会返回旧进程名；LRU 淘汰，有上限"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.by_pid = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused = 0
+
+    def warm(self):
+        """用一次 process_iter 快照批量填充，返回填充的进程数"""
+        count = 0
+        for proc in psutil.process_iter(["name", "create_time"]):
+            name, create_time = proc.info["name"], proc.info["create_time"]
+            if name and create_time is not None:
+                self.put(proc.pid, create_time, name)
+                count += 1
+        return count
+
+    def put(self, pid, create_time, name):
+        key = (pid, create_time)
+        old = self.by_pid.get(pid)
+        if old is not None and old != key:
+            self.entries.pop(old, None)
+            self.reused += 1
+        self.by_pid[pid] = key
+        # 进程名重复度很高，驻留后所有条目共享同一个字符串对象
+        self.entries[key] = sys.intern(name.lower())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            if self.by_pid.get(evicted[0]) == evicted:
+                del self.by_pid[evicted[0]]
+            self.evictions += 1
+
+    def get(self, pid):
+        try:
+            # 构造 Process 时 psutil 会读取创建时间
+            proc = psutil.Process(pid)
+            key = (pid, proc.create_time())
+        except (psutil.Error, ValueError):
+            return "unknown"
+        name = self.entries.get(key)
+        if name is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return name
+        self.misses += 1
+        try:
+            self.put(pid, key[1], proc.name())
+        except psutil.Error:
+            return "unknown"
+        return self.entries[key]
+
+    def approx_bytes(self):
+        size = sys.getsizeof(self.entries) + sys.getsizeof(self.by_pid)
+        for pid, create_time in self.entries:
+            size += sys.getsizeof((pid, create_time)) + sys.getsizeof(pid) + sys.getsizeof(create_time)
+        size += sum(sys.getsizeof(name) for name in set(self.entries.values()))
+        return size
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+            "pid_reused": self.reused,
+            "approx_kb": round(self.approx_bytes() / 1024, 1),
+        }
+
+
+# ==========================================
+# 后端：时钟 + 窗口 + 输入 + URL
+# ==========================================
+class SystemClock:
+    @staticmethod
+    def time():
+        return time.time()
+
+    @staticmethod
+    def monotonic():
+        return time.monotonic()
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+    @staticmethod
+    def wait(events, timeout):
+        """从事件队列取一个事件，超时抛出 queue.Empty"""
+        return events.get(timeout=timeout)
+
+
+class Win32Backend:
+    """真实桌面：WinEvent/轮询窗口事件，pynput 输入监听，uiautomation 读取地址栏"""
+
+    def __init__(self, config):
+        self.config = config
+        self.clock = SystemClock()
+
+    def create_window_source(self):
+        return create_window_source(self.config)
+
+    def foreground_event(self):
+        hwnd = foreground_window()
+        return WindowEvent(self.clock.time(), hwnd, None, None, None) if hwnd else None
+
+    window_text = staticmethod(window_text)
+    window_pid = staticmethod(window_pid)
+
+    def start_input(self, on_click, on_move, on_key):
+        if mouse is None:
+            raise RuntimeError("pynput not installed")
+        mouse.Listener(on_click=on_click, on_move=on_move).start()
+        keyboard.Listener(on_release=on_key).start()
+
+    # 地址栏探测很慢（UIA 树搜索），放到后台线程
+    async_url_probe = True
+
+    def create_url_probe(self):
+        return UIAURLProbe()
+
+
+class UIAURLProbe:
+    """uiautomation 读取浏览器地址栏
+
+    按 hwnd 缓存找到的地址栏控件，之后直接读值；按浏览器记住控件的 AutomationId/Name，
+    同一浏览器的新窗口先按这个条件查找，不再逐个尝试。
+    """
+    MAX_CONTROLS = 64
+
+    def __init__(self):
+        self.controls = OrderedDict()
+        self.hints = {}
+        self.searches = 0
+        self.cached_reads = 0
+
+    def thread_context(self):
+        # UIA 基于 COM，每个调用线程都要先初始化
+        return auto.UIAutomationInitializerInThread() if auto else contextlib.nullcontext()
+
+    @staticmethod
+    def _default_search(window, process_name):
+        # Exists(0) 只查找一次；默认参数会重试最多 5 秒
+        if 'firefox' in process_name:
+            edit = window.EditControl(searchDepth=8, AutomationId="urlbar-input")
+            if not edit.Exists(0):
+                edit = window.EditControl(searchDepth=6)
+        elif 'edge' in process_name:
+            edit = window.EditControl(Name="Address and search bar", searchDepth=6)
+            if not edit.Exists(0):
+                edit = window.EditControl(searchDepth=6, foundIndex=1)
+        else:
+            edit = window.EditControl(searchDepth=6, foundIndex=1)
+        return edit if edit.Exists(0) else None
+
+    def _search(self, hwnd, process_name):
+        self.searches += 1
+        window = auto.ControlFromHandle(hwnd)
+        hint = self.hints.get(process_name)
+        if hint:
+            edit = window.EditControl(searchDepth=8, **hint)
+            if edit.Exists(0):
+                return edit
+        edit = self._default_search(window, process_name)
+        if edit is not None:
+            if edit.AutomationId:
+                self.hints[process_name] = {"AutomationId": edit.AutomationId}
+            elif edit.Name:
+                self.hints[process_name] = {"Name": edit.Name}
+        return edit
+
+    def read(self, hwnd, process_name):
+        if auto is None:
+            return ""
+        control = self.controls.get(hwnd)
+        if control is not None:
+            try:
+                url = control.GetValuePattern().Value
+                self.controls.move_to_end(hwnd)
+                self.cached_reads += 1
+                return url
+            except Exception:
+                # 控件失效（页面重建、窗口关闭），重新查找
+                self.controls.pop(hwnd, None)
+        edit = self._search(hwnd, process_name)
+        if edit is None:
+            return ""
+        url = edit.GetValuePattern().Value
+        self.controls[hwnd] = edit
+        if len(self.controls) > self.MAX_CONTROLS:
+            self.controls.popitem(last=False)
+        return url
+
+
+class BrowserURLProber:
+    """按 hwnd 缓存浏览器 URL，窗口标题变化即失效
+
+    异步模式下未命中时提交给后台线程探测并立即返回 None；探测结果以 WindowEvent
+    （沿用触发探测的事件时间戳）交给 on_result。同一窗口排队期间只探测最新的标题。
+    """
+
+    def __init__(self, probe, on_result=None, async_mode=True, cache_size=256):
+        self.probe = probe
+        self.on_result = on_result
+        # 每次探测完成后以耗时（秒）回调，用于运行指标
+        self.on_latency = None
+        self.cache_size = cache_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.latencies = deque(maxlen=1000)
+        self.hits = 0
+        self.misses = 0
+        self.jobs = None
+        if async_mode:
+            self.jobs = queue.Queue()
+            threading.Thread(target=self._run, name="url-probe", daemon=True).start()
+
+    def lookup(self, ts, hwnd, process, title):
+        with self.lock:
+            entry = self.entries.get(hwnd)
+            if entry and entry[0] == title:
+                self.entries.move_to_end(hwnd)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if self.jobs is not None:
+                queued = hwnd in self.pending
+                self.pending[hwnd] = (ts, process, title)
+        if self.jobs is None:
+            return self._probe(hwnd, process, title)
+        if not queued:
+            self.jobs.put(hwnd)
+        return None
+
+    def _run(self):
+        with self.probe.thread_context():
+            while True:
+                hwnd = self.jobs.get()
+                if hwnd is None:
+                    return
+                with self.lock:
+                    ts, process, title = self.pending.pop(hwnd)
+                url = self._probe(hwnd, process, title)
+                if self.on_result:
+                    self.on_result(WindowEvent(ts, hwnd, title, process, url))
+
+    def _probe(self, hwnd, process, title):
+        t0 = time.perf_counter()
+        try:
+            url = self.probe.read(hwnd, process) or ""
+        except Exception:
+            url = ""
+        latency = time.perf_counter() - t0
+        with self.lock:
+            self.latencies.append(latency)
+            self.entries[hwnd] = (title, url)
+            self.entries.move_to_end(hwnd)
+            if len(self.entries) > self.cache_size:
+                self.entries.popitem(last=False)
+        if self.on_latency:
+            self.on_latency(latency)
+        return url
+
+    def stop(self):
+        if self.jobs is not None:
+            self.jobs.put(None)
+
+    def get_stats(self):
+        with self.lock:
+            samples = sorted(self.latencies)
+            total = self.hits + self.misses
+
+        def pct(p):
+            return round(samples[min(int(len(samples) * p), len(samples) - 1)] * 1000, 1) if samples else 0.0
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            "p50_ms": pct(0.5),
+            "p90_ms": pct(0.9),
+            "p99_ms": pct(0.99),
+            "searches": getattr(self.probe, "searches", 0),
+            "cached_reads": getattr(self.probe, "cached_reads", 0),
+        }
+
+
+class ReplayFinished(Exception):
+    """回放时间线已经用完"""
+
+
+class ReplayClock:
+    """虚拟时钟：等待事件时直接跳到下一个时间线条目，不真正睡眠"""
+
+    def __init__(self, backend, start_time):
+        self.backend = backend
+        self.start_time = start_time
+        self.elapsed = 0.0
+
+    def time(self):
+        return self.start_time + self.elapsed
+
+    def monotonic(self):
+        return self.elapsed
+
+    def sleep(self, seconds):
+        self.wait(queue.Queue(), seconds, block_events=False)
+
+    def wait(self, events, timeout, block_events=True):
+        deadline = self.elapsed + timeout
+        while True:
+            if block_events and not events.empty():
+                return events.get_nowait()
+            entry = self.backend.next_entry(deadline)
+            if entry is None:
+                self.elapsed = max(self.elapsed, deadline)
+                raise queue.Empty
+            at, kind, payload = entry
+            self.elapsed = max(self.elapsed, at)
+            if kind == "suspend":
+                # 挂起期间墙钟和单调时钟一起前进，醒来时等待已超时
+                self.elapsed += payload
+                raise queue.Empty
+            self.backend.dispatch(kind, payload)
+
+
+class ReplayBackend:
+    """回放时间线驱动 SmartTracker / InputMonitor / DataCollector，无需桌面环境
+
+    timeline: [(偏移秒, kind, payload)]，按偏移排序
+      ("window", (title, process, url))  前台窗口变化
+      ("input", count)                   一次输入（count 次按键）
+      ("suspend", seconds)               系统睡眠
+    """
+
+    def __init__(self, timeline, start_time=None):
+        self.timeline = list(timeline)
+        self.pos = 0
+        self.clock = ReplayClock(self, start_time if start_time is not None else time.time())
+        self.current = None
+        self.window_sink = None
+        self.input_callbacks = None
+        # 第一个窗口事件作为启动时的前台窗口
+        for index, (_, kind, payload) in enumerate(self.timeline):
+            if kind == "window":
+                self.current = payload
+                del self.timeline[index]
+                break
+
+    def create_window_source(self):
+        return _ReplaySource(self)
+
+    def foreground_event(self):
+        if not self.current:
+            return None
+        title, process, url = self.current
+        return WindowEvent(self.clock.time(), None, title, process, url)
+
+    @staticmethod
+    def window_text(hwnd):
+        return ""
+
+    @staticmethod
+    def window_pid(hwnd):
+        return None
+
+    def start_input(self, on_click, on_move, on_key):
+        self.input_callbacks = (on_click, on_move, on_key)
+
+    # 回放事件自带 URL，探测只在补全 hwnd 事件时发生，同步即可保证回放确定
+    async_url_probe = False
+
+    def create_url_probe(self):
+        return _ReplayURLProbe(self)
+
+    def next_entry(self, deadline):
+        """取出不晚于 deadline 的下一条；时间线用完时抛出 ReplayFinished"""
+        if self.pos >= len(self.timeline):
+            raise ReplayFinished()
+        entry = self.timeline[self.pos]
+        if entry[0] > deadline:
+            return None
+        self.pos += 1
+        return entry
+
+    def dispatch(self, kind, payload):
+        if kind == "window":
+            self.current = payload
+            if self.window_sink:
+                title, process, url = payload
+                self.window_sink(WindowEvent(self.clock.time(), None, title, process, url))
+        elif kind == "input" and self.input_callbacks:
+            on_key = self.input_callbacks[2]
+            for _ in range(payload):
+                on_key(None)
+
+
+class _ReplayURLProbe:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def thread_context(self):
+        return contextlib.nullcontext()
+
+    def read(self, hwnd, process_name):
+        return self.backend.current[2] if self.backend.current else ""
+
+
+class _ReplaySource(WindowSource):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def start(self, sink):
+        self.backend.window_sink = sink
+
+    def stop(self):
+        self.backend.window_sink = None
+
+
+def merge_timelines(*timelines):
+    return list(heapq.merge(*timelines, key=lambda entry: entry[0]))
+
+
+def create_backend(config):
+    return Win32Backend(config)
+
+
+def create_window_source(config, probe=None):
+    """window_source: auto（Windows 用 WinEvent，失败回退轮询）/ winevent / poll"""
+    kind = config.get("window_source", "auto")
+    interval = config.get("poll_interval", 1)
+    if kind in ("auto", "winevent") and sys.platform == "win32":
+        try:
+            return WinEventSource()
+        except Exception as e:
+            common.log(f"WinEvent source unavailable, polling: {e}")
+    return PollingSource(probe, interval)
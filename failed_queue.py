@@ -0,0 +1,269 @@
+# failed_queue.py - logs/failed 的后台重试
+# 失败批次按指数退避重新分类，已在存储中的行先去重；状态持久化在 failed/retry_state.json
+# 无法解析的行不能去重也不能按日期分组，批次完成时移到 failed/unparsed_*.txt 保留，等待人工处理
+
+import os
+import json
+import time
+import threading
+
+import common
+import classifier
+
+STATE_FILE = "retry_state.json"
+
+
+def list_failed(failed_dir=None, prefix="failed_"):
+    failed_dir = failed_dir or common.FAILED_LOG_DIR
+    try:
+        return sorted(name for name in os.listdir(failed_dir)
+                      if name.startswith(prefix) and name.endswith(".txt"))
+    except OSError:
+        return []
+
+
+def read_failed(path):
+    """返回 (错误信息, 日志行)；文件格式见 AsyncAISummarizer._save_failed"""
+    error = ""
+    lines = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("# Error:"):
+                error = line[len("# Error:"):].strip()
+            elif line.strip():
+                lines.append(line)
+    return error, lines
+
+
+class FailedQueue:
+    """failed/ 目录中待重试批次的状态：尝试次数、下次重试时间、最后一次错误"""
+
+    def __init__(self, failed_dir=None, base_delay=300, max_delay=6 * 3600):
+        self.dir = failed_dir or common.FAILED_LOG_DIR
+        self.state_path = os.path.join(self.dir, STATE_FILE)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("files", {})
+        state.setdefault("recovered_batches", 0)
+        state.setdefault("recovered_lines", 0)
+        state.setdefault("deduped_lines", 0)
+        state.setdefault("unparsed_lines", 0)
+        return state
+
+    def _save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            common.log(f"Retry state save failed: {e}")
+
+    def next_due(self, now, min_age=5):
+        """最早到期的批次文件名；刚写入不到 min_age 秒的文件跳过"""
+        with self.lock:
+            names = list_failed(self.dir)
+            # 清理已被手动删除的文件的状态
+            for name in set(self.state["files"]) - set(names):
+                del self.state["files"][name]
+            for name in names:
+                entry = self.state["files"].get(name)
+                if entry and entry["next_at"] > now:
+                    continue
+                try:
+                    if now - os.path.getmtime(os.path.join(self.dir, name)) < min_age:
+                        continue
+                except OSError:
+                    continue
+                return name
+        return None
+
+    def read(self, name):
+        return read_failed(os.path.join(self.dir, name))
+
+    def mark_failed(self, name, error, now):
+        with self.lock:
+            entry = self.state["files"].setdefault(name, {"attempts": 0})
+            entry["attempts"] += 1
+            delay = min(self.max_delay, self.base_delay * 2 ** (entry["attempts"] - 1))
+            entry["next_at"] = now + delay
+            entry["error"] = str(error)[:200]
+            self._save_state()
+            return delay
+
+    def _quarantine(self, name, lines):
+        """无法解析的行写入 unparsed_*.txt（格式同 failed_*.txt，不会被重试）"""
+        path = os.path.join(self.dir, "unparsed_" + name[len("failed_"):])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(f"# Error: unparseable log lines (from {name})\n" + "\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return path
+
+    def mark_done(self, name, lines, deduped, unparsed=()):
+        """其余行都已入库或已去重：无法解析的行先另存，成功后才删除批次文件；返回是否已删除"""
+        with self.lock:
+            if unparsed:
+                try:
+                    path = self._quarantine(name, unparsed)
+                except OSError as e:
+                    common.log(f"Failed retry: cannot keep unparseable lines of {name}: {e}")
+                    return False
+                common.log(f"Failed retry: {len(unparsed)} unparseable lines kept in {path}")
+            try:
+                os.remove(os.path.join(self.dir, name))
+            except OSError:
+                pass
+            self.state["files"].pop(name, None)
+            self.state["recovered_batches"] += 1
+            self.state["recovered_lines"] += lines
+            self.state["deduped_lines"] += deduped
+            self.state["unparsed_lines"] += len(unparsed)
+            self._save_state()
+            return True
+
+    def summary(self):
+        return backlog_summary(self.dir)
+
+
+def backlog_summary(failed_dir=None):
+    """仪表盘用：待重试批次数、行数、最近一次重试时间（只读文件，不依赖 tracker 进程）"""
+    failed_dir = failed_dir or common.FAILED_LOG_DIR
+    names = list_failed(failed_dir)
+    lines = 0
+    for name in names:
+        try:
+            lines += len(read_failed(os.path.join(failed_dir, name))[1])
+        except OSError:
+            pass
+    unparsed = 0
+    for name in list_failed(failed_dir, prefix="unparsed_"):
+        try:
+            unparsed += len(read_failed(os.path.join(failed_dir, name))[1])
+        except OSError:
+            pass
+    try:
+        with open(os.path.join(failed_dir, STATE_FILE), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    entries = [state.get("files", {}).get(name) for name in names]
+    scheduled = [entry["next_at"] for entry in entries if entry and "next_at" in entry]
+    return {
+        "batches": len(names),
+        "lines": lines,
+        "retrying": len(scheduled),
+        "next_retry": min(scheduled) if len(scheduled) == len(names) and scheduled else None,
+        "recovered_batches": state.get("recovered_batches", 0),
+        "recovered_lines": state.get("recovered_lines", 0),
+        "unparsed_lines": unparsed,
+    }
+
+
+class FailedReprocessor:
+    """后台线程：实时分类空闲时，每 interval 秒最多重试一个失败批次
+
+    classify(lines) -> bool 负责分类并入库；is_busy() 为 True 时让路给实时分类。
+    """
+
+    def __init__(self, classify, store, is_busy=None, interval=120, queue=None):
+        self.classify = classify
+        self.store = store
+        self.is_busy = is_busy or (lambda: False)
+        self.interval = interval
+        self.queue = queue or FailedQueue()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="failed-retry", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            if self.is_busy():
+                continue
+            try:
+                self.process_one(time.time())
+            except Exception as e:
+                common.log(f"Failed retry error: {e}")
+
+    def uncovered_lines(self, lines):
+        """去掉已被存储中的结果行覆盖的日志行（比如批次失败后又被手动或重放补上）
+
+        返回 (仍需分类的行, 无法解析的行)；无法解析的行不计入去重。
+        """
+        by_date = {}
+        unparsed = []
+        for line in lines:
+            parsed = classifier.parse_log_line(line)
+            if parsed is None:
+                unparsed.append(line)
+                continue
+            by_date.setdefault(parsed["date"], []).append((line, parsed))
+        remaining = []
+        for date_str, items in by_date.items():
+            rows = self.store.read_rows(date_str)
+            matched = classifier.match_rows_to_lines(date_str, [p for _, p in items], rows)
+            covered = {id(p) for p, _ in matched}
+            remaining.extend(line for line, p in items if id(p) not in covered)
+        return remaining, unparsed
+
+    def process_one(self, now):
+        """重试一个到期批次，返回是否处理了批次"""
+        name = self.queue.next_due(now)
+        if name is None:
+            return False
+        try:
+            _, lines = self.queue.read(name)
+        except OSError as e:
+            self.queue.mark_failed(name, e, now)
+            return True
+        remaining, unparsed = self.uncovered_lines(lines)
+        deduped = len(lines) - len(remaining) - len(unparsed)
+        if not remaining:
+            if self._finish(name, 0, deduped, unparsed, now):
+                common.log(f"Failed retry: {name} already stored ({deduped} lines)")
+            return True
+
+        # 一个请求只包含同一天的记录
+        days = {}
+        for line in remaining:
+            days.setdefault(line[1:11], []).append(line)
+        for day_lines in days.values():
+            if self.stop_event.is_set():
+                return True
+            if not self.classify(day_lines):
+                if self.stop_event.is_set():
+                    # 退出时被中止，不计入失败次数
+                    return True
+                delay = self.queue.mark_failed(name, "retry failed", now)
+                common.log(f"Failed retry: {name} failed again, next in {int(delay)}s")
+                return True
+        if self._finish(name, len(remaining), deduped, unparsed, now):
+            common.log(f"Failed retry: {name} recovered {len(remaining)} lines ({deduped} already stored)")
+        return True
+
+    def _finish(self, name, recovered, deduped, unparsed, now):
+        if self.queue.mark_done(name, recovered, deduped, unparsed):
+            return True
+        # 无法解析的行没能另存：保留批次文件，已入库的行下次重试时会被去重
+        self.queue.mark_failed(name, "cannot keep unparseable lines", now)
+        return False
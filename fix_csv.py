@@ -1,15 +1,33 @@
 # fix_csv.py - CSV Data Repair Tool
 # Run this script to fix existing CSV files with format issues
+#   python fix_csv.py [--dir logs] [--workers N] [--dry-run] [--no-backup] [--force]
+# Also usable as a library: repair_file() / repair_directory()
 
 import os
-import csv
+import io
 import re
+import csv
+import sys
+import gzip
+import json
+import codecs
 import shutil
-from datetime import datetime
+import hashlib
+import argparse
+import concurrent.futures
 
 # Configuration - adjust path if needed
 LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
 BACKUP_DIR = os.path.join(LOG_DIR, "backup_before_fix")
+MANIFEST_NAME = ".fix_csv_manifest.json"
+
+HEADER = ['开始时间', '结束时间', '任务分类', '任务详情']
+ENCODINGS = ['utf-8-sig', 'utf-8', 'gbk', 'gb2312']
+PREFIX_BYTES = 64 * 1024
+CHUNK_BYTES = 1024 * 1024
+MAX_SAMPLES = 5
+
+_TIME_RE = re.compile(r'^(\d{2}:\d{2}:\d{2}|\d{2}:\d{2}|\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})$')
 
 
 def clean_csv_line(line):
@@ -17,7 +35,7 @@ def clean_csv_line(line):
     line = line.strip()
     if not line or line.startswith('#'):
         return None
-    
+
     # Try csv module first
     try:
         reader = csv.reader([line])
@@ -28,7 +46,7 @@ def clean_csv_line(line):
                 return row + ['']
     except:
         pass
-    
+
     # Fallback: manual split
     parts = line.split(',')
     if len(parts) < 3:
@@ -43,135 +61,324 @@ def clean_csv_line(line):
 
 
 def is_valid_time(time_str):
-    """Check if string is valid time format"""
-    time_str = str(time_str).strip()
-    patterns = [
-        r'^\d{2}:\d{2}:\d{2}$',           # HH:MM:SS
-        r'^\d{2}:\d{2}$',                  # HH:MM
-        r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$',  # YYYY-MM-DD HH:MM:SS
-    ]
-    for pattern in patterns:
-        if re.match(pattern, time_str):
-            return True
-    return False
+    """Check if string is valid time format (HH:MM:SS / HH:MM / YYYY-MM-DD HH:MM:SS)"""
+    return _TIME_RE.match(str(time_str).strip()) is not None
 
 
-def fix_csv_file(filepath):
-    """Fix a single CSV file"""
+def detect_encoding(filepath, prefix_bytes=PREFIX_BYTES):
+    """Guess the encoding from a small prefix instead of decoding the whole file per candidate"""
+    with open(filepath, 'rb') as f:
+        prefix = f.read(prefix_bytes)
+    if prefix.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    for encoding in ENCODINGS[1:]:
+        try:
+            # final=False: the prefix may end in the middle of a multi-byte character
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def iter_lines(filepath, encoding, hasher):
+    """Stream decoded lines; every raw byte also goes through hasher"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    with open(filepath, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            hasher.update(chunk)
+            text = pending + decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                if text:
+                    yield text
+                return
+            lines = text.split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + '\n'
+
+
+class _HashingSink:
+    """Encodes csv.writer output to UTF-8, hashes it and (optionally) writes it to a file"""
+
+    def __init__(self, f=None):
+        self.f = f
+        self.hasher = hashlib.sha256()
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, quoting=csv.QUOTE_MINIMAL)
+        self._emit(codecs.BOM_UTF8)
+
+    def _emit(self, data):
+        self.hasher.update(data)
+        if self.f:
+            self.f.write(data)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        if self.buffer.tell() >= CHUNK_BYTES:
+            self.flush()
+
+    def flush(self):
+        self._emit(self.buffer.getvalue().encode('utf-8'))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+
+def file_sha256(filepath):
+    hasher = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _repair_pass(filepath, encoding, out_file):
+    """One streaming pass: parse, validate and re-serialize. Returns (stats, input hash, output hash)"""
+    in_hasher = hashlib.sha256()
+    sink = _HashingSink(out_file)
+    sink.writerow(HEADER)
+    rows = 0
+    skipped = 0
+    samples = []
+    for i, line in enumerate(iter_lines(filepath, encoding, in_hasher)):
+        line = line.strip()
+        if not line:
+            continue
+
+        # Check for header
+        if i == 0 and ('开始时间' in line or 'starttime' in line.lower()):
+            continue
+
+        parsed = clean_csv_line(line)
+        if parsed and is_valid_time(parsed[0]) and is_valid_time(parsed[1]):
+            # Clean up task detail (remove extra quotes)
+            parsed[3] = parsed[3].strip('"').strip("'")
+            sink.writerow(parsed)
+            rows += 1
+            continue
+
+        skipped += 1
+        if len(samples) < MAX_SAMPLES:
+            reason = "Invalid time format" if parsed else "Cannot parse"
+            samples.append(f"{reason} in line {i+1}: {line[:50]}...")
+    sink.flush()
+    stats = {"rows": rows, "skipped": skipped, "samples": samples}
+    return stats, in_hasher.hexdigest(), sink.hasher.hexdigest()
+
+
+def _backup(filepath, backup_dir):
+    """Gzip the original into backup_dir (existing backups are never overwritten)"""
+    os.makedirs(backup_dir, exist_ok=True)
+    dst = os.path.join(backup_dir, os.path.basename(filepath) + ".gz")
+    if os.path.exists(dst):
+        return
+    tmp = dst + ".tmp"
+    with open(filepath, 'rb') as src, gzip.open(tmp, 'wb') as out:
+        shutil.copyfileobj(src, out)
+    os.replace(tmp, dst)
+
+
+def repair_file(filepath, dry_run=False, backup_dir=BACKUP_DIR, known_hash=None):
+    """Repair one CSV file in a single streaming pass.
+
+    status: clean (already well-formed, or matches known_hash) / fixed / would_fix (dry run) /
+    empty (no valid rows, left untouched) / error.
+    """
+    result = {"file": filepath, "status": "error", "rows": 0, "skipped": 0, "samples": [],
+              "encoding": None, "sha256": None, "error": None}
     try:
-        # Read with multiple encodings
-        content = None
-        for encoding in ['utf-8-sig', 'utf-8', 'gbk', 'gb2312']:
+        if known_hash and file_sha256(filepath) == known_hash:
+            result.update(status="clean", sha256=known_hash)
+            return result
+
+        encoding = detect_encoding(filepath)
+        if encoding is None:
+            result["error"] = "Cannot detect encoding"
+            return result
+        result["encoding"] = encoding
+
+        tmp_path = filepath + ".fixing"
+        out_file = None if dry_run else open(tmp_path, 'wb')
+        replaced = False
+        try:
             try:
-                with open(filepath, 'r', encoding=encoding) as f:
-                    content = f.readlines()
-                break
-            except:
-                continue
-        
-        if not content:
-            print(f"  [ERROR] Cannot read: {filepath}")
-            return False
-        
-        # Parse lines
-        fixed_rows = []
-        header_found = False
-        errors_fixed = 0
-        
-        for i, line in enumerate(content):
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Check for header
-            if i == 0 and ('开始时间' in line or 'StartTime' in line.lower()):
-                header_found = True
-                continue
-            
-            # Parse the line
-            parsed = clean_csv_line(line)
-            
-            if parsed:
-                # Validate time format
-                if is_valid_time(parsed[0]) and is_valid_time(parsed[1]):
-                    # Clean up task detail (remove extra quotes)
-                    parsed[3] = parsed[3].strip('"').strip("'")
-                    fixed_rows.append(parsed)
-                else:
-                    print(f"  [SKIP] Invalid time format in line {i+1}: {line[:50]}...")
-                    errors_fixed += 1
+                stats, in_hash, out_hash = _repair_pass(filepath, encoding, out_file)
+            except UnicodeDecodeError:
+                # The prefix looked like UTF-8 but a later part is not; retry as GBK
+                if encoding == 'gbk':
+                    raise
+                encoding = result["encoding"] = 'gbk'
+                if out_file:
+                    out_file.seek(0)
+                    out_file.truncate()
+                stats, in_hash, out_hash = _repair_pass(filepath, encoding, out_file)
+            if out_file:
+                out_file.close()
+            result.update(stats)
+
+            if not stats["rows"]:
+                result["status"] = "empty"
+            elif in_hash == out_hash:
+                result.update(status="clean", sha256=in_hash)
+            elif dry_run:
+                result["status"] = "would_fix"
             else:
-                print(f"  [SKIP] Cannot parse line {i+1}: {line[:50]}...")
-                errors_fixed += 1
-        
-        if not fixed_rows:
-            print(f"  [WARN] No valid data found in {filepath}")
-            return False
-        
-        # Write fixed file
-        with open(filepath, 'w', encoding='utf-8-sig', newline='') as f:
-            writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['开始时间', '结束时间', '任务分类', '任务详情'])
-            for row in fixed_rows:
-                writer.writerow(row)
-        
-        print(f"  [OK] Fixed {filepath}: {len(fixed_rows)} rows, {errors_fixed} errors corrected")
-        return True
-        
+                if backup_dir:
+                    _backup(filepath, backup_dir)
+                os.replace(tmp_path, filepath)
+                replaced = True
+                result.update(status="fixed", sha256=out_hash)
+        finally:
+            # Whatever went wrong (decode error on the retry, disk full, backup failure),
+            # the temp file must not outlive this call unless it replaced the original
+            if out_file:
+                out_file.close()
+                if not replaced:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
     except Exception as e:
-        print(f"  [ERROR] {filepath}: {e}")
-        return False
+        result["error"] = str(e)
+    return result
 
 
-def main():
+def fix_csv_file(filepath):
+    """Fix a single CSV file (kept for compatibility; returns True on success)"""
+    return repair_file(filepath)["status"] in ("clean", "fixed")
+
+
+def load_manifest(log_dir):
+    try:
+        with open(os.path.join(log_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(log_dir, manifest):
+    path = os.path.join(log_dir, MANIFEST_NAME)
+    try:
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+
+def repair_directory(log_dir=LOG_DIR, workers=None, dry_run=False, backup=True, force=False,
+                     on_result=None):
+    """Repair every *.csv in log_dir across a process pool.
+
+    Files whose size/mtime match the manifest of the last run are skipped without being read;
+    otherwise a file whose hash matches the recorded clean hash is not rewritten.
+    Returns a list of per-file results (see repair_file).
+    """
+    csv_files = sorted(f for f in os.listdir(log_dir) if f.endswith('.csv'))
+    manifest = {} if force else load_manifest(log_dir)
+    backup_dir = os.path.join(log_dir, os.path.basename(BACKUP_DIR)) if backup else None
+
+    results = []
+    todo = []
+    for name in csv_files:
+        path = os.path.join(log_dir, name)
+        st = os.stat(path)
+        entry = manifest.get(name)
+        if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            result = {"file": path, "status": "unchanged", "rows": entry.get("rows", 0), "skipped": 0,
+                      "samples": [], "sha256": entry.get("sha256"), "error": None}
+            results.append(result)
+            if on_result:
+                on_result(result)
+        else:
+            todo.append((path, entry.get("sha256") if entry else None))
+
+    def collect(result):
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(todo) <= 1:
+        for path, known in todo:
+            collect(repair_file(path, dry_run, backup_dir, known))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            futures = [pool.submit(repair_file, path, dry_run, backup_dir, known) for path, known in todo]
+            for future in concurrent.futures.as_completed(futures):
+                collect(future.result())
+
+    if not dry_run:
+        for result in results:
+            name = os.path.basename(result["file"])
+            if result["status"] in ("clean", "fixed"):
+                st = os.stat(result["file"])
+                manifest[name] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                  "sha256": result["sha256"], "rows": result["rows"]}
+            elif result["status"] != "unchanged":
+                manifest.pop(name, None)
+        save_manifest(log_dir, manifest)
+    results.sort(key=lambda r: r["file"])
+    return results
+
+
+def _print_result(result, verbose=False):
+    name = os.path.basename(result["file"])
+    status = result["status"]
+    if status == "unchanged" and not verbose:
+        return
+    if status == "error":
+        print(f"  [ERROR] {name}: {result['error']}")
+    elif status == "empty":
+        print(f"  [WARN] No valid data found in {name}")
+    elif status in ("fixed", "would_fix"):
+        tag = "OK" if status == "fixed" else "DRY"
+        verb = "Fixed" if status == "fixed" else "Would fix"
+        print(f"  [{tag}] {verb} {name}: {result['rows']} rows, {result['skipped']} errors corrected")
+    else:
+        print(f"  [{status.upper()}] {name}: {result['rows']} rows")
+    if verbose or status == "would_fix":
+        for sample in result["samples"]:
+            print(f"      [SKIP] {sample}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CSV Data Repair Tool")
+    parser.add_argument("--dir", default=LOG_DIR, help="directory containing the daily CSV files")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change, write nothing")
+    parser.add_argument("--no-backup", action="store_true", help="do not keep gzipped originals of fixed files")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and re-check every file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
     print("=" * 60)
-    print("CSV Data Repair Tool")
+    print("CSV Data Repair Tool" + (" (dry run)" if args.dry_run else ""))
     print("=" * 60)
-    
-    if not os.path.exists(LOG_DIR):
-        print(f"Log directory not found: {LOG_DIR}")
-        return
-    
-    # Find all CSV files
-    csv_files = [f for f in os.listdir(LOG_DIR) if f.endswith('.csv')]
-    
-    if not csv_files:
+
+    if not os.path.exists(args.dir):
+        print(f"Log directory not found: {args.dir}")
+        return 1
+
+    results = repair_directory(args.dir, workers=args.workers, dry_run=args.dry_run,
+                               backup=not args.no_backup, force=args.force,
+                               on_result=lambda r: _print_result(r, args.verbose))
+    if not results:
         print("No CSV files found to repair.")
-        return
-    
-    print(f"\nFound {len(csv_files)} CSV file(s) to check.")
-    
-    # Create backup
-    print(f"\nCreating backup in: {BACKUP_DIR}")
-    os.makedirs(BACKUP_DIR, exist_ok=True)
-    
-    for f in csv_files:
-        src = os.path.join(LOG_DIR, f)
-        dst = os.path.join(BACKUP_DIR, f)
-        if not os.path.exists(dst):  # Don't overwrite existing backups
-            shutil.copy2(src, dst)
-    
-    print("Backup complete.\n")
-    
-    # Fix files
-    print("Repairing files...")
-    success = 0
-    failed = 0
-    
-    for f in sorted(csv_files):
-        filepath = os.path.join(LOG_DIR, f)
-        print(f"\nProcessing: {f}")
-        if fix_csv_file(filepath):
-            success += 1
-        else:
-            failed += 1
-    
+        return 0
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
     print("\n" + "=" * 60)
-    print(f"Repair complete: {success} success, {failed} failed")
-    print(f"Original files backed up to: {BACKUP_DIR}")
+    print("Repair complete: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    if counts.get("fixed") and not args.no_backup:
+        print(f"Original files backed up to: {os.path.join(args.dir, os.path.basename(BACKUP_DIR))}")
     print("=" * 60)
+    return 1 if counts.get("error") else 0
 
 
 if __name__ == "__main__":
-    main()
-    input("\nPress Enter to exit...")
+    sys.exit(main())
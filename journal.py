@@ -0,0 +1,161 @@
+# journal.py - 待分类日志行的预写日志（WAL）
+# _commit_log 生成的行先追加到 journal，批次分类完成（入库或写入 failed/）后再确认；
+# 进程崩溃或被强制结束后，下次启动时重放未确认的行
+
+import os
+import bisect
+import threading
+
+import common
+
+# 记录格式（每行一条）：
+#   + <seq> <log_line>   追加一条待分类日志
+#   - <start> <end>      确认 start..end 之间的记录已处理完
+COMPACT_BYTES = 64 * 1024
+
+
+class LogJournal:
+    """追加写入、批量 fsync 的日志缓冲预写日志
+
+    fsync_interval=0 时每次写入都 fsync；>0 时由后台线程最多每 fsync_interval 秒 fsync 一次；
+    <0 时只写入操作系统缓存（进程崩溃不丢，断电可能丢）。
+    """
+
+    def __init__(self, path=None, fsync_interval=1.0):
+        self.path = path or common.JOURNAL_PATH
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.next_seq = 1
+        self.flushed_upto = 0
+        self.batches = {}
+        self.dirty = False
+        self.appends = 0
+        self.fsyncs = 0
+        self.recovered = self._load()
+        self.file = open(self.path, "a", encoding="utf-8")
+
+        self.closed = threading.Event()
+        self.thread = None
+        if fsync_interval > 0:
+            self.thread = threading.Thread(target=self._sync_loop, name="journal-sync", daemon=True)
+            self.thread.start()
+
+    def _load(self):
+        """读取旧 journal，返回未确认的 [(seq, line)]，并把文件压缩为只含这些记录"""
+        entries = {}
+        done = []
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for record in f:
+                    kind, _, rest = record.rstrip("\n").partition(" ")
+                    try:
+                        if kind == "+":
+                            seq, _, line = rest.partition(" ")
+                            entries[int(seq)] = line
+                        elif kind == "-":
+                            start, end = rest.split()
+                            done.append((int(start), int(end)))
+                    except ValueError:
+                        # 崩溃时写了一半的最后一行
+                        continue
+        except OSError:
+            return []
+
+        # 确认区间互不重叠，按起点排序后二分查找
+        done.sort()
+        starts = [start for start, _ in done]
+
+        def processed(seq):
+            i = bisect.bisect_right(starts, seq) - 1
+            return i >= 0 and seq <= done[i][1]
+
+        live = sorted((seq, line) for seq, line in entries.items() if not processed(seq))
+        # 文件只保留未确认的记录，已确认的序号可以复用
+        self.next_seq = live[-1][0] + 1 if live else 1
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(f"+ {seq} {line}\n" for seq, line in live)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if live:
+            common.log(f"Journal: {len(live)} unprocessed lines recovered "
+                       f"({len(entries) - len(live)} already processed)")
+        return live
+
+    def _write(self, text):
+        self.file.write(text)
+        self.file.flush()
+        if self.fsync_interval == 0:
+            os.fsync(self.file.fileno())
+            self.fsyncs += 1
+        else:
+            self.dirty = True
+
+    def append(self, line):
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self._write(f"+ {seq} {line}\n")
+            self.appends += 1
+            return seq
+
+    def take_batch(self, upto=None):
+        """把 upto（默认全部）之前尚未提交的记录划为一个批次，返回 (start, end)，没有则返回 None"""
+        with self.lock:
+            end = self.next_seq - 1 if upto is None else upto
+            if end <= self.flushed_upto:
+                return None
+            batch = (self.flushed_upto + 1, end)
+            self.flushed_upto = end
+            self.batches[batch[0]] = batch[1]
+            return batch
+
+    def ack(self, batch):
+        """批次已入库或已写入 failed/；全部确认后截断文件"""
+        if not batch:
+            return
+        with self.lock:
+            if self.batches.pop(batch[0], None) is None or self.file.closed:
+                return
+            self._write(f"- {batch[0]} {batch[1]}\n")
+            if not self.batches and self.flushed_upto == self.next_seq - 1 \
+                    and self.file.tell() > COMPACT_BYTES:
+                self.file.truncate(0)
+                self.file.seek(0)
+
+    def sync(self):
+        # fsync 在锁外进行，慢盘上也不阻塞主循环的追加
+        with self.lock:
+            if not self.dirty or self.file.closed:
+                return
+            self.dirty = False
+            fd = self.file.fileno()
+            self.fsyncs += 1
+        os.fsync(fd)
+
+    def _sync_loop(self):
+        while not self.closed.wait(self.fsync_interval):
+            try:
+                self.sync()
+            except (OSError, ValueError) as e:
+                common.log(f"Journal fsync failed: {e}")
+
+    def close(self):
+        self.closed.set()
+        if self.thread:
+            self.thread.join(5)
+        if self.fsync_interval >= 0:
+            self.sync()
+        with self.lock:
+            self.file.close()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "appends": self.appends,
+                "fsyncs": self.fsyncs,
+                "pending_lines": self.next_seq - 1 - self.flushed_upto,
+                "open_batches": len(self.batches),
+            }
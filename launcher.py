@@ -4,21 +4,27 @@
 import subprocess
 import sys
 import os
+import json
 import threading
 import time
 import webbrowser
 import signal
+import urllib.request
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 os.chdir(SCRIPT_DIR)
 
 WEBUI_PORT = 8502
+PROFILE_SECONDS = 60
+SUMMARY_INTERVAL = 15
 
 # Globals
 tracker_proc = None
 webui_proc = None
 log_proc = None
 running = True
+tracker_summary = ["Tracker metrics unavailable"]
+profiling = False
 
 
 def start_tracker():
@@ -73,6 +79,25 @@ def open_log_window():
         os.system(f'gnome-terminal -- tail -f "{log_path}" &')
 
 
+def read_metrics_endpoint():
+    """Port and token of the running tracker (logs/metrics_endpoint.json)"""
+    try:
+        with open(os.path.join(SCRIPT_DIR, "logs", "metrics_endpoint.json"), encoding="utf-8") as f:
+            endpoint = json.load(f)
+        return endpoint["port"], endpoint["token"]
+    except (OSError, ValueError, KeyError):
+        raise ConnectionError("Tracker metrics endpoint not found")
+
+
+def metrics_request(path, post=False, timeout=2):
+    """Call the tracker metrics endpoint, return the decoded JSON"""
+    port, token = read_metrics_endpoint()
+    req = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=b"" if post else None,
+                                 method="POST" if post else "GET", headers={"X-Tracker-Token": token})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
 def stop_all():
     global tracker_proc, webui_proc, running
     running = False
@@ -124,6 +149,41 @@ def main_with_tray():
     
     def on_log(icon, item):
         open_log_window()
+
+    def status_items():
+        return [pystray.MenuItem(line, None, enabled=False) for line in tracker_summary]
+
+    def toggle_profile():
+        global profiling
+        try:
+            if profiling:
+                status = metrics_request("/profile/stop", post=True, timeout=10)
+                icon.notify(f"Hot stacks saved: {status['path']}", "AI Time Tracker")
+            else:
+                metrics_request(f"/profile/start?seconds={PROFILE_SECONDS}", post=True)
+                icon.notify(f"Profiling tracker for {PROFILE_SECONDS}s", "AI Time Tracker")
+            profiling = not profiling
+        except Exception as e:
+            icon.notify(f"Profiler unavailable: {e}", "AI Time Tracker")
+        icon.update_menu()
+
+    def on_profile(icon, item):
+        threading.Thread(target=toggle_profile, daemon=True).start()
+
+    def poll_summary():
+        """Refresh the tracker summary shown in the tray menu"""
+        global tracker_summary, profiling
+        while running:
+            try:
+                tracker_summary = metrics_request("/summary")
+                status = metrics_request("/profile")
+                if profiling and not status["running"] and status["last_path"]:
+                    icon.notify(f"Hot stacks saved: {status['last_path']}", "AI Time Tracker")
+                profiling = status["running"]
+            except Exception:
+                tracker_summary = ["Tracker metrics unavailable"]
+            icon.update_menu()
+            time.sleep(SUMMARY_INTERVAL)
     
     def on_quit(icon, item):
         stop_all()
@@ -142,11 +202,14 @@ def main_with_tray():
     menu = pystray.Menu(
         pystray.MenuItem("Open Dashboard", on_open, default=True),
         pystray.MenuItem("View Log", on_log),
+        pystray.MenuItem("Tracker Status", pystray.Menu(status_items)),
+        pystray.MenuItem(f"Profile Tracker ({PROFILE_SECONDS}s)", on_profile, checked=lambda item: profiling),
         pystray.Menu.SEPARATOR,
         pystray.MenuItem("Exit", on_quit)
     )
     
     icon = pystray.Icon("TimeTracker", create_icon(), "AI Time Tracker", menu)
+    threading.Thread(target=poll_summary, daemon=True).start()
     icon.run()
 
 
@@ -0,0 +1,387 @@
+# live.py - tracker → webui 实时推送
+# tracker 把新入库的记录和当前活动通过 127.0.0.1 上的 TCP 连接推送给仪表盘（每行一条 JSON），
+# 仪表盘在内存中合并增量；记录事件带着写入前后当天的存储版本，合并后仪表盘直接采用新版本，不需要重读磁盘
+
+import os
+import sys
+import hmac
+import json
+import time
+import socket
+import secrets
+import select
+import threading
+from collections import deque
+
+import common
+
+DEFAULT_PORT = 47833
+# 本次运行实际绑定的端口和握手用的 token；仪表盘读取它来连接
+ENDPOINT_PATH = os.path.join(common.LOG_DIR, "live_endpoint.json")
+
+# 消息格式：
+#   订阅端 -> 发布端  {"token": ..., "epoch": ..., "since": seq}   连接后发送一次；token 不对直接断开，
+#                     epoch / since 用于断线续传
+#   发布端 -> 订阅端  {"type": "hello", "epoch", "seq", "now", "resume"}
+#                     {"type": "rows", "seq", "date", "rows": [[开始, 结束, 分类, 详情], ...], "before", "after"}
+#                       before / after：这次写入前后当天的存储版本（storage.DayWrite），未知时为 null
+#                     {"type": "now", "process", "title", "url", "start", "idle"}
+
+
+def _encode(message):
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _version(value):
+    # CSV 的版本是 (mtime_ns, size)，经 JSON 传输后变成列表
+    return tuple(value) if isinstance(value, list) else value
+
+
+class _Client:
+    """一个订阅连接：待发送字节缓冲，超过 limit 说明订阅端跟不上"""
+    __slots__ = ("conn", "buffer", "limit")
+
+    def __init__(self, conn, initial, max_buffer):
+        self.conn = conn
+        self.buffer = bytearray(initial)
+        # 续传的积压事件不计入上限
+        self.limit = len(initial) + max_buffer
+
+
+class LivePublisher:
+    """tracker 端：接受订阅连接并广播事件；保留最近 history 条记录事件供断线续传
+
+    publish_* 只把消息追加到各订阅端的缓冲区（不做网络 I/O），由发送线程用非阻塞 socket 写出；
+    缓冲超过 max_buffer 字节的订阅端直接断开，卡住的仪表盘页面不会拖慢 tracker。
+    """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, history=2000, max_buffer=256 * 1024,
+                 handshake_timeout=2, endpoint_path=None):
+        self.epoch = f"{time.time():.6f}"
+        self.token = secrets.token_urlsafe(24)
+        self.endpoint_path = endpoint_path
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.history = deque(maxlen=history)
+        self.now = None
+        self.clients = []
+        self.closing = []
+        self.max_buffer = max_buffer
+        self.handshake_timeout = handshake_timeout
+        self.sent = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.closed = False
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if sys.platform == "win32":
+            # Windows 上 SO_REUSEADDR 允许其他进程抢绑同一端口，改用独占绑定
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        else:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(8)
+        self.port = self.server.getsockname()[1]
+        if endpoint_path:
+            self._write_endpoint()
+        # 发送线程阻塞在 select 上，有新数据时通过这对 socket 唤醒
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.wake_recv.setblocking(False)
+        self.wake_send.setblocking(False)
+        self.thread = threading.Thread(target=self._accept_loop, name="live-accept", daemon=True)
+        self.thread.start()
+        self.sender = threading.Thread(target=self._send_loop, name="live-send", daemon=True)
+        self.sender.start()
+
+    def _write_endpoint(self):
+        """写入端口和 token，只有当前用户可读"""
+        tmp_path = self.endpoint_path + ".tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"port": self.port, "token": self.token, "pid": os.getpid()}, f)
+            os.replace(tmp_path, self.endpoint_path)
+        except OSError as e:
+            common.log(f"Live endpoint file failed: {e}")
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handshake, args=(conn,), name="live-client", daemon=True).start()
+
+    def _handshake(self, conn):
+        try:
+            conn.settimeout(self.handshake_timeout)
+            request = json.loads(conn.makefile("rb").readline() or b"{}")
+            conn.setblocking(False)
+            token = str(request.get("token") or "")
+        except (OSError, ValueError, AttributeError):
+            conn.close()
+            return
+        with self.lock:
+            if self.closed:
+                conn.close()
+                return
+            if not hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8")):
+                # 本机其他用户的进程也能连上 127.0.0.1，不带本次运行 token 的连接直接断开
+                self.rejected += 1
+                conn.close()
+                return
+            since = request.get("since", 0) if request.get("epoch") == self.epoch else None
+            # 订阅端错过的事件还在 history 中时续传，否则让它从磁盘重新载入
+            resume = since is not None and (since >= self.seq or
+                                            (self.history and self.history[0]["seq"] <= since + 1))
+            backlog = [event for event in self.history if event["seq"] > since] if resume else []
+            initial = _encode({"type": "hello", "epoch": self.epoch, "seq": self.seq,
+                               "now": self.now, "resume": resume})
+            initial += b"".join(_encode(event) for event in backlog)
+            self.clients.append(_Client(conn, initial, self.max_buffer))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self.wake_send.send(b"\0")
+        except OSError:
+            # 缓冲已满说明发送线程已有待处理的唤醒
+            pass
+
+    def _drop(self, client):
+        # 调用方持有锁；socket 由发送线程关闭，避免关闭正在 select 的描述符
+        if client in self.clients:
+            self.clients.remove(client)
+            self.closing.append(client.conn)
+            self.dropped += 1
+
+    def _broadcast(self, data):
+        # 调用方持有锁；只追加到缓冲区，跟不上的订阅端直接断开
+        for client in list(self.clients):
+            if len(client.buffer) + len(data) > client.limit:
+                self._drop(client)
+                continue
+            client.buffer += data
+            self.sent += 1
+        self._wake()
+
+    def _send_loop(self):
+        while True:
+            with self.lock:
+                if self.closed:
+                    return
+                closing, self.closing = self.closing, []
+                pending = [client for client in self.clients if client.buffer]
+            for conn in closing:
+                conn.close()
+            try:
+                readable, writable, _ = select.select([self.wake_recv], [c.conn for c in pending], [])
+            except (OSError, ValueError):
+                continue
+            if readable:
+                try:
+                    while self.wake_recv.recv(4096):
+                        pass
+                except OSError:
+                    pass
+            for client in pending:
+                if client.conn not in writable:
+                    continue
+                with self.lock:
+                    data = bytes(client.buffer)
+                try:
+                    count = client.conn.send(data)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    with self.lock:
+                        self._drop(client)
+                    continue
+                with self.lock:
+                    # 发送期间追加的数据都在末尾，从头删除已发送的部分即可
+                    del client.buffer[:count]
+
+    def publish_rows(self, date_str, rows, write=None):
+        if not rows:
+            return
+        with self.lock:
+            self.seq += 1
+            event = {"type": "rows", "seq": self.seq, "date": date_str, "rows": [list(row) for row in rows],
+                     "before": write.before if write else None, "after": write.after if write else None}
+            self.history.append(event)
+            self._broadcast(_encode(event))
+
+    def publish_now(self, process, title, url, start, idle=False):
+        with self.lock:
+            self.now = {"process": process, "title": title, "url": url, "start": start, "idle": idle}
+            self._broadcast(_encode(dict(self.now, type="now")))
+
+    def get_stats(self):
+        with self.lock:
+            return {"clients": len(self.clients), "seq": self.seq, "sent": self.sent, "dropped": self.dropped,
+                    "rejected": self.rejected, "buffered": sum(len(client.buffer) for client in self.clients)}
+
+    def close(self):
+        try:
+            # 先 shutdown 唤醒阻塞在 accept 中的线程，端口才会立即释放
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+        self.thread.join(1)
+        with self.lock:
+            self.closed = True
+        self._wake()
+        self.sender.join(1)
+        with self.lock:
+            for conn in self.closing + [client.conn for client in self.clients]:
+                conn.close()
+            self.clients = []
+            self.closing = []
+        self.wake_recv.close()
+        self.wake_send.close()
+        if self.endpoint_path:
+            try:
+                os.remove(self.endpoint_path)
+            except OSError:
+                pass
+
+
+class LiveSubscriber:
+    """webui 端：后台线程保持连接（断开后每 retry 秒重连），在内存中累积增量
+
+    generation 在 tracker 重启或续传失败时加一，读取端据此丢弃旧的增量并从磁盘重新载入；
+    增量最多保留 keep_seconds 秒 / max_events 条，基准更旧的读取端同样需要重新载入。
+    endpoint_path: 每次连接前从这个文件读取端口和 token（tracker 每次启动都会重新生成）；
+    不给时使用 port / token 参数。
+    """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, token=None, endpoint_path=None, retry=5,
+                 keep_seconds=1800, max_events=5000):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.endpoint_path = endpoint_path
+        self.retry = retry
+        self.keep_seconds = keep_seconds
+        self.max_events = max_events
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.connected = False
+        self.epoch = None
+        self.seq = 0
+        self.generation = 0
+        self.events = deque()
+        self.floor = 0
+        self.now = None
+        self.updated_at = None
+        self.conn = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="live-subscribe", daemon=True)
+        self.thread.start()
+
+    def _endpoint(self):
+        if not self.endpoint_path:
+            return self.port, self.token
+        with open(self.endpoint_path, "r", encoding="utf-8") as f:
+            endpoint = json.load(f)
+        return endpoint["port"], endpoint["token"]
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                port, token = self._endpoint()
+                with socket.create_connection((self.host, port), timeout=self.retry) as conn:
+                    conn.settimeout(None)
+                    with self.lock:
+                        if self.stop_event.is_set():
+                            return
+                        self.conn = conn
+                        conn.sendall(_encode({"token": token, "epoch": self.epoch, "since": self.seq}))
+                    for line in conn.makefile("rb"):
+                        self._handle(json.loads(line))
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+            with self.lock:
+                self.conn = None
+                self.connected = False
+            self.stop_event.wait(self.retry)
+
+    def _handle(self, message):
+        with self.changed:
+            kind = message.get("type")
+            if kind == "hello":
+                if not message["resume"]:
+                    self.events.clear()
+                    self.floor = 0
+                    self.generation += 1
+                self.epoch = message["epoch"]
+                self.seq = message["seq"] if not message["resume"] else self.seq
+                self.now = message["now"]
+                self.connected = True
+            elif kind == "rows":
+                self.seq = message["seq"]
+                now = time.time()
+                self.events.append((message["seq"], now, message["date"], message["rows"],
+                                    _version(message.get("before")), _version(message.get("after"))))
+                while len(self.events) > self.max_events or now - self.events[0][1] > self.keep_seconds:
+                    self.floor = self.events.popleft()[0]
+            elif kind == "now":
+                self.now = {k: message.get(k) for k in ("process", "title", "url", "start", "idle")}
+            self.updated_at = time.time()
+            self.changed.notify_all()
+
+    def position(self):
+        """(generation, seq)：载入磁盘数据之前记下，之后用 rows_since 取增量"""
+        with self.lock:
+            return self.generation, self.seq
+
+    def rows_since(self, generation, seq):
+        """返回 seq 之后的 [(日期, 行)]；generation 已变化或增量已被丢弃时返回 None（需要重新载入）"""
+        with self.lock:
+            if generation != self.generation or seq < self.floor:
+                return None
+            return [(date_str, row) for event_seq, _, date_str, rows, _, _ in self.events if event_seq > seq
+                    for row in rows]
+
+    def events_since(self, generation, seq):
+        """同 rows_since，按事件返回 [(日期, 行列表, 写入前版本, 写入后版本)]"""
+        with self.lock:
+            if generation != self.generation or seq < self.floor:
+                return None
+            return [(date_str, rows, before, after)
+                    for event_seq, _, date_str, rows, before, after in self.events if event_seq > seq]
+
+    def get_now(self):
+        with self.lock:
+            return self.now if self.connected else None
+
+    def wait(self, seq, timeout):
+        """等待 seq 之后的新事件，返回是否有新事件"""
+        with self.changed:
+            return self.changed.wait_for(lambda: self.seq != seq, timeout)
+
+    def close(self):
+        with self.lock:
+            self.stop_event.set()
+            conn = self.conn
+        if conn:
+            try:
+                # 先 shutdown 唤醒阻塞在读取上的后台线程
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+        self.thread.join(1)
+
+
+def create_publisher(config=None):
+    """按 config.json 的 live_push / live_port 创建发布端；端口被占用时返回 None"""
+    config = config or common.load_config()
+    if not config.get("live_push", True):
+        return None
+    try:
+        return LivePublisher(port=config.get("live_port", DEFAULT_PORT), endpoint_path=ENDPOINT_PATH)
+    except OSError as e:
+        common.log(f"Live push disabled: {e}")
+        return None
@@ -0,0 +1,493 @@
+# metrics.py - tracker 运行指标与采样分析
+# 主循环 / 探测 / AI 请求的耗时和计数记在进程内的 MetricsRegistry 中；
+# 通过 127.0.0.1 上的 HTTP 端口提供 Prometheus 文本格式和 JSON，并定期写入 logs/metrics.json
+
+import os
+import sys
+import hmac
+import json
+import time
+import bisect
+import secrets
+import threading
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import psutil
+
+import common
+
+DEFAULT_PORT = 47834
+SNAPSHOT_PATH = os.path.join(common.LOG_DIR, "metrics.json")
+# 本次运行实际绑定的端口和 POST 用的 token；launcher 读取它来调用端点
+ENDPOINT_PATH = os.path.join(common.LOG_DIR, "metrics_endpoint.json")
+TOKEN_HEADER = "X-Tracker-Token"
+LOCAL_HOSTS = {"127.0.0.1", "localhost"}
+# 秒；覆盖主循环的亚毫秒处理到 AI 请求的几十秒
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 线程阻塞等待时停在这些函数里，不计入热点
+IDLE_LEAVES = {"wait", "select", "poll", "accept", "recv_into", "readinto", "get", "sleep", "_wait_for_tstate_lock"}
+
+# 端点：
+#   GET  /metrics         Prometheus 文本格式
+#   GET  /metrics.json    JSON 快照（与 logs/metrics.json 相同）
+#   GET  /summary         托盘菜单用的几行摘要 ["...", ...]
+#   GET  /profile         采样分析状态
+#   POST /profile/start   开始采样（?seconds=N 到时自动停止并导出）
+#   POST /profile/stop    停止采样，把热点调用栈写入 logs/profile_*.txt，返回路径
+# Host 头不是 127.0.0.1 / localhost 的请求一律 403（防 DNS rebinding）；
+# POST 还需带 X-Tracker-Token 头，值为 logs/metrics_endpoint.json 中的 token（每次启动重新生成）
+
+
+class Histogram:
+    """累计分桶（Prometheus histogram）+ 最近 window 个样本（JSON 快照里的分位数）"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=1000):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.recent.append(value)
+
+    def snapshot(self):
+        with self.lock:
+            samples = sorted(self.recent)
+            count, total, counts = self.count, self.sum, list(self.counts)
+
+        def pct(p):
+            return round(samples[min(int(len(samples) * p), len(samples) - 1)] * 1000, 2) if samples else 0.0
+
+        return {
+            "count": count,
+            "sum": total,
+            "buckets": counts,
+            "p50_ms": pct(0.5),
+            "p90_ms": pct(0.9),
+            "p99_ms": pct(0.99),
+            "max_ms": round(samples[-1] * 1000, 2) if samples else 0.0,
+        }
+
+
+class MetricsRegistry:
+    """进程内指标：计数器 / 仪表 / 直方图，均可带标签
+
+    热路径上只做一次加锁的加法；队列深度、缓存命中等已有统计由 collector 在导出时读取，
+    不在各模块里重复计数。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}
+        self.values = {}
+        self.histograms = {}
+        self.collectors = []
+        self.started = time.time()
+
+    def _describe(self, name, kind, help_text):
+        with self.lock:
+            self.meta.setdefault(name, (kind, help_text))
+            self.values.setdefault(name, {})
+
+    def counter(self, name, help_text):
+        self._describe(name, "counter", help_text)
+
+    def gauge(self, name, help_text):
+        self._describe(name, "gauge", help_text)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._describe(name, "histogram", help_text)
+        with self.lock:
+            return self.histograms.setdefault(name, Histogram(buckets))
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value):
+        self.histograms[name].observe(value)
+
+    def prune(self, name, label, keep):
+        """只保留 label 取值最大的 keep 组（如按日期的计数只留最近几天）"""
+        with self.lock:
+            series = self.values[name]
+            latest = sorted({dict(key).get(label) for key in series})[-keep:]
+            for key in [k for k in series if dict(k).get(label) not in latest]:
+                del series[key]
+
+    def add_collector(self, func):
+        """func(registry) 在每次导出前调用，用 set() 刷新仪表值"""
+        self.collectors.append(func)
+
+    def collect(self):
+        for func in self.collectors:
+            try:
+                func(self)
+            except Exception as e:
+                common.log(f"Metrics collector failed: {e}", "DEBUG")
+        with self.lock:
+            values = {name: dict(series) for name, series in self.values.items()}
+            meta = dict(self.meta)
+        histograms = {name: h.snapshot() for name, h in self.histograms.items()}
+        return meta, values, histograms
+
+    def snapshot(self):
+        """JSON 形式：{"time", "uptime", "metrics": {名称: 值 / {标签: 值} / 直方图摘要}}"""
+        meta, values, histograms = self.collect()
+        metrics = {}
+        for name in sorted(meta):
+            if meta[name][0] == "histogram":
+                summary = dict(histograms[name])
+                del summary["buckets"]
+                metrics[name] = summary
+                continue
+            series = values.get(name, {})
+            if list(series) in ([()], []):
+                metrics[name] = series.get((), 0)
+            else:
+                metrics[name] = {",".join(f"{k}={v}" for k, v in key): value for key, value in sorted(series.items())}
+        return {
+            "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "uptime": round(time.time() - self.started, 1),
+            "metrics": metrics,
+        }
+
+    def render_prometheus(self):
+        meta, values, histograms = self.collect()
+        lines = []
+        for name in sorted(meta):
+            kind, help_text = meta[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                h = histograms[name]
+                cumulative = 0
+                for bound, count in zip(self.histograms[name].buckets + ("+Inf",), h["buckets"]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum {h['sum']:.6f}")
+                lines.append(f"{name}_count {h['count']}")
+                continue
+            for key, value in sorted(values.get(name, {}).items()):
+                labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def process_collector(registry):
+    """本进程的常驻内存、CPU 时间和线程数（psutil）"""
+    registry.gauge("process_resident_memory_bytes", "Resident set size of the tracker process")
+    registry.counter("process_cpu_seconds_total", "User + system CPU time of the tracker process")
+    registry.gauge("tracker_cpu_percent", "CPU usage since the previous collection (100 = one core)")
+    registry.gauge("process_num_threads", "Threads in the tracker process")
+    proc = psutil.Process()
+    proc.cpu_percent(None)
+
+    def collect(reg):
+        with proc.oneshot():
+            cpu = proc.cpu_times()
+            reg.set("process_resident_memory_bytes", proc.memory_info().rss)
+            reg.set("process_cpu_seconds_total", round(cpu.user + cpu.system, 3))
+            reg.set("tracker_cpu_percent", proc.cpu_percent(None))
+            reg.set("process_num_threads", proc.num_threads())
+
+    registry.add_collector(collect)
+
+
+def summary_lines(snapshot):
+    """托盘菜单显示的摘要"""
+    m = snapshot["metrics"]
+
+    def series_sum(name):
+        value = m.get(name, 0)
+        return sum(value.values()) if isinstance(value, dict) else value
+
+    today = common.get_today_str()
+    written = m.get("tracker_bytes_written_total", {})
+    today_bytes = sum(v for k, v in written.items() if f"day={today}" in k.split(",")) \
+        if isinstance(written, dict) else 0
+    tick = m.get("tracker_loop_tick_seconds", {})
+    ai = m.get("tracker_ai_request_seconds", {})
+    hours, rest = divmod(int(snapshot["uptime"]), 3600)
+    return [
+        f"Up {hours}h{rest // 60:02d}m  RSS {m.get('process_resident_memory_bytes', 0) / 2**20:.0f} MB  "
+        f"CPU {m.get('tracker_cpu_percent', 0):.1f}%",
+        f"Loop p99 {tick.get('p99_ms', 0):.1f} ms  wakeups {tick.get('count', 0)}",
+        f"AI p50 {ai.get('p50_ms', 0) / 1000:.1f}s  requests {ai.get('count', 0)}  "
+        f"retries {series_sum('tracker_ai_retries_total')}",
+        f"Queue {m.get('tracker_ai_queue_depth', 0)}  in-flight {m.get('tracker_ai_in_flight', 0)}  "
+        f"buffer {m.get('tracker_buffer_lines', 0)} lines",
+        f"Written today {today_bytes / 1024:.1f} KB",
+    ]
+
+
+class SamplingProfiler:
+    """后台线程每 interval 秒抓取一次所有线程的调用栈，按折叠栈计数
+
+    导出文件为「线程;外层函数;...;内层函数 次数」格式（可直接交给火焰图工具），
+    前面附带按叶子函数统计的热点。不采样时没有任何开销。
+    """
+
+    def __init__(self, interval=0.01, max_depth=48):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_path = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds=None):
+        """开始采样；seconds 到时自动停止并导出。已在采样时返回 False"""
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.started = time.time()
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, args=(seconds,), name="profiler", daemon=True)
+            self.thread.start()
+        common.log(f"Profiler started ({f'{seconds:g}s' if seconds else 'until stopped'}, every {self.interval * 1000:.0f}ms)")
+        return True
+
+    def stop(self):
+        """停止采样并导出，返回导出文件路径；没有在采样时返回上一次的路径"""
+        thread = self.thread
+        if thread is None:
+            return self.last_path
+        self.stop_event.set()
+        if thread is not threading.current_thread():
+            thread.join(5)
+        with self.lock:
+            if self.thread is thread:
+                self.thread = None
+                self.last_path = self.dump()
+        return self.last_path
+
+    def _run(self, seconds):
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds if seconds else None
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            if deadline and time.monotonic() >= deadline:
+                threading.Thread(target=self.stop, name="profiler-stop", daemon=True).start()
+                return
+
+    def dump(self, top=40):
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(common.LOG_DIR, f"profile_{stamp}.txt")
+        # 等待在 wait / select 上的空闲线程对热点没有意义，只在折叠栈里保留
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            if leaf.split(" (", 1)[0] not in IDLE_LEAVES:
+                leaves[leaf] += count
+        total = sum(self.stacks.values()) or 1
+        elapsed = time.time() - self.started
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(f"# {self.samples} samples over {elapsed:.1f}s, interval {self.interval * 1000:.0f}ms\n")
+            f.write("# hot functions (self samples, threads blocked in wait/select excluded)\n")
+            for leaf, count in leaves.most_common(top):
+                f.write(f"#   {count / total:6.1%} {count:>7} {leaf}\n")
+            f.write("# folded stacks\n")
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(tmp_path, path)
+        common.log(f"Profiler: {self.samples} samples -> {path}")
+        return path
+
+    def get_status(self):
+        return {"running": self.running, "samples": self.samples, "last_path": self.last_path}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    exporter = None
+
+    def _send(self, status, body, content_type="application/json; charset=utf-8"):
+        data = body.encode("utf-8") if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _json(self, value, status=200):
+        self._send(status, json.dumps(value, ensure_ascii=False))
+
+    def _local_host(self):
+        """Host 头必须是 127.0.0.1 / localhost（可带端口），否则回 403"""
+        name, _, port = self.headers.get("Host", "").partition(":")
+        if name in LOCAL_HOSTS and (not port or port.isdigit()):
+            return True
+        self._json({"error": "forbidden host"}, 403)
+        return False
+
+    def do_GET(self):
+        if not self._local_host():
+            return
+        exporter = self.exporter
+        path = urlparse(self.path).path
+        try:
+            if path == "/metrics":
+                self._send(200, exporter.registry.render_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+            elif path == "/metrics.json":
+                self._json(exporter.registry.snapshot())
+            elif path == "/summary":
+                self._json(summary_lines(exporter.registry.snapshot()))
+            elif path == "/profile" and exporter.profiler:
+                self._json(exporter.profiler.get_status())
+            else:
+                self._json({"error": "not found"}, 404)
+        except Exception as e:
+            self._json({"error": str(e)}, 500)
+            common.log(f"Metrics request failed: {traceback.format_exc(limit=3)}", "DEBUG")
+
+    def do_POST(self):
+        if not self._local_host():
+            return
+        token = self.headers.get(TOKEN_HEADER, "")
+        if not hmac.compare_digest(token.encode("utf-8"), self.exporter.token.encode("utf-8")):
+            self._json({"error": "invalid token"}, 403)
+            return
+        profiler = self.exporter.profiler
+        url = urlparse(self.path)
+        if not profiler or url.path not in ("/profile/start", "/profile/stop"):
+            self._json({"error": "not found"}, 404)
+            return
+        if url.path == "/profile/start":
+            try:
+                seconds = float(parse_qs(url.query).get("seconds", ["0"])[0]) or None
+            except ValueError:
+                self._json({"error": "bad seconds"}, 400)
+                return
+            started = profiler.start(seconds)
+            self._json(dict(profiler.get_status(), started=started))
+        else:
+            path = profiler.stop()
+            self._json(dict(profiler.get_status(), path=path))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsExporter:
+    """HTTP 端点（只绑定 127.0.0.1）+ 每 snapshot_interval 秒写一次 JSON 快照"""
+
+    def __init__(self, registry, host="127.0.0.1", port=DEFAULT_PORT, snapshot_path=SNAPSHOT_PATH,
+                 snapshot_interval=60, profiler=None, endpoint_path=ENDPOINT_PATH):
+        self.registry = registry
+        self.profiler = profiler
+        self.token = secrets.token_urlsafe(24)
+        self.endpoint_path = endpoint_path
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.server = None
+        if port is not None:
+            handler = type("MetricsHandler", (_Handler,), {"exporter": self})
+            try:
+                self.server = ThreadingHTTPServer((host, port), handler)
+                self.server.daemon_threads = True
+            except OSError as e:
+                common.log(f"Metrics endpoint disabled: {e}")
+            else:
+                threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        self.port = self.server.server_address[1] if self.server else None
+        if self.port and endpoint_path:
+            self._write_endpoint()
+        self.stop_event = threading.Event()
+        self.thread = None
+        if snapshot_path and snapshot_interval > 0:
+            self.thread = threading.Thread(target=self._snapshot_loop, name="metrics-snapshot", daemon=True)
+            self.thread.start()
+
+    def _write_endpoint(self):
+        """写入端口和 token，只有当前用户可读"""
+        tmp_path = self.endpoint_path + ".tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"port": self.port, "token": self.token, "pid": os.getpid()}, f)
+            os.replace(tmp_path, self.endpoint_path)
+        except OSError as e:
+            common.log(f"Metrics endpoint file failed: {e}")
+
+    def write_snapshot(self):
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.registry.snapshot(), f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            common.log(f"Metrics snapshot failed: {e}")
+
+    def _snapshot_loop(self):
+        while not self.stop_event.wait(self.snapshot_interval):
+            self.write_snapshot()
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(5)
+            self.write_snapshot()
+        if self.profiler and self.profiler.running:
+            self.profiler.stop()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            if self.endpoint_path:
+                try:
+                    os.remove(self.endpoint_path)
+                except OSError:
+                    pass
+
+
+def create_exporter(registry, config=None):
+    """按 config.json 的 metrics_* 配置启动导出端；metrics_enabled=false 时返回 None"""
+    config = config or common.load_config()
+    if not config.get("metrics_enabled", True):
+        return None
+    profiler = None
+    if config.get("metrics_profiler", True):
+        profiler = SamplingProfiler(interval=config.get("profile_interval_ms", 10) / 1000)
+    return MetricsExporter(registry, port=config.get("metrics_port", DEFAULT_PORT),
+                           snapshot_interval=config.get("metrics_snapshot_interval", 60),
+                           profiler=profiler)
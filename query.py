@@ -0,0 +1,331 @@
+# query.py - 仪表盘共享查询服务
+# 进程内只保留一份按天索引的明细与汇总，所有浏览器会话和重跑共用同一份数据；
+# 相同查询并发到达时只计算一次，磁盘上只重读版本变化的日期
+
+import os
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+import pandas as pd
+
+import common
+import storage
+import analysis
+
+# 一个日期范围（或其按分类筛选后）的查询结果；所有会话共享，调用方不得原地修改
+RangeData = namedtuple("RangeData", "key frame daily hourly categories")
+
+EMPTY_DAILY = pd.DataFrame(columns=['日期', '分类', '分钟'])
+EMPTY_HOURLY = pd.DataFrame(columns=['日期', '小时', '分类', '分钟'])
+
+
+class SingleFlight:
+    """相同键的并发调用只执行一次，其余调用等待并共享同一结果（或异常）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.shared = 0
+
+    def do(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event(), "result": None, "error": None}
+            else:
+                self.shared += 1
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = func()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+
+class DayData:
+    """一天的明细帧与汇总；version 为载入时的磁盘版本，stamp 在内容变化时递增
+
+    daily / hourly 取自存储层按天维护的汇总，收到推送时只叠加新记录的部分。
+    """
+    __slots__ = ("version", "frame", "daily", "hourly", "stamp", "bytes")
+
+    def __init__(self, version, frame, daily, hourly, stamp):
+        self.version = version
+        self.set_frame(frame, stamp, daily, hourly)
+
+    def set_frame(self, frame, stamp, daily, hourly):
+        self.frame = frame
+        self.daily = daily
+        self.hourly = hourly
+        self.stamp = stamp
+        self.bytes = int(frame.memory_usage(deep=True).sum()) if not frame.empty else 0
+
+
+def _add_minutes(base, delta, keys):
+    """两份汇总按 keys 相加"""
+    if base.empty:
+        return delta
+    return pd.concat([base, delta], ignore_index=True).groupby(keys, as_index=False)['分钟'].sum()
+
+
+def read_csv_day(path):
+    """按原文读取一个日 CSV 的四列（与编辑保存时的比对方式一致），读不到时返回 None"""
+    for encoding in storage.CSV_ENCODINGS:
+        try:
+            df = pd.read_csv(path, encoding=encoding, on_bad_lines='skip', dtype=str, keep_default_na=False)
+            break
+        except (UnicodeDecodeError, OSError, pd.errors.ParserError, pd.errors.EmptyDataError):
+            continue
+    else:
+        return None
+    if df.empty or len(df.columns) < 4:
+        return None
+    df = df.iloc[:, :4]
+    df.columns = storage.HEADER
+    return df
+
+
+class QueryService:
+    """按天索引的共享数据集
+
+    每次查询先取范围内各天的磁盘版本（SQLite 为当天写入版本，CSV 为文件签名），只重读版本变化的日期。
+    接入实时推送（live.LiveSubscriber）时，推送的新记录直接合并进内存中的当天数据，并采用推送带来的
+    写入后版本，tracker 的写入不触发重读；其他进程的改写（其他会话编辑、reclassify.py / fix_csv.py）
+    使磁盘版本与之不符，仍会重读当天。
+    """
+
+    def __init__(self, store, subscriber=None, tail_cache=None, max_results=16):
+        self.store = store
+        self.subscriber = subscriber
+        self.tail_cache = tail_cache or analysis.CSVTailCache()
+        self.max_results = max_results
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+        self.days = {}
+        self.results = OrderedDict()
+        self.stamp = 0
+        self.live_position = None
+        self.started = time.monotonic()
+        self.queries = 0
+        self.result_hits = 0
+        self.day_loads = 0
+        self.live_rows = 0
+
+    def _next_stamp(self):
+        self.stamp += 1
+        return self.stamp
+
+    def _remember(self, key, value):
+        nbytes = int(value.frame.memory_usage(deep=True).sum()) if not value.frame.empty else 0
+        self.results[key] = (value, nbytes)
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+        return value
+
+    def _cached(self, key):
+        entry = self.results.get(key)
+        if entry is None:
+            return None
+        self.results.move_to_end(key)
+        self.result_hits += 1
+        return entry[0]
+
+    # ---------- 载入与增量 ----------
+
+    def _apply_live(self):
+        """把推送的新记录合并进已载入的日期，并沿写入版本链更新当天的版本"""
+        if self.subscriber is None:
+            return
+        position = self.subscriber.position()
+        events = None
+        if self.live_position and self.live_position[0] == position[0]:
+            events = self.subscriber.events_since(*self.live_position)
+        self.live_position = position
+        if events is None:
+            # 首次连接、tracker 重启或增量已被丢弃：只按磁盘版本判断
+            return
+
+        by_date = {}
+        for date_str, rows, before, after in events:
+            if date_str in self.days:
+                by_date.setdefault(date_str, []).append((rows, before, after))
+        for date_str, day_events in by_date.items():
+            day = self.days[date_str]
+            # 推送的写入紧接在当前版本之后时采用写入后的版本，_sync 就不会重读当天；
+            # 中间夹着其他进程的写入（版本链断开）时保留旧版本，照常按磁盘重读
+            version = day.version
+            for _, before, after in day_events:
+                if version == before:
+                    version = after
+                else:
+                    break
+            day.version = version
+            # 与磁盘载入的记录重复的行由 merge_live_rows 去重
+            day_rows = [(date_str, row) for rows, _, _ in day_events for row in rows]
+            frame, added = analysis.merge_live_rows(day.frame, day_rows, date_str, date_str)
+            if added.empty:
+                continue
+            # 存储层的汇总加上推送记录的增量
+            daily, hourly = analysis.rollup_frames(added)
+            day.set_frame(frame, self._next_stamp(),
+                          _add_minutes(day.daily, daily, ['日期', '分类']),
+                          _add_minutes(day.hourly, hourly, ['日期', '小时', '分类']))
+            self.live_rows += len(added)
+
+    def _is_fresh(self, date_str, version):
+        day = self.days.get(date_str)
+        return day is not None and day.version == version
+
+    def _load_rollups(self, dates):
+        """范围内各天的按天 / 按小时汇总（存储层预聚合，不读取明细行）"""
+        first, last = min(dates), max(dates)
+        wanted = set(dates)
+        daily, hourly = {}, {}
+        for row in self.store.read_rollup(first, last):
+            if row[0] in wanted:
+                daily.setdefault(row[0], []).append(row)
+        for row in self.store.read_hourly_rollup(first, last):
+            if row[0] in wanted:
+                hourly.setdefault(row[0], []).append(row)
+        return ({d: pd.DataFrame(rows, columns=EMPTY_DAILY.columns) for d, rows in daily.items()},
+                {d: pd.DataFrame(rows, columns=EMPTY_HOURLY.columns) for d, rows in hourly.items()})
+
+    def _load_days(self, dates, versions):
+        if self.store.name == "csv":
+            today = common.get_today_str()
+            frames = {}
+            for date_str in dates:
+                path = self.store.day_path(date_str)
+                if not os.path.exists(path):
+                    continue
+                # 当天文件只解析新追加的行，其余日期整文件读取一次后常驻内存
+                raw = self.tail_cache.load(path) if date_str == today else read_csv_day(path)
+                frame = analysis.process_dataframe(raw, date_str)
+                if frame is not None:
+                    frames[date_str] = frame
+        else:
+            columns, categories = self.store.read_range(min(dates), max(dates))
+            frame = analysis.frame_from_columns(columns, categories)
+            frames = dict(tuple(frame.groupby('日期', sort=False))) if not frame.empty else {}
+
+        daily, hourly = self._load_rollups(dates)
+        for date_str in dates:
+            frame = frames.get(date_str)
+            if frame is None:
+                frame = pd.DataFrame()
+            else:
+                frame = frame.reset_index(drop=True)
+            self.days[date_str] = DayData(versions.get(date_str), frame,
+                                          daily.get(date_str, EMPTY_DAILY), hourly.get(date_str, EMPTY_HOURLY),
+                                          self._next_stamp())
+        self.day_loads += len(dates)
+
+    def _sync(self, start_str, end_str):
+        """让范围内各天与磁盘 / 推送保持一致，返回 (日期列表, 内容签名)"""
+        dates = list(storage.iter_dates(datetime.strptime(start_str, '%Y-%m-%d'),
+                                        datetime.strptime(end_str, '%Y-%m-%d')))
+        self._apply_live()
+        # 先取版本号再读数据：读取期间的新写入会让下次查询再读一次，不会漏
+        versions = self.store.day_versions(start_str, end_str)
+        stale = [d for d in dates if not self._is_fresh(d, versions.get(d))]
+        if stale:
+            self._load_days(stale, versions)
+        return dates, tuple(self.days[d].stamp for d in dates)
+
+    # ---------- 查询 ----------
+
+    def range(self, start_str, end_str):
+        """日期范围内的全部明细与汇总（RangeData）"""
+        self.queries += 1
+        return self.flight.do(("range", start_str, end_str), lambda: self._range(start_str, end_str))
+
+    def _range(self, start_str, end_str):
+        with self.lock:
+            dates, stamps = self._sync(start_str, end_str)
+            key = ("range", start_str, end_str, stamps)
+            cached = self._cached(key)
+            if cached is not None:
+                return cached
+            days = [self.days[d] for d in dates if not self.days[d].frame.empty]
+            if days:
+                frame = pd.concat([day.frame for day in days], ignore_index=True)
+                daily = pd.concat([day.daily for day in days], ignore_index=True)
+                hourly = pd.concat([day.hourly for day in days], ignore_index=True)
+                categories = sorted(frame['任务分类'].unique())
+            else:
+                frame, daily, hourly, categories = pd.DataFrame(), EMPTY_DAILY, EMPTY_HOURLY, []
+            return self._remember(key, RangeData(key, frame, daily, hourly, categories))
+
+    def select(self, data, categories):
+        """按分类筛选 range() 的结果；与全部分类相同时原样返回"""
+        categories = tuple(sorted(categories))
+        if data.frame.empty or categories == tuple(data.categories):
+            return data
+        self.queries += 1
+        key = ("select", data.key, categories)
+        return self.flight.do(key, lambda: self._select(key, data, categories))
+
+    def _select(self, key, data, categories):
+        with self.lock:
+            cached = self._cached(key)
+            if cached is not None:
+                return cached
+        frame = data.frame[data.frame['任务分类'].isin(categories)]
+        daily = data.daily[data.daily['分类'].isin(categories)]
+        hourly = data.hourly[data.hourly['分类'].isin(categories)]
+        result = RangeData(key, frame, daily, hourly, list(categories))
+        with self.lock:
+            return self._remember(key, result)
+
+    def totals(self, data):
+        """{分类: 分钟}"""
+        return data.daily.groupby('分类')['分钟'].sum().to_dict()
+
+    # ---------- 维护 ----------
+
+    def invalidate(self, dates):
+        """这些日期被本进程改写过（如明细编辑保存），下次查询重读"""
+        with self.lock:
+            for date_str in dates:
+                self.days.pop(date_str, None)
+                if self.store.name == "csv":
+                    self.tail_cache.invalidate(self.store.day_path(date_str))
+
+    def refresh(self):
+        """手动刷新：丢弃内存中的全部日期，下次查询从磁盘重读"""
+        with self.lock:
+            self.days.clear()
+            self.results.clear()
+            self.tail_cache = analysis.CSVTailCache()
+
+    def get_stats(self):
+        with self.lock:
+            days = list(self.days.values())
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            # 按天数据 + 拼好的范围 / 筛选结果（LRU 最多 max_results 个）
+            nbytes = sum(day.bytes for day in days) + sum(n for _, n in self.results.values())
+            return {
+                "days": len(days),
+                "rows": sum(len(day.frame) for day in days),
+                "memory_mb": round(nbytes / 1e6, 1),
+                "results": len(self.results),
+                "queries": self.queries,
+                "queries_per_min": round(self.queries / elapsed * 60, 1),
+                "shared": self.flight.shared,
+                "result_hits": self.result_hits,
+                "day_loads": self.day_loads,
+                "live_rows": self.live_rows,
+            }
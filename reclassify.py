@@ -0,0 +1,337 @@
+# reclassify.py - 从 logs/raw 批量重新分类历史数据
+# 修改 SYSTEM_PROMPT 或模型后，用当前配置重新生成一段日期的分类结果并整天替换
+# 用法: python reclassify.py 2024-01-01 [2024-01-31] [--concurrency 4] [--model M] [--restart] [--dry-run] [--no-rules]
+
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import collections
+from datetime import datetime, date, timedelta
+
+import common
+import storage
+import classifier
+import ai_engine
+import tracker
+
+STATE_PATH = os.path.join(common.LOG_DIR, "reclassify_state.json")
+PROMPT_PREFIX = "请分析以下日志并输出CSV格式结果:\n"
+
+
+def iter_raw_lines(date_str, stats=None):
+    """逐行读取当天的原始日志，跳过空行、完全相同的重复行和不属于这一天的行
+
+    stats: 可选的 Counter，累计跳过的重复行数（duplicates）
+    """
+    path = os.path.join(common.RAW_LOG_DIR, f"{date_str}_raw.txt")
+    seen = set()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line.strip():
+                    continue
+                if line in seen:
+                    if stats is not None:
+                        stats["duplicates"] += 1
+                    continue
+                seen.add(line)
+                parsed = classifier.parse_log_line(line)
+                if parsed and parsed["date"] == date_str:
+                    parsed["line"] = line
+                    yield parsed
+    except OSError:
+        return
+
+
+def parse_csv_rows(text):
+    """AI 返回的 CSV 文本 -> [开始, 结束, 分类, 详情]"""
+    parser = ai_engine.CSVRowStream()
+    rows = []
+    for line in parser.feed(text) + parser.finish():
+        for row in csv.reader([line]):
+            if len(row) >= 4:
+                rows.append(row[:4])
+            elif len(row) == 3:
+                rows.append(row + [""])
+    return rows
+
+
+class DayPlan:
+    """一天的重分类计划：规则直接命中的行 + 按活动签名去重后需要 AI 分类的代表行"""
+
+    def __init__(self, date_str, rules=None, token_budget=3000, max_lines=80):
+        self.date = date_str
+        self.lines = []
+        self.stats = collections.Counter()
+        self.local = {}
+        self.groups = collections.OrderedDict()
+        for parsed in iter_raw_lines(date_str, self.stats):
+            index = len(self.lines)
+            self.lines.append(parsed)
+            category = rules.match(parsed["process"], parsed["url"], parsed["title"]) if rules else None
+            if category:
+                self.local[index] = category
+                continue
+            signature = classifier.activity_signature(parsed["process"], parsed["url"], parsed["title"])
+            self.groups.setdefault(signature, []).append(index)
+        self.batches = self.pack([members[0] for members in self.groups.values()], token_budget, max_lines)
+        self.results = {}
+        # 结果行与代表行一一对应的行，只有这些写回分类缓存
+        self.learnable = set()
+
+    def pack(self, indexes, token_budget, max_lines):
+        """按 token 预算把代表行装箱（保持时间顺序，AI 更容易对上时间）"""
+        batches = []
+        batch = []
+        tokens = tracker.AdaptiveBatcher.PROMPT_OVERHEAD
+        for index in indexes:
+            cost = tracker.AdaptiveBatcher.estimate_tokens(self.lines[index]["line"])
+            if batch and (tokens + cost > token_budget or len(batch) >= max_lines):
+                batches.append(batch)
+                batch = []
+                tokens = tracker.AdaptiveBatcher.PROMPT_OVERHEAD
+            batch.append(index)
+            tokens += cost
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def user_content(self, batch):
+        return PROMPT_PREFIX + "\n".join(self.lines[index]["line"] for index in batch)
+
+    def estimated_tokens(self, batches=None):
+        return sum(tracker.AdaptiveBatcher.estimate_tokens(self.user_content(batch)) +
+                   tracker.AdaptiveBatcher.PROMPT_OVERHEAD for batch in (batches or self.batches))
+
+    def apply(self, batch, text):
+        """记录一批 AI 结果，返回没有被结果行覆盖的代表行"""
+        parsed = [self.lines[index] for index in batch]
+        rows = parse_csv_rows(text)
+        for line, row in classifier.match_rows(self.date, parsed, rows):
+            self.results[id(line)] = (str(row[2]).strip(), row[3])
+        self.learnable.update(id(line) for line, _ in classifier.learnable_matches(self.date, parsed, rows))
+        return [index for index in batch if id(self.lines[index]) not in self.results]
+
+    def rows(self):
+        """所有行的最终结果，同签名的行沿用代表行的分类"""
+        category_of = {}
+        for members in self.groups.values():
+            result = self.results.get(id(self.lines[members[0]]))
+            for index in members:
+                category_of[index] = result
+        rows = []
+        for index, parsed in enumerate(self.lines):
+            end = parsed["end"] if parsed["end_date"] == self.date else f"{parsed['end_date']} {parsed['end']}"
+            if index in self.local:
+                rows.append([parsed["start"], end, self.local[index], parsed["title"] or parsed["process"]])
+            else:
+                category, detail = category_of[index]
+                rows.append([parsed["start"], end, category, detail or parsed["title"] or parsed["process"]])
+        return rows
+
+    def learned(self):
+        """[(签名, 分类)]，写回分类缓存"""
+        return [(signature, self.results[id(self.lines[members[0]])][0])
+                for signature, members in self.groups.items() if id(self.lines[members[0]]) in self.learnable]
+
+
+class Reclassifier:
+    """逐天流式处理：同时在途的天数有上限，AI 并发由引擎的信号量限制；每完成一天写一次断点"""
+
+    def __init__(self, engine, store, model, rules=None, cache=None, token_budget=3000, max_lines=80,
+                 state_path=STATE_PATH, out=print):
+        self.engine = engine
+        self.store = store
+        self.rules = rules
+        self.cache = cache
+        self.token_budget = token_budget
+        self.max_lines = max_lines
+        self.state_path = state_path
+        self.out = out
+        self.window = max(2, engine.max_concurrency * 2) if engine else 1
+        prompt_hash = hashlib.sha1(tracker.SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+        self.run_key = f"{model}|{prompt_hash}"
+
+    def _load_state(self, restart):
+        state = {}
+        if not restart:
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                pass
+        if state.get("key") != self.run_key:
+            # 提示词或模型变了，之前的断点作废
+            state = {"key": self.run_key, "done": [], "failed": {}}
+        return state
+
+    def _save_state(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    def plan(self, date_str):
+        return DayPlan(date_str, self.rules, self.token_budget, self.max_lines)
+
+    def _messages(self, content):
+        return [{"role": "system", "content": tracker.SYSTEM_PROMPT}, {"role": "user", "content": content}]
+
+    def _submit(self, plan):
+        return [(batch, self.engine.submit(self._messages(plan.user_content(batch)), temperature=0.3))
+                for batch in plan.batches]
+
+    def _finish(self, plan, futures):
+        """等待一天的所有批次；没对上的代表行单独再请求一次；全部成功才整天替换"""
+        missing = []
+        requests = len(futures)
+        for batch, future in futures:
+            missing.extend(plan.apply(batch, future.result()))
+        if missing:
+            for batch in plan.pack(missing, self.token_budget, self.max_lines):
+                requests += 1
+                missing = plan.apply(batch, self.engine.complete(
+                    self._messages(plan.user_content(batch)), temperature=0.3))
+                if missing:
+                    raise ValueError(f"{len(missing)} activities not covered by AI result")
+        rows = plan.rows()
+        self.store.replace_rows(plan.date, rows)
+        if self.cache:
+            self.cache.put_many(plan.learned())
+        return requests
+
+    def run(self, start_date, end_date, restart=False, dry_run=False):
+        state = self._load_state(restart)
+        dates = [d for d in storage.iter_dates(start_date, end_date) if d not in state["done"]]
+        skipped = len(list(storage.iter_dates(start_date, end_date))) - len(dates)
+        if skipped:
+            self.out(f"Resuming: {skipped} days already done with this prompt/model")
+
+        totals = collections.Counter()
+        pending = collections.deque()
+        t0 = time.monotonic()
+
+        def progress(plan, requests, status):
+            totals["days"] += 1
+            totals["lines"] += len(plan.lines)
+            elapsed = max(time.monotonic() - t0, 1e-6)
+            remaining = len(dates) - totals["days"]
+            eta = elapsed / totals["days"] * remaining
+            self.out(f"[{totals['days']}/{len(dates)}] {plan.date}: {len(plan.lines)} lines "
+                     f"({plan.stats['duplicates']} dup) -> {len(plan.local)} rules + {len(plan.groups)} unique, "
+                     f"{requests} requests, {status} | {totals['lines'] / elapsed:.0f} lines/s, "
+                     f"ETA {int(eta // 60)}m{int(eta % 60):02d}s")
+
+        def finish_oldest():
+            plan, futures = pending.popleft()
+            try:
+                requests = self._finish(plan, futures)
+            except Exception as e:
+                state["failed"][plan.date] = str(e)[:200]
+                totals["failed"] += 1
+                progress(plan, len(futures), f"FAILED ({e})")
+            else:
+                state["done"].append(plan.date)
+                state["failed"].pop(plan.date, None)
+                totals["requests"] += requests
+                totals["written"] += 1
+                progress(plan, requests, "replaced")
+            self._save_state(state)
+
+        for date_str in dates:
+            plan = self.plan(date_str)
+            if not plan.lines:
+                totals["days"] += 1
+                continue
+            if dry_run:
+                naive = plan.estimated_tokens(plan.pack(
+                    [i for members in plan.groups.values() for i in members], self.token_budget, self.max_lines))
+                totals["tokens"] += plan.estimated_tokens()
+                totals["naive_tokens"] += naive
+                totals["requests"] += len(plan.batches)
+                progress(plan, len(plan.batches), f"~{plan.estimated_tokens()} tokens (vs {naive} without dedupe)")
+                continue
+            pending.append((plan, self._submit(plan)))
+            while len(pending) >= self.window:
+                finish_oldest()
+        while pending:
+            finish_oldest()
+
+        elapsed = time.monotonic() - t0
+        if dry_run:
+            self.out(f"Dry run: {totals['lines']} lines, {totals['requests']} requests, "
+                     f"~{totals['tokens']} tokens (vs {totals['naive_tokens']} without dedupe)")
+        else:
+            self.out(f"Done: {totals['written']} days replaced, {totals['failed']} failed, "
+                     f"{totals['lines']} lines, {totals['requests']} requests in {elapsed:.1f}s")
+            common.log(f"Reclassify {start_date} ~ {end_date}: {totals['written']} days replaced, "
+                       f"{totals['failed']} failed, {totals['requests']} requests")
+        return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reclassify past days from logs/raw with the current prompt/model")
+    parser.add_argument("start", help="YYYY-MM-DD")
+    parser.add_argument("end", nargs="?", help="YYYY-MM-DD (default: same as start)")
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--token-budget", type=int, default=None)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and redo every day")
+    parser.add_argument("--dry-run", action="store_true", help="show dedupe/batching/token estimates only")
+    parser.add_argument("--no-rules", action="store_true", help="send everything to the AI, skip local rules")
+    args = parser.parse_args(argv)
+
+    config = tracker.CONFIG
+    start_date = datetime.strptime(args.start, "%Y-%m-%d").date()
+    end_date = datetime.strptime(args.end, "%Y-%m-%d").date() if args.end else start_date
+    if end_date >= date.today():
+        # 当天的数据 tracker 还在写入，整天替换会和它冲突
+        end_date = date.today() - timedelta(days=1)
+        print(f"Today is still being tracked, stopping at {end_date}")
+    if end_date < start_date:
+        print("Nothing to do")
+        return 0
+
+    model = args.model or config["model"]
+    engine = None
+    if not args.dry_run:
+        if not config.get("api_key"):
+            print("No API key configured")
+            return 1
+        engine = ai_engine.AsyncAIEngine(
+            api_key=config["api_key"],
+            base_url=config.get("base_url", "https://api.openai.com/v1"),
+            model=model,
+            max_concurrency=args.concurrency or config.get("ai_max_concurrency", 4),
+            retry_times=config.get("ai_retry_times", 3),
+            base_delay=config.get("ai_retry_delay", 5))
+
+    rules = None
+    if config.get("local_classifier", True) and not args.no_rules:
+        rules = classifier.RuleClassifier(config.get("local_rules"), config.get("browser_processes", []))
+    cache = None
+    if config.get("classify_cache", True) and not args.dry_run:
+        cache = classifier.ClassificationCache(max_entries=config.get("classify_cache_size", 5000),
+                                               ttl_days=config.get("classify_cache_ttl_days", 30))
+
+    reclassifier = Reclassifier(engine, storage.get_store(config), model, rules=rules, cache=cache,
+                                token_budget=args.token_budget or config.get("reclassify_token_budget", 3000),
+                                max_lines=config.get("batch_max_lines", 50))
+    try:
+        totals = reclassifier.run(start_date, end_date, restart=args.restart, dry_run=args.dry_run)
+    except KeyboardInterrupt:
+        print("Interrupted, progress saved; run the same command again to resume")
+        return 1
+    finally:
+        if engine:
+            engine.shutdown(timeout=5)
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,669 @@
+# storage.py - 日数据存储后端
+# tracker 写入、webui 读取都通过这里，不再直接操作 logs/YYYY-MM-DD.csv
+
+import os
+import sys
+import csv
+import json
+import sqlite3
+import calendar
+import threading
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import common
+
+HEADER = ['开始时间', '结束时间', '任务分类', '任务详情']
+CSV_ENCODINGS = ['utf-8-sig', 'utf-8', 'gbk']
+
+# append_rows 的结果：写入行数，以及写入前后当天的版本（与 day_versions 的取值一致，没有版本时为 None）
+DayWrite = namedtuple("DayWrite", "count before after")
+
+
+def to_epoch(date_str, time_str):
+    """日期 + 时间字符串 -> 墙上时间纪元秒（按 UTC 计算，不做时区换算）"""
+    time_str = str(time_str).strip()
+    try:
+        if len(time_str) > 10:
+            dt = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
+        else:
+            dt = None
+            for fmt in ['%H:%M:%S', '%H:%M']:
+                try:
+                    t = datetime.strptime(time_str, fmt).time()
+                    dt = datetime.combine(datetime.strptime(date_str, '%Y-%m-%d').date(), t)
+                    break
+                except ValueError:
+                    continue
+            if dt is None:
+                return None
+        return calendar.timegm(dt.timetuple())
+    except ValueError:
+        return None
+
+
+def from_epoch(date_str, ts):
+    """墙上时间纪元秒 -> 时间字符串（同一天只保留 HH:MM:SS）"""
+    dt = datetime(1970, 1, 1) + timedelta(seconds=int(ts))
+    if dt.strftime('%Y-%m-%d') == date_str:
+        return dt.strftime('%H:%M:%S')
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def iter_dates(start_date, end_date):
+    current = start_date
+    while current <= end_date:
+        yield current.strftime('%Y-%m-%d')
+        current += timedelta(days=1)
+
+
+def compute_rollup(intervals):
+    """(start_ts, end_ts, category) -> ({category: 分钟}, {(hour, category): 分钟})
+
+    时长计算与仪表盘一致：结束早于开始按 0 计；跨小时的记录按小时边界拆分。
+    """
+    daily = {}
+    hourly = {}
+    for start_ts, end_ts, category in intervals:
+        if end_ts <= start_ts:
+            daily.setdefault(category, 0.0)
+            continue
+        daily[category] = daily.get(category, 0.0) + (end_ts - start_ts) / 60
+        t = start_ts
+        while t < end_ts:
+            boundary = min((t // 3600 + 1) * 3600, end_ts)
+            key = ((t // 3600) % 24, category)
+            hourly[key] = hourly.get(key, 0.0) + (boundary - t) / 60
+            t = boundary
+    return daily, hourly
+
+
+def rows_to_intervals(date_str, rows):
+    for row in rows:
+        start_ts = to_epoch(date_str, row[0])
+        end_ts = to_epoch(date_str, row[1])
+        if start_ts is not None and end_ts is not None:
+            yield start_ts, end_ts, str(row[2]).strip()
+
+
+def read_csv_rows(file_path):
+    """读取一个旧格式的日 CSV，返回 [开始, 结束, 分类, 详情] 行（不含表头）"""
+    for encoding in CSV_ENCODINGS:
+        try:
+            with open(file_path, 'r', encoding=encoding, newline='') as f:
+                rows = list(csv.reader(f))
+            break
+        except (UnicodeDecodeError, OSError):
+            continue
+    else:
+        return []
+
+    result = []
+    for i, row in enumerate(rows):
+        if i == 0 and row and row[0].strip() == HEADER[0]:
+            continue
+        if len(row) >= 4:
+            result.append(row[:4])
+        elif len(row) == 3:
+            result.append(row + [''])
+    return result
+
+
+def row_key(date_str, row):
+    """行的比较键：(开始纪元秒, 结束纪元秒, 分类, 详情)"""
+    return (to_epoch(date_str, row[0]), to_epoch(date_str, row[1]),
+            str(row[2]).strip(), str(row[3]) if len(row) > 3 else '')
+
+
+def remove_rows(date_str, rows, deleted):
+    """从 rows 中按键各删除一行，返回剩余行；有键找不到时抛出 ValueError"""
+    pending = Counter(deleted)
+    kept = []
+    for row in rows:
+        key = row_key(date_str, row)
+        if pending[key] > 0:
+            pending[key] -= 1
+        else:
+            kept.append(row)
+    missing = sum(pending.values())
+    if missing:
+        raise ValueError(f"{date_str}: {missing} rows changed since loaded")
+    return kept
+
+
+def merge_rows(date_str, kept, inserted):
+    """新增行按开始时间插回原有行中（稳定排序）"""
+    if not inserted:
+        return kept
+    return sorted(kept + list(inserted), key=lambda row: to_epoch(date_str, row[0]) or 0)
+
+
+class BaseStore:
+    """存储后端接口，行格式统一为 [开始时间, 结束时间, 任务分类, 任务详情]"""
+    name = "base"
+
+    def append_rows(self, date_str, rows):
+        """追加记录，返回 DayWrite；before / after 在同一把锁（事务）内取得"""
+        raise NotImplementedError
+
+    def read_rows(self, date_str):
+        raise NotImplementedError
+
+    def replace_rows(self, date_str, rows):
+        raise NotImplementedError
+
+    def list_days(self):
+        raise NotImplementedError
+
+    def revision(self):
+        """数据版本号，任何写入后都会变化，供读取端做缓存键"""
+        raise NotImplementedError
+
+    def range_revision(self, start_str, end_str):
+        """日期范围内的数据版本号，只在范围内某天被写入后变化"""
+        return self.revision()
+
+    def day_versions(self, start_str, end_str):
+        """{日期: 版本}，某天被写入后其版本变化；没有记录过版本的日期不出现"""
+        raise NotImplementedError
+
+    def apply_changes(self, date_str, deleted, inserted):
+        """行级修改：删除 deleted 中的行、追加 inserted，返回 (删除数, 新增数)
+
+        deleted 为 row_key() 形式的 (开始纪元秒, 结束纪元秒, 分类, 详情)，每个键只删除一行；
+        有键找不到（数据已被其他进程改动）时抛出 ValueError，当天不做任何写入。
+        """
+        rows = self.read_rows(date_str)
+        kept = remove_rows(date_str, rows, deleted)
+        self.replace_rows(date_str, merge_rows(date_str, kept, inserted))
+        return len(rows) - len(kept), len(inserted)
+
+    def read_rollup(self, start_str, end_str):
+        """按天汇总：[(日期, 分类, 分钟)]，不读取原始行"""
+        raise NotImplementedError
+
+    def read_hourly_rollup(self, start_str, end_str):
+        """按小时汇总：[(日期, 小时, 分类, 分钟)]"""
+        raise NotImplementedError
+
+
+class CSVStore(BaseStore):
+    """旧版存储：每天一个 logs/YYYY-MM-DD.csv"""
+    name = "csv"
+
+    def __init__(self, log_dir=None):
+        self.log_dir = log_dir or common.LOG_DIR
+        self.lock = threading.Lock()
+        # 每天一个汇总文件 rollup/YYYY-MM-DD.json，写入某天只重写那一天的汇总
+        self.rollup_dir = os.path.join(self.log_dir, "rollup")
+        self._rollup = {}
+
+    def day_path(self, date_str):
+        return os.path.join(self.log_dir, f"{date_str}.csv")
+
+    def append_rows(self, date_str, rows):
+        file_path = self.day_path(date_str)
+        with self.lock:
+            before = self._file_sig(date_str)
+            new_file = before is None
+            with open(file_path, "a", encoding="utf-8-sig", newline="") as f:
+                writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+                if new_file:
+                    writer.writerow(HEADER)
+                writer.writerows(rows)
+            after = self._file_sig(date_str)
+            self._append_rollup(date_str, rows, before, after)
+        return DayWrite(len(rows), tuple(before) if before else None, tuple(after) if after else None)
+
+    def read_rows(self, date_str):
+        file_path = self.day_path(date_str)
+        if not os.path.exists(file_path):
+            return []
+        return read_csv_rows(file_path)
+
+    def _write_day(self, date_str, rows):
+        # 先写临时文件再改名，写到一半中断也不会留下半个文件
+        file_path = self.day_path(date_str)
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(HEADER)
+            writer.writerows(rows)
+        os.replace(tmp_path, file_path)
+        self._update_rollup([date_str])
+
+    def replace_rows(self, date_str, rows):
+        with self.lock:
+            self._write_day(date_str, rows)
+        return len(rows)
+
+    def apply_changes(self, date_str, deleted, inserted):
+        # 读改写在同一把锁内，不会吞掉 tracker 同时追加的行
+        with self.lock:
+            rows = self.read_rows(date_str)
+            kept = remove_rows(date_str, rows, deleted)
+            self._write_day(date_str, merge_rows(date_str, kept, inserted))
+        return len(rows) - len(kept), len(inserted)
+
+    def revision(self):
+        try:
+            return max((e.stat().st_mtime_ns for e in os.scandir(self.log_dir)
+                        if e.name.endswith('.csv')), default=0)
+        except OSError:
+            return 0
+
+    def range_revision(self, start_str, end_str):
+        sigs = [self._file_sig(d) for d in iter_dates(datetime.strptime(start_str, '%Y-%m-%d'),
+                                                      datetime.strptime(end_str, '%Y-%m-%d'))]
+        sigs = [sig[0] for sig in sigs if sig]
+        # 文件数一起作为键，范围内有文件被删除时也会变化
+        return max(sigs, default=0), len(sigs)
+
+    def day_versions(self, start_str, end_str):
+        versions = {}
+        for date_str in iter_dates(datetime.strptime(start_str, '%Y-%m-%d'),
+                                   datetime.strptime(end_str, '%Y-%m-%d')):
+            sig = self._file_sig(date_str)
+            if sig:
+                versions[date_str] = tuple(sig)
+        return versions
+
+    def list_days(self):
+        if not os.path.isdir(self.log_dir):
+            return []
+        return sorted(f[:-4] for f in os.listdir(self.log_dir)
+                      if f.endswith('.csv') and len(f) == 14)
+
+    def _file_sig(self, date_str):
+        try:
+            stat = os.stat(self.day_path(date_str))
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _rollup_file(self, date_str):
+        return os.path.join(self.rollup_dir, f"{date_str}.json")
+
+    def _cached_rollup(self, date_str, sig):
+        """与 CSV 签名一致的汇总条目：先查内存，再读文件（其他进程可能已更新）；没有则返回 None"""
+        entry = self._rollup.get(date_str)
+        if entry is None or entry['sig'] != sig:
+            try:
+                with open(self._rollup_file(date_str), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+            self._rollup[date_str] = entry
+        return entry if entry.get('sig') == sig else None
+
+    def _save_rollup(self, date_str, sig, daily, hourly):
+        entry = {
+            'sig': sig,
+            'daily': daily,
+            'hourly': [[h, c, m] for (h, c), m in hourly.items()],
+        }
+        self._rollup[date_str] = entry
+        tmp_path = self._rollup_file(date_str) + ".tmp"
+        try:
+            os.makedirs(self.rollup_dir, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, self._rollup_file(date_str))
+        except OSError as e:
+            common.log(f"Rollup save failed: {e}")
+
+    def _append_rollup(self, date_str, rows, before, after):
+        """追加后只把新行的时长加到当天汇总上；追加前的汇总缺失或已过期时整天重算"""
+        if before is None:
+            entry = {'daily': {}, 'hourly': []}
+        else:
+            entry = self._cached_rollup(date_str, before)
+        if entry is None or after is None:
+            self._update_rollup([date_str])
+            return
+        daily = dict(entry['daily'])
+        hourly = {(h, c): m for h, c, m in entry['hourly']}
+        added_daily, added_hourly = compute_rollup(rows_to_intervals(date_str, rows))
+        for category, minutes in added_daily.items():
+            daily[category] = daily.get(category, 0.0) + minutes
+        for key, minutes in added_hourly.items():
+            hourly[key] = hourly.get(key, 0.0) + minutes
+        self._save_rollup(date_str, after, daily, hourly)
+
+    def _update_rollup(self, days):
+        """重算指定日期的汇总，文件签名不变的日期直接跳过；返回 {日期: 汇总}"""
+        result = {}
+        for date_str in days:
+            sig = self._file_sig(date_str)
+            if sig is None:
+                self._rollup.pop(date_str, None)
+                try:
+                    os.remove(self._rollup_file(date_str))
+                except OSError:
+                    pass
+                continue
+            if self._cached_rollup(date_str, sig) is None:
+                daily, hourly = compute_rollup(rows_to_intervals(date_str, self.read_rows(date_str)))
+                self._save_rollup(date_str, sig, daily, hourly)
+            result[date_str] = self._rollup[date_str]
+        return result
+
+    def _rollup_range(self, start_str, end_str):
+        days = [d for d in self.list_days() if start_str <= d <= end_str]
+        with self.lock:
+            rollup = self._update_rollup(days)
+        return [(d, rollup[d]) for d in days if d in rollup]
+
+    def read_rollup(self, start_str, end_str):
+        return [(d, cat, minutes)
+                for d, entry in self._rollup_range(start_str, end_str)
+                for cat, minutes in entry['daily'].items()]
+
+    def read_hourly_rollup(self, start_str, end_str):
+        return [(d, hour, cat, minutes)
+                for d, entry in self._rollup_range(start_str, end_str)
+                for hour, cat, minutes in entry['hourly']]
+
+
+class SQLiteStore(BaseStore):
+    """SQLite 列式存储：开始/结束为纪元秒整数，分类字典编码为整数"""
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS records (
+        id INTEGER PRIMARY KEY,
+        day TEXT NOT NULL,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        category_id INTEGER NOT NULL REFERENCES categories(id),
+        detail TEXT NOT NULL DEFAULT ''
+    );
+    CREATE INDEX IF NOT EXISTS idx_records_day ON records(day, start_ts);
+    CREATE TABLE IF NOT EXISTS rollup_daily (
+        day TEXT NOT NULL,
+        category_id INTEGER NOT NULL,
+        minutes REAL NOT NULL,
+        PRIMARY KEY (day, category_id)
+    );
+    CREATE TABLE IF NOT EXISTS rollup_hourly (
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        category_id INTEGER NOT NULL,
+        minutes REAL NOT NULL,
+        PRIMARY KEY (day, hour, category_id)
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    CREATE TABLE IF NOT EXISTS day_revisions (
+        day TEXT PRIMARY KEY,
+        revision INTEGER NOT NULL
+    );
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or common.DB_PATH
+        self.lock = threading.Lock()
+        self._category_ids = {}
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _category_id(self, conn, name):
+        cat_id = self._category_ids.get(name)
+        if cat_id is None:
+            conn.execute("INSERT OR IGNORE INTO categories(name) VALUES (?)", (name,))
+            cat_id = conn.execute("SELECT id FROM categories WHERE name = ?", (name,)).fetchone()[0]
+            self._category_ids[name] = cat_id
+        return cat_id
+
+    def _encode_rows(self, conn, date_str, rows):
+        encoded = []
+        for row in rows:
+            start_ts = to_epoch(date_str, row[0])
+            end_ts = to_epoch(date_str, row[1])
+            if start_ts is None or end_ts is None:
+                continue
+            category = str(row[2]).strip() if len(row) > 2 else ''
+            detail = str(row[3]) if len(row) > 3 else ''
+            encoded.append((date_str, start_ts, end_ts, self._category_id(conn, category), detail))
+        return encoded
+
+    def _write(self, date_str, rows, replace):
+        with self.lock:
+            try:
+                with self._connect() as conn:
+                    before = self._day_revision(conn, date_str)
+                    encoded = self._encode_rows(conn, date_str, rows)
+                    if replace:
+                        conn.execute("DELETE FROM records WHERE day = ?", (date_str,))
+                    conn.executemany(
+                        "INSERT INTO records(day, start_ts, end_ts, category_id, detail) "
+                        "VALUES (?, ?, ?, ?, ?)", encoded)
+                    self._refresh_rollup(conn, date_str)
+                    self._bump_revision(conn, date_str)
+                    after = self._day_revision(conn, date_str)
+            except Exception:
+                # 事务回滚后新分类的 id 可能无效
+                self._category_ids.clear()
+                raise
+        return encoded, before, after
+
+    @staticmethod
+    def _day_revision(conn, date_str):
+        row = conn.execute("SELECT revision FROM day_revisions WHERE day = ?", (date_str,)).fetchone()
+        return row[0] if row else None
+
+    def _bump_revision(self, conn, date_str):
+        """全局版本号 +1，并记为当天的版本号（范围版本号取范围内各天的最大值）"""
+        conn.execute(
+            "INSERT INTO meta(key, value) VALUES ('revision', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+        conn.execute(
+            "INSERT OR REPLACE INTO day_revisions(day, revision) "
+            "SELECT ?, CAST(value AS INTEGER) FROM meta WHERE key = 'revision'", (date_str,))
+
+    def apply_changes(self, date_str, deleted, inserted):
+        # 每个键只删除一条匹配的记录，删除与插入在同一事务内
+        with self.lock:
+            try:
+                with self._connect() as conn:
+                    removed = 0
+                    for start_ts, end_ts, category, detail in deleted:
+                        cur = conn.execute(
+                            "DELETE FROM records WHERE id = ("
+                            "SELECT r.id FROM records r JOIN categories c ON c.id = r.category_id "
+                            "WHERE r.day = ? AND r.start_ts = ? AND r.end_ts = ? AND c.name = ? "
+                            "AND r.detail = ? LIMIT 1)",
+                            (date_str, start_ts, end_ts, category, detail))
+                        removed += cur.rowcount
+                    if removed < len(deleted):
+                        raise ValueError(f"{date_str}: {len(deleted) - removed} rows changed since loaded")
+                    encoded = self._encode_rows(conn, date_str, inserted)
+                    conn.executemany(
+                        "INSERT INTO records(day, start_ts, end_ts, category_id, detail) "
+                        "VALUES (?, ?, ?, ?, ?)", encoded)
+                    self._refresh_rollup(conn, date_str)
+                    self._bump_revision(conn, date_str)
+            except Exception:
+                self._category_ids.clear()
+                raise
+        return removed, len(encoded)
+
+    def _refresh_rollup(self, conn, date_str):
+        """在写入事务内重算当天的汇总"""
+        intervals = conn.execute(
+            "SELECT start_ts, end_ts, category_id FROM records WHERE day = ?", (date_str,)).fetchall()
+        daily, hourly = compute_rollup(intervals)
+        conn.execute("DELETE FROM rollup_daily WHERE day = ?", (date_str,))
+        conn.execute("DELETE FROM rollup_hourly WHERE day = ?", (date_str,))
+        conn.executemany("INSERT INTO rollup_daily(day, category_id, minutes) VALUES (?, ?, ?)",
+                         [(date_str, cat, m) for cat, m in daily.items()])
+        conn.executemany("INSERT INTO rollup_hourly(day, hour, category_id, minutes) VALUES (?, ?, ?, ?)",
+                         [(date_str, h, cat, m) for (h, cat), m in hourly.items()])
+
+    def rebuild_rollups(self):
+        with self.lock, self._connect() as conn:
+            days = [r[0] for r in conn.execute("SELECT DISTINCT day FROM records")]
+            for date_str in days:
+                self._refresh_rollup(conn, date_str)
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('rollup_version', '1')")
+        return len(days)
+
+    def append_rows(self, date_str, rows):
+        encoded, before, after = self._write(date_str, rows, replace=False)
+        if len(encoded) < len(rows):
+            common.log(f"Store: skipped {len(rows) - len(encoded)} rows with bad time ({date_str})")
+        return DayWrite(len(encoded), before, after)
+
+    def replace_rows(self, date_str, rows):
+        return len(self._write(date_str, rows, replace=True)[0])
+
+    def read_rows(self, date_str):
+        with self._connect() as conn:
+            cur = conn.execute(
+                "SELECT r.start_ts, r.end_ts, c.name, r.detail FROM records r "
+                "JOIN categories c ON c.id = r.category_id WHERE r.day = ? ORDER BY r.start_ts, r.id",
+                (date_str,))
+            return [[from_epoch(date_str, s), from_epoch(date_str, e), cat, detail]
+                    for s, e, cat, detail in cur]
+
+    def read_range(self, start_str, end_str):
+        """按列读取日期范围，一次查询；返回 (columns, categories)
+
+        columns: {'day', 'start_ts', 'end_ts', 'category_id', 'detail'} 各为等长列表
+        categories: {category_id: name}
+        """
+        with self._connect() as conn:
+            cur = conn.execute(
+                "SELECT day, start_ts, end_ts, category_id, detail FROM records "
+                "WHERE day BETWEEN ? AND ? ORDER BY start_ts, id",
+                (start_str, end_str))
+            rows = cur.fetchall()
+            categories = dict(conn.execute("SELECT id, name FROM categories").fetchall())
+        names = ['day', 'start_ts', 'end_ts', 'category_id', 'detail']
+        if rows:
+            columns = {name: list(col) for name, col in zip(names, zip(*rows))}
+        else:
+            columns = {name: [] for name in names}
+        return columns, categories
+
+    def read_rollup(self, start_str, end_str):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT r.day, c.name, r.minutes FROM rollup_daily r "
+                "JOIN categories c ON c.id = r.category_id WHERE r.day BETWEEN ? AND ? ORDER BY r.day",
+                (start_str, end_str)).fetchall()
+
+    def read_hourly_rollup(self, start_str, end_str):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT r.day, r.hour, c.name, r.minutes FROM rollup_hourly r "
+                "JOIN categories c ON c.id = r.category_id WHERE r.day BETWEEN ? AND ? "
+                "ORDER BY r.day, r.hour",
+                (start_str, end_str)).fetchall()
+
+    def list_days(self):
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute("SELECT DISTINCT day FROM records ORDER BY day")]
+
+    def revision(self):
+        return int(self.get_meta('revision', 0))
+
+    def range_revision(self, start_str, end_str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT MAX(revision) FROM day_revisions WHERE day BETWEEN ? AND ?",
+                               (start_str, end_str)).fetchone()
+        return row[0] or 0
+
+    def day_versions(self, start_str, end_str):
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT day, revision FROM day_revisions WHERE day BETWEEN ? AND ?",
+                                     (start_str, end_str)).fetchall())
+
+    def get_meta(self, key, default=None):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def migrate_csv(store, log_dir=None, overwrite=False):
+    """一次性迁移：把 logs/*.csv 导入 store，已有数据的日期默认跳过"""
+    source = CSVStore(log_dir)
+    existing = set(store.list_days())
+    migrated = 0
+    rows_total = 0
+    for date_str in source.list_days():
+        if date_str in existing and not overwrite:
+            continue
+        rows = source.read_rows(date_str)
+        if not rows:
+            continue
+        rows_total += store.replace_rows(date_str, rows)
+        migrated += 1
+    common.log(f"Store migrate: {migrated} days, {rows_total} rows -> {store.name}")
+    return migrated, rows_total
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(config=None):
+    """按 config.json 的 storage_backend 返回进程内共享的存储实例"""
+    global _store
+    with _store_lock:
+        if _store is not None:
+            return _store
+        config = config or common.load_config()
+        backend = config.get("storage_backend", "csv")
+        common.ensure_dirs()
+        if backend == "csv":
+            _store = CSVStore()
+        else:
+            store = SQLiteStore()
+            # 旧数据库没有汇总表数据时补建一次
+            if store.get_meta("rollup_version") is None:
+                common.log(f"Store rollup rebuilt: {store.rebuild_rollups()} days")
+            # 迁移旧 CSV 需显式开启（storage_migrate_csv 或 python storage.py migrate），只执行一次
+            if store.get_meta("csv_migrated") is None:
+                if config.get("storage_migrate_csv", False):
+                    migrate_csv(store)
+                    store.set_meta("csv_migrated", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                elif CSVStore().list_days():
+                    common.log("Store: CSV records not imported, run 'python storage.py migrate' "
+                               "or set storage_migrate_csv")
+            _store = store
+        return _store
+
+
+if __name__ == "__main__":
+    # 用法: python storage.py migrate [--overwrite]
+    if len(sys.argv) >= 2 and sys.argv[1] == "migrate":
+        common.ensure_dirs()
+        target = SQLiteStore()
+        days, count = migrate_csv(target, overwrite="--overwrite" in sys.argv)
+        target.set_meta("csv_migrated", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        print(f"Migrated {days} days, {count} rows -> {target.db_path}")
+    else:
+        print("Usage: python storage.py migrate [--overwrite]")
@@ -0,0 +1,17 @@
+# conftest.py - 测试公共设置：项目根目录加入 sys.path，日志不写入 logs/runtime.log
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import common  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def quiet_log(monkeypatch):
+    messages = []
+    monkeypatch.setattr(common, "log", lambda msg, level="INFO": messages.append(msg))
+    return messages
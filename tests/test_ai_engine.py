@@ -0,0 +1,167 @@
+# test_ai_engine.py - AsyncAIEngine 的重试、Retry-After 和退避（本地桩服务器，不访问网络）
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ai_engine
+
+pytestmark = pytest.mark.skipif(ai_engine.AsyncOpenAI is None, reason="openai/httpx not installed")
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def completion(content):
+    return {"id": "c1", "object": "chat.completion", "created": 0, "model": "m",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}]}
+
+
+def stream_body(*deltas):
+    chunks = [{"id": "c1", "object": "chat.completion.chunk", "created": 0, "model": "m",
+               "choices": [{"index": 0, "delta": {"content": d}, "finish_reason": None}]} for d in deltas]
+    chunks.append({"id": "c1", "object": "chat.completion.chunk", "created": 0, "model": "m",
+                   "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    return "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+
+
+class StubServer:
+    """按顺序返回预设响应 (状态码, 头, 正文)；记录每次请求的到达时间"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.times = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.times.append(time.monotonic())
+                status, headers, body = stub.responses.pop(0)
+                data = (body if isinstance(body, str) else json.dumps(body)).encode("utf-8")
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def serve():
+    servers, engines = [], []
+
+    def start(responses, **kwargs):
+        server = StubServer(responses)
+        servers.append(server)
+        kwargs.setdefault("base_delay", 0.01)
+        engine = ai_engine.AsyncAIEngine(api_key="test", base_url=server.base_url, model="m", **kwargs)
+        engines.append(engine)
+        return server, engine
+
+    yield start
+    for engine in engines:
+        engine.shutdown(timeout=1)
+    for server in servers:
+        server.close()
+
+
+ERROR = {"error": {"message": "boom", "type": "server_error"}}
+JSON = {"Content-Type": "application/json"}
+SSE = {"Content-Type": "text/event-stream"}
+
+
+def test_retries_server_errors_then_succeeds(serve):
+    server, engine = serve([(500, JSON, ERROR), (503, JSON, ERROR), (200, JSON, completion("ok"))],
+                           retry_times=3)
+    assert engine.complete(MESSAGES, timeout=10) == "ok"
+    metrics = engine.get_metrics()
+    assert metrics["requests"] == 3
+    assert metrics["retries"] == 2
+    assert metrics["failures"] == 0
+
+
+def test_gives_up_after_retry_times(serve):
+    server, engine = serve([(500, JSON, ERROR)] * 2, retry_times=2)
+    with pytest.raises(ai_engine.APIStatusError) as info:
+        engine.complete(MESSAGES, timeout=10)
+    assert info.value.status_code == 500
+    assert len(server.times) == 2
+    assert engine.get_metrics()["failures"] == 1
+
+
+def test_client_error_is_not_retried(serve):
+    server, engine = serve([(400, JSON, ERROR), (200, JSON, completion("ok"))], retry_times=3)
+    with pytest.raises(ai_engine.APIStatusError) as info:
+        engine.complete(MESSAGES, timeout=10)
+    assert info.value.status_code == 400
+    assert len(server.times) == 1
+    assert engine.get_metrics()["retries"] == 0
+
+
+@pytest.mark.parametrize("retry_times", [0, -1])
+def test_zero_retry_times_still_requests_once(serve, retry_times):
+    server, engine = serve([(500, JSON, ERROR)], retry_times=retry_times)
+    assert engine.retry_times == 1
+    with pytest.raises(ai_engine.APIStatusError):
+        engine.complete(MESSAGES, timeout=10)
+    assert len(server.times) == 1
+
+
+@pytest.mark.parametrize("headers", [{"Retry-After": "0.4"}, {"retry-after-ms": "400"}])
+def test_rate_limit_waits_for_retry_after(serve, headers):
+    server, engine = serve([(429, dict(JSON, **headers), ERROR), (200, JSON, completion("ok"))],
+                           retry_times=2)
+    assert engine.complete(MESSAGES, timeout=10) == "ok"
+    assert server.times[1] - server.times[0] >= 0.4
+    assert engine.get_metrics()["rate_limited"] == 1
+
+
+def test_stream_retries_before_first_delta(serve):
+    server, engine = serve([(503, JSON, ERROR), (200, SSE, stream_body("a,", "b\n"))], retry_times=2)
+    assert "".join(engine.stream(MESSAGES)) == "a,b\n"
+    assert len(server.times) == 2
+    assert engine.get_metrics()["retries"] == 1
+
+
+def test_stream_zero_retry_times_raises_real_error(serve):
+    server, engine = serve([(503, JSON, ERROR)], retry_times=0)
+    with pytest.raises(ai_engine.APIStatusError):
+        list(engine.stream(MESSAGES))
+    assert len(server.times) == 1
+
+
+def test_backoff_is_exponential_capped_and_honours_retry_after(serve, monkeypatch):
+    server, engine = serve([], base_delay=1.0, max_delay=10.0)
+    monkeypatch.setattr(ai_engine.random, "uniform", lambda a, b: 1.0)
+    assert [engine._backoff(n) for n in range(5)] == [1.0, 2.0, 4.0, 8.0, 10.0]
+    assert engine._backoff(0, retry_after=30) == 30
+    assert engine._backoff(3, retry_after=2) == 8.0
+    # 抖动范围为 ±50%
+    monkeypatch.setattr(ai_engine.random, "uniform", lambda a, b: a)
+    assert engine._backoff(2) == 2.0
+    monkeypatch.setattr(ai_engine.random, "uniform", lambda a, b: b)
+    assert engine._backoff(2) == 6.0
+
+
+def test_parse_retry_after_headers():
+    assert ai_engine.parse_retry_after({"retry-after-ms": "250"}) == 0.25
+    assert ai_engine.parse_retry_after({"retry-after": "3"}) == 3.0
+    assert ai_engine.parse_retry_after({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}) is None
+    assert ai_engine.parse_retry_after({}) is None
+    assert ai_engine.parse_reset_seconds("1m30s") == 90
+    assert ai_engine.parse_reset_seconds("250ms") == 0.25
@@ -0,0 +1,28 @@
+# test_analysis.py - 向量化解析与逐行旧实现一致
+
+import pandas as pd
+import pytest
+
+import analysis
+from benchmark import make_day_frame, process_dataframe_rowwise
+
+
+@pytest.mark.parametrize("rows,seed", [(1, 0), (200, 1), (5000, 2)])
+def test_process_dataframe_matches_rowwise(rows, seed):
+    raw = make_day_frame(rows, seed=seed)
+    old = process_dataframe_rowwise(raw, "2024-01-15")
+    new = analysis.process_dataframe(raw, "2024-01-15")
+    if old is None:
+        assert new is None or new.empty
+        return
+    assert len(new) == len(old)
+    assert new['Duration_Min'].sum() == pytest.approx(old['Duration_Min'].sum(), abs=1e-6)
+    assert list(new['Start_DT']) == list(pd.to_datetime(old['Start_DT']))
+    assert list(new['End_DT']) == list(pd.to_datetime(old['End_DT']))
+
+
+def test_process_dataframe_drops_unparsable_times():
+    raw = pd.DataFrame({'开始时间': ["09:00:00", "??", "10:00"], '结束时间': ["09:30:00", "", "10:15"],
+                        '任务分类': ["开发"] * 3, '任务详情': ["x"] * 3})
+    result = analysis.process_dataframe(raw, "2024-01-15")
+    assert list(result['Duration_Min']) == [30, 15]
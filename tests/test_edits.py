@@ -0,0 +1,84 @@
+# test_edits.py - 明细编辑的行级 diff：只改动编辑过的行，页外和筛选掉的行原样保留
+
+from collections import Counter
+
+import pandas as pd
+import pytest
+
+import analysis
+import storage
+from benchmark import make_range_frame
+
+
+def range_rows(days):
+    frame = make_range_frame(days, per_day=50)
+    rows = {}
+    for day, start, end, category, detail in zip(frame["日期"], frame["Start_DT"], frame["End_DT"],
+                                                 frame["任务分类"], frame["任务详情"]):
+        rows.setdefault(day, []).append([start.strftime("%H:%M:%S"), end.strftime("%H:%M:%S"), category, detail])
+    return rows
+
+
+@pytest.fixture(params=["csv", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "csv":
+        return storage.CSVStore(str(tmp_path))
+    return storage.SQLiteStore(str(tmp_path / "test.db"))
+
+
+def load_frame(store, days):
+    return pd.concat([analysis.process_dataframe(pd.DataFrame(store.read_rows(day), columns=storage.HEADER), day)
+                      for day in days], ignore_index=True)
+
+
+def rows_of(frame):
+    return Counter(map(tuple, frame[analysis.EDIT_COLUMNS].values.tolist()))
+
+
+def test_diff_edits_writes_only_changed_rows(store):
+    rows = range_rows(3)
+    for day, day_rows in rows.items():
+        store.replace_rows(day, day_rows)
+    frame = load_frame(store, rows)
+    # 筛选后的一页：改两行分类、删一行、加一行
+    page = frame[frame["任务分类"] != "娱乐"].iloc[:60]
+    edited = page[analysis.EDIT_COLUMNS].copy()
+    changed = list(page.index[[0, 30]])
+    edited.loc[changed, "任务分类"] = "学习"
+    removed = page.index[10]
+    edited = edited.drop(removed)
+    first_day = page.loc[changed[0], "日期"]
+    edited.loc[10 ** 6] = [first_day, "23:59:00", "23:59:30", "学习", "new"]
+
+    changes, invalid = analysis.diff_edits(page, edited)
+    assert invalid == 0
+    assert sum(len(deleted) for deleted, _ in changes.values()) == 3
+    assert sum(len(inserted) for _, inserted in changes.values()) == 3
+    for day, (deleted, inserted) in changes.items():
+        store.apply_changes(day, deleted, inserted)
+
+    # 页外和筛选掉的行原样保留，只有编辑过的行变化
+    expected = rows_of(frame.drop(index=[removed]))
+    for index in changed:
+        old = tuple(frame.loc[index, analysis.EDIT_COLUMNS])
+        expected[old] -= 1
+        expected[old[:3] + ("学习",) + old[4:]] += 1
+    expected[(first_day, "23:59:00", "23:59:30", "学习", "new")] += 1
+    assert rows_of(load_frame(store, rows)) == +expected
+
+
+def test_diff_edits_unchanged_page_has_no_changes(store):
+    rows = range_rows(1)
+    for day, day_rows in rows.items():
+        store.replace_rows(day, day_rows)
+    page = load_frame(store, rows)
+    changes, invalid = analysis.diff_edits(page, page[analysis.EDIT_COLUMNS].copy())
+    assert changes == {} and invalid == 0
+
+
+def test_apply_changes_rejects_stale_keys(store):
+    store.replace_rows("2024-01-01", [["09:00:00", "09:10:00", "开发", "a"]])
+    stale = [(storage.to_epoch("2024-01-01", "10:00:00"), storage.to_epoch("2024-01-01", "10:10:00"), "开发", "b")]
+    with pytest.raises(ValueError):
+        store.apply_changes("2024-01-01", stale, [["11:00:00", "11:10:00", "开发", "c"]])
+    assert store.read_rows("2024-01-01") == [["09:00:00", "09:10:00", "开发", "a"]]
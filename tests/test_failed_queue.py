@@ -0,0 +1,68 @@
+# test_failed_queue.py - 失败批次重试：已入库的行去重，无法解析的行另存而不是随批次文件删除
+
+import os
+
+import pytest
+
+import failed_queue
+import storage
+
+STORED = "[2024-01-01 09:00:00 - 2024-01-01 09:30:00] <code.exe> [活跃度:高] main.py"
+NEW = "[2024-01-01 10:00:00 - 2024-01-01 10:20:00] <chrome.exe> [活跃度:中] docs"
+GARBAGE = "2024-01-01 11:00 something the tracker never wrote"
+
+
+@pytest.fixture
+def setup(tmp_path):
+    failed_dir = tmp_path / "failed"
+    failed_dir.mkdir()
+    store = storage.CSVStore(str(tmp_path))
+    store.append_rows("2024-01-01", [["09:00:00", "09:30:00", "开发", "main.py"]])
+    name = "failed_20240101_120000_000000.txt"
+    (failed_dir / name).write_text("# Error: timeout\n" + "\n".join([STORED, NEW, GARBAGE]) + "\n", encoding="utf-8")
+    classified = []
+
+    def classify(lines):
+        classified.append(lines)
+        store.append_rows("2024-01-01", [["10:00:00", "10:20:00", "学习", "docs"]])
+        return True
+
+    queue = failed_queue.FailedQueue(str(failed_dir))
+    reprocessor = failed_queue.FailedReprocessor(classify, store, queue=queue)
+    return failed_dir, name, queue, reprocessor, classified
+
+
+def test_unparseable_lines_are_kept_and_counted_separately(setup):
+    failed_dir, name, queue, reprocessor, classified = setup
+    assert reprocessor.process_one(now=10 ** 10)
+    assert classified == [[NEW]]
+    assert not (failed_dir / name).exists()
+    _, kept = failed_queue.read_failed(str(failed_dir / name.replace("failed_", "unparsed_")))
+    assert kept == [GARBAGE]
+    assert queue.state["recovered_lines"] == 1
+    assert queue.state["deduped_lines"] == 1
+    assert queue.state["unparsed_lines"] == 1
+    summary = failed_queue.backlog_summary(str(failed_dir))
+    assert summary["batches"] == 0
+    assert summary["unparsed_lines"] == 1
+
+
+def test_batch_file_is_kept_when_unparseable_lines_cannot_be_saved(setup, monkeypatch):
+    failed_dir, name, queue, reprocessor, classified = setup
+
+    def fail(name, lines):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(queue, "_quarantine", fail)
+    assert reprocessor.process_one(now=10 ** 10)
+    assert (failed_dir / name).exists()
+    assert queue.state["files"][name]["attempts"] == 1
+    assert queue.state["recovered_batches"] == 0
+
+    # 下次重试：已入库的行被去重，不再请求分类
+    monkeypatch.delattr(queue, "_quarantine")
+    assert reprocessor.process_one(now=10 ** 11)
+    assert classified == [[NEW]]
+    assert not (failed_dir / name).exists()
+    assert os.path.exists(failed_dir / name.replace("failed_", "unparsed_"))
+    assert queue.state["deduped_lines"] == 2
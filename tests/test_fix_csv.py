@@ -0,0 +1,42 @@
+# test_fix_csv.py - 修复失败时不留下 .fixing 临时文件，原文件保持不变
+
+import os
+
+import fix_csv
+
+LINE = b"09:00:00,09:30:00,dev,\"main.py\"\n"
+
+
+def test_failed_gbk_retry_removes_temp_file(tmp_path):
+    # 前 64KB 是合法 UTF-8，后面的字节 UTF-8 和 GBK 都解不出
+    path = tmp_path / "2024-01-01.csv"
+    data = LINE * (fix_csv.PREFIX_BYTES // len(LINE) + 10) + b"\xff\xff\n"
+    path.write_bytes(data)
+    result = fix_csv.repair_file(str(path), backup_dir=str(tmp_path / "backup"))
+    assert result["status"] == "error"
+    assert result["encoding"] == "gbk"
+    assert os.listdir(tmp_path) == ["2024-01-01.csv"]
+    assert path.read_bytes() == data
+
+
+def test_backup_failure_removes_temp_file(tmp_path, monkeypatch):
+    path = tmp_path / "2024-01-01.csv"
+    path.write_bytes(LINE * 3)
+
+    def fail(filepath, backup_dir):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(fix_csv, "_backup", fail)
+    result = fix_csv.repair_file(str(path), backup_dir=str(tmp_path / "backup"))
+    assert result["status"] == "error"
+    assert result["error"] == "disk full"
+    assert os.listdir(tmp_path) == ["2024-01-01.csv"]
+    assert path.read_bytes() == LINE * 3
+
+
+def test_fixed_file_leaves_no_temp_file(tmp_path):
+    path = tmp_path / "2024-01-01.csv"
+    path.write_bytes(LINE * 3)
+    result = fix_csv.repair_file(str(path), backup_dir=None)
+    assert result["status"] == "fixed"
+    assert os.listdir(tmp_path) == ["2024-01-01.csv"]
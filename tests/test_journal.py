@@ -0,0 +1,71 @@
+# test_journal.py - 预写日志的崩溃恢复，以及重放批次入库不重复
+
+import pytest
+
+import journal
+import tracker
+import storage
+
+LINE = "[2024-01-01 10:00:00 - 2024-01-01 10:01:00] <app{}.exe> [活跃度:中] title {}"
+
+
+def crash(wal):
+    """模拟进程被强制结束：不调用 close，直接丢弃"""
+    wal.closed.set()
+    wal.file.flush()
+
+
+@pytest.mark.parametrize("fsync_interval", [-1, 0, 1.0])
+def test_unacked_batches_are_recovered(tmp_path, fsync_interval):
+    path = str(tmp_path / "journal.log")
+    wal = journal.LogJournal(path, fsync_interval=fsync_interval)
+    expected = []
+    for i in range(95):
+        line = LINE.format(i % 7, i)
+        wal.append(line)
+        if i % 10 == 9:
+            batch = wal.take_batch()
+            # 每 3 个批次有 1 个在崩溃前还没处理完
+            if i % 30 == 29:
+                expected.extend(LINE.format(j % 7, j) for j in range(i - 9, i + 1))
+            else:
+                wal.ack(batch)
+    # 最后 5 行还没划入批次
+    expected.extend(LINE.format(j % 7, j) for j in range(90, 95))
+    crash(wal)
+
+    reopened = journal.LogJournal(path, fsync_interval=-1)
+    assert [line for _, line in reopened.recovered] == expected
+    seqs = [seq for seq, _ in reopened.recovered]
+    assert seqs == sorted(seqs)
+    assert reopened.append("next") == seqs[-1] + 1
+    reopened.close()
+
+
+def test_recovery_ignores_torn_last_record(tmp_path):
+    path = str(tmp_path / "journal.log")
+    wal = journal.LogJournal(path, fsync_interval=-1)
+    wal.append("a")
+    wal.ack(wal.take_batch())
+    wal.append("b")
+    crash(wal)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("- 2")
+
+    reopened = journal.LogJournal(path, fsync_interval=-1)
+    assert reopened.recovered == [(2, "b")]
+    reopened.close()
+
+
+def test_recovered_rows_are_not_stored_twice(tmp_path):
+    # 崩溃前批次已入库但 journal 还没确认：重放时跳过 (开始, 结束) 已存在的行
+    summarizer = tracker.AsyncAISummarizer.__new__(tracker.AsyncAISummarizer)
+    summarizer.store = storage.SQLiteStore(str(tmp_path / "test.db"))
+    summarizer.on_rows = None
+    summarizer.on_bytes = None
+    rows = [["10:00:00", "10:01:00", "开发", "a"], ["10:01:00", "10:05:00", "学习", "b"]]
+    summarizer._append_rows("2024-01-01", rows[:1])
+
+    assert summarizer._append_rows("2024-01-01", rows, skip_existing=True) == rows[1:]
+    assert summarizer._append_rows("2024-01-01", rows, skip_existing=True) == []
+    assert summarizer.store.read_rows("2024-01-01") == rows
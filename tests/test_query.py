@@ -0,0 +1,104 @@
+# test_query.py - 实时推送：tracker 的写入合并后不触发重读，其他进程的写入照常重读；握手校验 token
+
+import os
+import time
+
+import pytest
+
+import live
+import query
+import storage
+
+DAY = "2024-01-01"
+
+
+@pytest.fixture(params=["csv", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "csv":
+        return storage.CSVStore(str(tmp_path))
+    return storage.SQLiteStore(str(tmp_path / "test.db"))
+
+
+@pytest.fixture
+def channel():
+    publisher = live.LivePublisher(port=0)
+    subscriber = live.LiveSubscriber(port=publisher.port, token=publisher.token, retry=0.1)
+    deadline = time.monotonic() + 5
+    while not subscriber.connected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert subscriber.connected
+    yield publisher, subscriber
+    subscriber.close()
+    publisher.close()
+
+
+def tracker_write(store, publisher, subscriber, rows):
+    """tracker 的写入路径：先入库，再带着写入前后的版本推送"""
+    seq = subscriber.position()[1]
+    publisher.publish_rows(DAY, rows, store.append_rows(DAY, rows))
+    assert subscriber.wait(seq, 5)
+
+
+def test_pushed_rows_are_merged_without_reread(store, channel):
+    publisher, subscriber = channel
+    store.append_rows(DAY, [["09:00:00", "09:30:00", "开发", "a"]])
+    service = query.QueryService(store, subscriber)
+    assert service.totals(service.range(DAY, DAY)) == {"开发": 30}
+    loads = service.day_loads
+
+    tracker_write(store, publisher, subscriber, [["10:00:00", "10:15:00", "学习", "b"]])
+    tracker_write(store, publisher, subscriber, [["10:15:00", "10:45:00", "开发", "c"]])
+    data = service.range(DAY, DAY)
+    assert service.day_loads == loads
+    assert service.get_stats()["live_rows"] == 2
+    assert len(data.frame) == 3
+    assert service.totals(data) == {"开发": 60, "学习": 15}
+    assert service.days[DAY].version == store.day_versions(DAY, DAY)[DAY]
+
+
+def test_foreign_write_between_pushes_forces_reread(store, channel):
+    publisher, subscriber = channel
+    store.append_rows(DAY, [["09:00:00", "09:30:00", "开发", "a"]])
+    service = query.QueryService(store, subscriber)
+    service.range(DAY, DAY)
+    loads = service.day_loads
+
+    # 其他进程（如 reclassify.py）改写了当天，之后 tracker 又追加了一条
+    store.replace_rows(DAY, [["09:00:00", "09:30:00", "学习", "a"]])
+    tracker_write(store, publisher, subscriber, [["10:00:00", "10:15:00", "开发", "b"]])
+    data = service.range(DAY, DAY)
+    assert service.day_loads == loads + 1
+    assert service.totals(data) == {"学习": 30, "开发": 15}
+
+
+def test_subscriber_without_token_is_rejected():
+    publisher = live.LivePublisher(port=0)
+    subscriber = live.LiveSubscriber(port=publisher.port, token="wrong", retry=0.1)
+    try:
+        deadline = time.monotonic() + 5
+        while publisher.get_stats()["rejected"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert publisher.get_stats()["rejected"] >= 2
+        assert publisher.get_stats()["clients"] == 0
+        assert not subscriber.connected
+    finally:
+        subscriber.close()
+        publisher.close()
+
+
+def test_subscriber_reads_endpoint_file_and_close_releases_socket(tmp_path):
+    path = str(tmp_path / "live_endpoint.json")
+    publisher = live.LivePublisher(port=0, endpoint_path=path)
+    subscriber = live.LiveSubscriber(endpoint_path=path, retry=0.1)
+    deadline = time.monotonic() + 5
+    while not subscriber.connected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert subscriber.connected
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    conn = subscriber.conn
+
+    subscriber.close()
+    assert conn.fileno() == -1
+    assert not subscriber.thread.is_alive()
+    publisher.close()
+    assert not (tmp_path / "live_endpoint.json").exists()
@@ -0,0 +1,60 @@
+# test_rollup.py - CSV 存储的按天汇总：追加时增量更新，不重读当天 CSV
+
+import os
+
+import pytest
+
+import storage
+
+DAY = "2024-01-01"
+ROWS = [
+    [["09:00:00", "09:30:00", "开发", "a"]],
+    [["09:30:00", "10:15:00", "学习", "b"], ["10:15:00", "10:20:00", "开发", "c"]],
+    [["23:50:00", "23:59:59", "休息", "d"]],
+]
+
+
+def expected(store):
+    daily, hourly = storage.compute_rollup(storage.rows_to_intervals(DAY, store.read_rows(DAY)))
+    return ({(DAY, c): m for c, m in daily.items()},
+            {(DAY, h, c): m for (h, c), m in hourly.items()})
+
+
+def as_dicts(store):
+    return ({(d, c): m for d, c, m in store.read_rollup(DAY, DAY)},
+            {(d, h, c): m for d, h, c, m in store.read_hourly_rollup(DAY, DAY)})
+
+
+def test_append_updates_rollup_without_rereading(tmp_path, monkeypatch):
+    store = storage.CSVStore(str(tmp_path))
+    reads = []
+    read_rows = store.read_rows
+    monkeypatch.setattr(store, "read_rows", lambda d: reads.append(d) or read_rows(d))
+    for rows in ROWS:
+        store.append_rows(DAY, rows)
+    result = as_dicts(store)
+    assert reads == []
+
+    daily, hourly = expected(storage.CSVStore(str(tmp_path)))
+    assert result[0] == pytest.approx(daily)
+    assert result[1] == pytest.approx(hourly)
+    assert os.listdir(tmp_path / "rollup") == [f"{DAY}.json"]
+
+
+def test_rollup_is_shared_and_recomputed_after_rewrite(tmp_path):
+    writer = storage.CSVStore(str(tmp_path))
+    reader = storage.CSVStore(str(tmp_path))
+    writer.append_rows(DAY, ROWS[0])
+    assert as_dicts(reader)[0] == {(DAY, "开发"): 30}
+
+    # 另一个实例（tracker 进程）追加后，读取端从汇总文件拿到新值
+    writer.append_rows(DAY, ROWS[1])
+    assert as_dicts(reader)[0] == pytest.approx({(DAY, "开发"): 35, (DAY, "学习"): 45})
+
+    # reader 改写了当天；writer 内存里的汇总过期，追加时以 reader 写下的汇总文件为基础
+    reader.replace_rows(DAY, [["08:00:00", "08:10:00", "办公", "x"]])
+    writer.append_rows(DAY, ROWS[2])
+    result, want = as_dicts(reader), expected(reader)
+    assert result[0] == pytest.approx(want[0])
+    assert result[1] == pytest.approx(want[1])
+    assert set(as_dicts(writer)[0]) == {(DAY, "办公"), (DAY, "休息")}
@@ -0,0 +1,194 @@
+# test_tracker.py - 事件驱动主循环：ScriptedSource 发窗口事件，假时钟让防抖 / 空闲的时间戳精确可控
+
+import contextlib
+import queue
+import threading
+from datetime import datetime
+
+import pytest
+
+import classifier
+import desktop
+import metrics
+import tracker
+
+START = datetime(2024, 1, 1, 9, 0, 0).timestamp()
+
+
+class FakeClock:
+    """假时钟：主循环等待时直接跳到脚本源的下一次唤醒、下一次输入或等待超时
+
+    脚本源线程在 sleep() 里挂起，主循环推进到它的唤醒时间后才放行，两边按虚拟时间交替执行。
+    """
+
+    def __init__(self, end, inputs=()):
+        self.end = end
+        self.inputs = sorted(inputs)
+        self.elapsed = 0.0
+        self.cond = threading.Condition()
+        self.wake_at = None
+        self.source = None
+        self.on_key = None
+
+    def time(self):
+        return START + self.elapsed
+
+    def monotonic(self):
+        return self.elapsed
+
+    def sleep(self, seconds):
+        with self.cond:
+            self.wake_at = self.elapsed + seconds
+            self.cond.notify_all()
+            while self.wake_at is not None:
+                self.cond.wait()
+
+    def wait(self, events, timeout):
+        deadline = self.elapsed + timeout
+        while True:
+            with self.cond:
+                # 等脚本源发完上一个事件，重新挂起或结束
+                while self.wake_at is None and not self.source.done.is_set():
+                    self.cond.wait(0.01)
+                if not events.empty():
+                    return events.get_nowait()
+                due = ([self.wake_at] if self.wake_at is not None else []) + self.inputs[:1]
+                at = min(due) if due else None
+                if at is None or at > deadline:
+                    if at is None and deadline >= self.end:
+                        self.elapsed = max(self.elapsed, self.end)
+                        raise desktop.ReplayFinished()
+                    self.elapsed = max(self.elapsed, deadline)
+                    raise queue.Empty
+                self.elapsed = max(self.elapsed, at)
+                if self.inputs and self.inputs[0] == at:
+                    self.inputs.pop(0)
+                else:
+                    self.wake_at = None
+                    self.cond.notify_all()
+                    continue
+            self.on_key(None)
+
+
+class NullProbe:
+    def thread_context(self):
+        return contextlib.nullcontext()
+
+    def read(self, hwnd, process_name):
+        return ""
+
+
+class ScriptedBackend:
+    """窗口事件来自 ScriptedSource，输入按 inputs 中的偏移秒触发；启动时前台为编辑器"""
+    async_url_probe = False
+
+    def __init__(self, script, end, inputs=()):
+        self.clock = FakeClock(end, inputs)
+        self.source = desktop.ScriptedSource(script, clock=self.clock)
+        self.clock.source = self.source
+
+    def create_window_source(self):
+        return self.source
+
+    def foreground_event(self):
+        return desktop.WindowEvent(self.clock.time(), None, "main.py", "code.exe", "")
+
+    @staticmethod
+    def window_text(hwnd):
+        return ""
+
+    @staticmethod
+    def window_pid(hwnd):
+        return None
+
+    def start_input(self, on_click, on_move, on_key):
+        self.clock.on_key = on_key
+
+    def create_url_probe(self):
+        return NullProbe()
+
+
+class CaptureAI:
+    on_request_done = None
+
+    def __init__(self):
+        self.lines = []
+
+    def process_logs_async(self, log_lines, on_done=None, recovered=False):
+        self.lines.extend(log_lines)
+        if on_done:
+            on_done()
+
+    def save_local(self, log_line, date_str, row):
+        self.lines.append(log_line)
+
+    def shutdown(self, timeout=None):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    for key, value in {"check_interval": 30, "idle_timeout": 300, "sleep_threshold": 120,
+                       "event_max_wait": 30, "batch_size": 1, "adaptive_batching": False,
+                       "local_classifier": False, "journal_enabled": False}.items():
+        monkeypatch.setitem(tracker.CONFIG, key, value)
+
+
+def commit_lines(backend):
+    ai = CaptureAI()
+    tracker.SmartTracker(backend=backend, ai=ai, live=False, metrics=metrics.MetricsRegistry()).run()
+    return [classifier.parse_log_line(line) for line in ai.lines]
+
+
+def run(script, end, inputs=()):
+    """回放脚本，返回提交的记录 [(开始, 结束, 进程)]"""
+    return [(p["start"], p["end"], p["process"]) for p in commit_lines(ScriptedBackend(script, end, inputs))]
+
+
+def test_switch_shorter_than_debounce_is_not_committed():
+    script = [(60, "微信", "wechat.exe", ""), (10, "main.py", "code.exe", "")]
+    assert run(script, end=200) == [("09:00:00", "09:03:20", "code.exe")]
+
+
+def test_confirmed_switch_is_committed_at_event_time():
+    script = [(60, "微信", "wechat.exe", ""), (45, "GitHub", "chrome.exe", "github.com")]
+    assert run(script, end=200) == [
+        ("09:00:00", "09:01:00", "code.exe"),
+        ("09:01:00", "09:01:45", "wechat.exe"),
+        ("09:01:45", "09:03:20", "chrome.exe"),
+    ]
+
+
+def test_idle_and_resume():
+    # 最后一次输入在 09:01:40，300 秒后进入空闲；空闲期间切到了微信，09:16:40 恢复输入
+    script = [(500, "微信", "wechat.exe", "")]
+    assert run(script, end=1200, inputs=[100, 1000]) == [
+        ("09:00:00", "09:01:40", "code.exe"),
+        ("09:01:40", "09:16:40", "idle"),
+        ("09:16:40", "09:20:00", "wechat.exe"),
+    ]
+
+
+def test_replay_across_midnight_and_sleep_adds_up():
+    # 23:00 编辑器，23:30 切到浏览器并跨过零点，00:30 睡眠一小时，01:30 醒来后继续到 02:00
+    window = ("GitHub", "chrome.exe", "github.com")
+    timeline = desktop.merge_timelines(
+        [(0, "window", ("main.py", "code.exe", "")), (1800, "window", window),
+         (5400, "window", window), (5400, "suspend", 3600), (10800, "window", window)],
+        [(t, "input", 1) for t in list(range(60, 5400, 120)) + list(range(9060, 10800, 120))])
+    start = datetime(2024, 1, 1, 23, 0, 0).timestamp()
+    lines = commit_lines(desktop.ReplayBackend(timeline, start_time=start))
+
+    assert [(p["date"], p["start"], p["end"], p["process"]) for p in lines] == [
+        ("2024-01-01", "23:00:00", "23:30:00", "code.exe"),
+        ("2024-01-01", "23:30:00", "23:59:59", "chrome.exe"),
+        ("2024-01-02", "00:00:00", "00:30:00", "chrome.exe"),
+        ("2024-01-02", "01:30:00", "02:00:00", "chrome.exe"),
+    ]
+
+    def epoch(date, clock):
+        return datetime.strptime(f"{date} {clock}", "%Y-%m-%d %H:%M:%S").timestamp()
+
+    total = sum(epoch(p["end_date"], p["end"]) - epoch(p["date"], p["start"]) for p in lines)
+    # 三小时减去一小时睡眠，再减去跨天时少记的 1 秒
+    assert total == 10800 - 3600 - 1
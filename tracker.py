@@ -1,28 +1,33 @@
 # tracker.py - v3.0 Simplified
-# No logging module, just common.log()
+# Logging via common.log() (buffered background writer)
 
 import time
 import os
 import sys
-import psutil
+import bisect
 import threading
+import queue
 import common
+import storage
+import classifier
+import ai_engine
+import desktop
+from journal import LogJournal
+from live import create_publisher
+from metrics import MetricsRegistry, create_exporter, process_collector
+from failed_queue import FailedReprocessor, FailedQueue
 from datetime import datetime, timedelta
+from array import array
+from collections import namedtuple
 import re
 import csv
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-os.chdir(SCRIPT_DIR)
-
-import win32gui
-import win32process
 
 common.ensure_dirs()
 
 try:
     from openai import OpenAI
-    import uiautomation as auto
-    from pynput import mouse, keyboard
 except ImportError as e:
     common.log(f"Missing dependency: {e}")
     sys.exit(1)
@@ -33,7 +38,7 @@ DEFAULT_SYSTEM_PROMPT = """
 你是一个专业的时间管理助手。根据电脑操作日志对用户行为进行分类。
 
 【日志字段说明】
-格式：[开始时间 - 结束时间] <进程名> [活跃度: 低/中/高] [URL: ...] 窗口标题
+格式：[开始时间 - 结束时间] <进程名> [活跃度: 低/中/高 有输入的秒数/总秒数 强度:每秒输入 仅鼠标/1/2-3/4-7/8+ 次的秒数] [URL: ...] 窗口标题
 
 【9大分类规则】
 1. 【开发】: 编写代码, 调试, 查阅技术文档, 终端操作
@@ -60,126 +65,141 @@ DEFAULT_SYSTEM_PROMPT = """
 SYSTEM_PROMPT = CONFIG.get("SYSTEM_PROMPT", DEFAULT_SYSTEM_PROMPT)
 
 
+ActivityStats = namedtuple("ActivityStats", "level events active_seconds histogram")
+
+
 class InputMonitor:
-    def __init__(self):
-        self.click_count = 0
-        self.key_count = 0
-        self.lock = threading.Lock()
-        self.last_activity_time = time.time()
+    """输入活动监听：按秒写入定长环形缓冲，提交记录时按时间段精确统计
+
+    监听线程上不加锁：点击/按键逐个记录，鼠标移动每 MOVE_SAMPLE 个事件采样一次。
+    两个监听线程极少数情况下会同时写同一秒，丢失的计数可以忽略。
+    """
+    MOVE_SAMPLE = 8
+    # 每秒按键+点击次数分桶：仅移动 / 1 / 2-3 / 4-7 / 8+
+    HISTOGRAM_BOUNDS = (1, 2, 4, 8)
+
+    def __init__(self, backend):
+        self.clock = backend.clock
+        self.now = backend.clock.time
+        self.size = CONFIG.get("activity_ring_seconds", 4 * 3600)
+        self.stamps = array('q', [-1]) * self.size
+        self.counts = array('I', [0]) * self.size
+        self.move_events = 0
+        self.last_activity_time = self.clock.time()
+        # 有输入时的回调（空闲期间用来唤醒主循环）
+        self.on_activity = None
 
         try:
-            self.mouse_listener = mouse.Listener(on_click=self._on_click, on_move=self._on_move)
-            self.key_listener = keyboard.Listener(on_release=self._on_key)
-            self.mouse_listener.start()
-            self.key_listener.start()
+            backend.start_input(self._on_click, self._on_move, self._on_key)
         except Exception as e:
             common.log(f"Input monitor failed: {e}")
 
+    def _record(self, weight):
+        now = self.now()
+        second = int(now)
+        index = second % self.size
+        if self.stamps[index] != second:
+            self.stamps[index] = second
+            self.counts[index] = 0
+        if weight:
+            self.counts[index] += weight
+        self.last_activity_time = now
+        if self.on_activity:
+            self.on_activity()
+
     def _on_click(self, x, y, button, pressed):
         if pressed:
-            with self.lock:
-                self.click_count += 1
-                self.last_activity_time = time.time()
+            self._record(1)
 
     def _on_move(self, x, y):
-        with self.lock:
-            self.last_activity_time = time.time()
+        self.move_events += 1
+        if self.move_events % self.MOVE_SAMPLE == 0:
+            self._record(0)
 
     def _on_key(self, key):
-        with self.lock:
-            self.key_count += 1
-            self.last_activity_time = time.time()
-
-    def get_and_reset(self):
-        with self.lock:
-            total = self.click_count + self.key_count
-            self.click_count = 0
-            self.key_count = 0
-        if total < 5:
-            return "低"
-        if total < 50:
-            return "中"
-        return "高"
-
-    def reset_counters(self):
-        with self.lock:
-            self.click_count = 0
-            self.key_count = 0
+        self._record(1)
+
+    def segment_stats(self, start_ts, end_ts):
+        """[start_ts, end_ts) 内的输入统计；超出环形缓冲长度的部分只统计最近的一段"""
+        first, last = int(start_ts), int(end_ts)
+        first = max(first, last - self.size)
+        events = 0
+        active = 0
+        histogram = [0] * (len(self.HISTOGRAM_BOUNDS) + 1)
+        for second in range(first, last):
+            index = second % self.size
+            if self.stamps[index] != second:
+                continue
+            count = self.counts[index]
+            events += count
+            active += 1
+            histogram[bisect.bisect_right(self.HISTOGRAM_BOUNDS, count)] += 1
+        if events < 5:
+            level = "低"
+        elif events < 50:
+            level = "中"
+        else:
+            level = "高"
+        return ActivityStats(level, events, active, histogram)
+
+    def restart_idle(self, now):
+        """空闲计时从 now 开始（睡眠唤醒后，睡眠时间不算空闲）"""
+        self.last_activity_time = now
 
     def get_idle_duration(self):
-        with self.lock:
-            return time.time() - self.last_activity_time
+        return self.clock.time() - self.last_activity_time
 
 
 class DataCollector:
-    def __init__(self):
-        self.process_cache = {}
+    def __init__(self, backend):
+        self.backend = backend
+        self.process_cache = desktop.ProcessNameCache(CONFIG.get("process_cache_size", 512))
+        try:
+            warmed = self.process_cache.warm()
+            common.log(f"Process cache warmed: {warmed} processes")
+        except Exception as e:
+            common.log(f"Process cache warm failed: {e}")
         self.browser_processes = [p.lower() for p in CONFIG.get("browser_processes",
             ['chrome.exe', 'msedge.exe', 'firefox.exe'])]
-        self.last_url_fetch_time = 0
-        self.last_url_cache = ""
+        # 浏览器 URL 在后台探测，结果通过 on_url 作为窗口事件送回主循环
+        self.on_url = None
+        self.url_prober = desktop.BrowserURLProber(
+            backend.create_url_probe(), on_result=self._on_url_result,
+            async_mode=backend.async_url_probe and CONFIG.get("url_probe_async", True))
 
     def get_process_name(self, pid):
-        if pid in self.process_cache:
-            return self.process_cache[pid]
-        try:
-            p = psutil.Process(pid)
-            name = p.name().lower()
-            self.process_cache[pid] = name
-            return name
-        except:
-            return "unknown"
-
-    def get_browser_url(self, hwnd, process_name):
-        now = time.time()
-        if now - self.last_url_fetch_time < 2:
-            return self.last_url_cache
-
-        try:
-            window = auto.ControlFromHandle(hwnd)
-
-            if 'firefox' in process_name:
-                edit = window.EditControl(searchDepth=8, AutomationId="urlbar-input")
-                if not edit.Exists():
-                    edit = window.EditControl(searchDepth=6)
-            elif 'edge' in process_name:
-                edit = window.EditControl(Name="Address and search bar", searchDepth=6)
-                if not edit.Exists():
-                    edit = window.EditControl(searchDepth=6, foundIndex=1)
-            else:
-                edit = window.EditControl(searchDepth=6, foundIndex=1)
+        return self.process_cache.get(pid)
 
-            if edit.Exists():
-                try:
-                    url = edit.GetValuePattern().Value
-                    self.last_url_cache = url
-                    self.last_url_fetch_time = now
-                    return url
-                except:
-                    pass
-        except:
-            pass
+    def get_browser_url(self, ts, hwnd, process_name, title):
+        """命中缓存时返回 URL；还在后台探测时返回 None"""
+        return self.url_prober.lookup(ts, hwnd, process_name, title)
 
-        self.last_url_fetch_time = now
-        return ""
+    def _on_url_result(self, event):
+        if self.on_url:
+            self.on_url(event)
 
     def get_active_window_info(self):
         try:
-            hwnd = win32gui.GetForegroundWindow()
-            if not hwnd:
+            event = self.backend.foreground_event()
+            if not event:
                 return None, None, None
+            return self.resolve(event)
+        except:
+            return None, None, None
 
-            title = win32gui.GetWindowText(hwnd)
-            _, pid = win32process.GetWindowThreadProcessId(hwnd)
-            process = self.get_process_name(pid)
-
+    def resolve(self, event):
+        """补全事件里缺少的标题/进程/URL（URL 探测需在主线程进行）"""
+        title = event.title if event.title is not None else self.backend.window_text(event.hwnd)
+        process = event.process
+        if not process:
+            pid = self.backend.window_pid(event.hwnd)
+            process = self.get_process_name(pid) if pid is not None else "unknown"
+        url = event.url
+        if url is None:
             url = ""
             if process in self.browser_processes and title:
-                url = self.get_browser_url(hwnd, process)
-
-            return title, process, url
-        except:
-            return None, None, None
+                url = self.get_browser_url(event.ts, event.hwnd, process, title) or ""
+        return title, process, url
 
 
 class AsyncAISummarizer:
@@ -194,30 +214,95 @@ class AsyncAISummarizer:
             except Exception as e:
                 common.log(f"OpenAI init failed: {e}")
 
-        self.lock = threading.Lock()
-        self.retry_times = CONFIG.get("ai_retry_times", 3)
+        self.store = storage.get_store(CONFIG)
+        self.retry_times = max(1, CONFIG.get("ai_retry_times", 3))
         self.retry_delay = CONFIG.get("ai_retry_delay", 5)
-
-    def _save_raw(self, log_lines, date_str=None):
+        # 流式模式：边接收边解析，每个完整的 CSV 行立即入库
+        self.stream = CONFIG.get("ai_stream", False)
+
+        # 固定大小的工作线程池 + 有界队列（队列满时 process_logs_async 阻塞，形成背压）
+        self.queue = queue.Queue(maxsize=CONFIG.get("ai_queue_size", 20))
+        self.queue_timeout = CONFIG.get("ai_queue_timeout", 30)
+        self.drain_timeout = CONFIG.get("ai_drain_timeout", 30)
+        self.abort_event = threading.Event()
+        self.metrics_lock = threading.Lock()
+        self.in_flight = {}
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.on_request_done = None
+        # 新记录入库后的回调 (date_str, rows, write)，用于实时推送；write 为 storage.DayWrite
+        self.on_rows = None
+        # 写入文件 / 存储后的回调 (date_str, target, 字节数)，用于运行指标
+        self.on_bytes = None
+        self.cache = None
+        if CONFIG.get("classify_cache", True):
+            try:
+                self.cache = classifier.ClassificationCache(
+                    max_entries=CONFIG.get("classify_cache_size", 5000),
+                    ttl_days=CONFIG.get("classify_cache_ttl_days", 30))
+            except Exception as e:
+                common.log(f"Classify cache init failed: {e}")
+        # 可选 asyncio 引擎：共享连接池，信号量限流，引擎内部负责退避重试
+        self.engine = None
+        worker_count = CONFIG.get("ai_workers", 2)
+        if self.client and CONFIG.get("ai_engine", "thread") == "asyncio":
+            try:
+                self.engine = ai_engine.AsyncAIEngine(
+                    api_key=CONFIG["api_key"],
+                    base_url=CONFIG.get("base_url", "https://api.openai.com/v1"),
+                    model=CONFIG["model"],
+                    max_concurrency=CONFIG.get("ai_max_concurrency", 4),
+                    retry_times=self.retry_times,
+                    base_delay=self.retry_delay)
+                worker_count = max(worker_count, self.engine.max_concurrency)
+            except Exception as e:
+                common.log(f"AI engine init failed, using threads: {e}")
+        self.workers = []
+        if self.client:
+            for i in range(max(1, worker_count)):
+                worker = threading.Thread(target=self._worker, name=f"ai-worker-{i}", daemon=True)
+                worker.start()
+                self.workers.append(worker)
+        # failed/ 中的批次在实时分类空闲时按指数退避重试
+        self.reprocessor = None
+        if self.client and CONFIG.get("failed_retry", True):
+            self.reprocessor = FailedReprocessor(
+                self.reprocess, self.store, is_busy=self.is_busy,
+                interval=CONFIG.get("failed_retry_interval", 120),
+                queue=FailedQueue(base_delay=CONFIG.get("failed_retry_backoff", 300)))
+            self.reprocessor.start()
+
+    def _save_raw(self, log_lines, date_str=None, skip_existing=False):
         if date_str is None:
             date_str = common.get_today_str()
+        if skip_existing:
+            # 重放的行可能在崩溃前已经写过原始日志
+            existing = set(classifier.read_raw_lines(date_str))
+            log_lines = [line for line in log_lines if line not in existing]
+            if not log_lines:
+                return
         raw_path = os.path.join(common.RAW_LOG_DIR, f"{date_str}_raw.txt")
+        text = "\n".join(log_lines) + "\n"
         try:
             with open(raw_path, "a", encoding="utf-8") as f:
-                f.write("\n".join(log_lines) + "\n")
+                f.write(text)
         except:
-            pass
+            return
+        self._report_bytes(date_str, "raw", len(text.encode("utf-8")))
 
     def _save_failed(self, log_lines, error_msg):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
         failed_path = os.path.join(common.FAILED_LOG_DIR, f"failed_{timestamp}.txt")
+        text = f"# Error: {error_msg}\n" + "\n".join(log_lines)
         try:
             with open(failed_path, "w", encoding="utf-8") as f:
-                f.write(f"# Error: {error_msg}\n")
-                f.write("\n".join(log_lines))
+                f.write(text)
             common.log(f"Failed log saved: {failed_path}")
         except:
-            pass
+            return
+        date_str = self._extract_date_from_log(log_lines[0]) if log_lines else common.get_today_str()
+        self._report_bytes(date_str, "failed", len(text.encode("utf-8")))
 
     def _extract_date_from_log(self, log_line):
         match = re.search(r'\[(\d{4}-\d{2}-\d{2})', log_line)
@@ -240,83 +325,487 @@ class AsyncAISummarizer:
                 return [parts[0], parts[1], parts[2], ','.join(parts[3:])]
             return None
 
-    def _save_csv(self, csv_content, log_lines):
+    def _save_csv(self, csv_content, log_lines, skip_existing=False):
         clean_text = csv_content.replace("```csv", "").replace("```", "").strip()
         lines = [line for line in clean_text.split('\n') if line.strip() and ',' in line]
+        date_str = self._extract_date_from_log(log_lines[0]) if log_lines else common.get_today_str()
         if not lines:
             common.log("AI response empty or invalid format")
-            return
+            return date_str, []
 
-        date_str = self._extract_date_from_log(log_lines[0]) if log_lines else common.get_today_str()
-        self._write_to_csv(date_str, lines)
+        return date_str, self._write_to_csv(date_str, lines, skip_existing)
 
-    def _write_to_csv(self, date_str, lines):
-        file_path = os.path.join(common.LOG_DIR, f"{date_str}.csv")
+    @staticmethod
+    def _span(date_str, row):
+        return storage.to_epoch(date_str, row[0]), storage.to_epoch(date_str, row[1])
 
-        with self.lock:
-            new_file = not os.path.exists(file_path)
+    def save_local(self, log_line, date_str, row):
+        """本地规则已确定分类的记录：保存原始日志后直接写入存储，不经过 AI"""
+        self._save_raw([log_line], date_str)
+        try:
+            self._append_rows(date_str, [row])
+        except Exception as e:
+            common.log(f"Store write failed: {e}")
+
+    def _append_rows(self, date_str, rows, skip_existing=False):
+        if skip_existing:
+            # 重放的批次可能在崩溃前已经入库：跳过 (开始, 结束) 已存在的行
+            existing = {self._span(date_str, row) for row in self.store.read_rows(date_str)}
+            rows = [row for row in rows if self._span(date_str, row) not in existing]
+            if not rows:
+                return rows
+        write = self.store.append_rows(date_str, rows)
+        # 按 CSV 行估算；SQLite 的实际页写入量由索引和 WAL 决定，不在这里统计
+        self._report_bytes(date_str, "records",
+                           sum(len(",".join(str(v) for v in row).encode("utf-8")) + 2 for row in rows))
+        if self.on_rows:
             try:
-                with open(file_path, "a", encoding="utf-8-sig", newline="") as f:
-                    writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
-                    if new_file:
-                        writer.writerow(['开始时间', '结束时间', '任务分类', '任务详情'])
-                    for line in lines:
-                        parsed = self._parse_csv_line(line)
-                        if parsed:
-                            writer.writerow(parsed)
-                common.log(f"AI done: {len(lines)} records -> {date_str}.csv")
+                self.on_rows(date_str, rows, write)
             except Exception as e:
-                common.log(f"CSV write failed: {e}")
+                common.log(f"Rows callback failed: {e}")
+        return rows
+
+    def _write_to_csv(self, date_str, lines, skip_existing=False):
+        rows = [parsed for parsed in (self._parse_csv_line(line) for line in lines) if parsed]
+        try:
+            rows = self._append_rows(date_str, rows, skip_existing)
+            common.log(f"AI done: {len(rows)}/{len(lines)} records -> {date_str} ({self.store.name})")
+        except Exception as e:
+            common.log(f"Store write failed: {e}")
+            return []
+        return rows
 
-    def process_logs_async(self, log_lines):
+    def _report_bytes(self, date_str, target, nbytes):
+        if self.on_bytes:
+            try:
+                self.on_bytes(date_str, target, nbytes)
+            except Exception:
+                pass
+
+    def get_metrics(self):
+        with self.metrics_lock:
+            metrics = {
+                "queue_depth": self.queue.qsize(),
+                "in_flight": len(self.in_flight),
+                "completed": self.completed,
+                "failed": self.failed,
+                "retries": self.retries,
+                "workers": len(self.workers),
+            }
+        if self.engine:
+            # asyncio 引擎在内部重试，次数记在引擎里
+            metrics["retries"] += self.engine.get_metrics()["retries"]
+        return metrics
+
+    def _worker(self):
+        ident = threading.get_ident()
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                lines, on_done, recovered = item
+                with self.metrics_lock:
+                    self.in_flight[ident] = item
+                ok = self._run_ai_task(lines, recovered=recovered)
+                with self.metrics_lock:
+                    # shutdown 取走的批次由 shutdown 负责落盘和确认
+                    owned = self.in_flight.pop(ident, None) is item
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                # 中止的批次不确认，留在 journal 里下次启动重放
+                if owned and (ok or not self.abort_event.is_set()):
+                    self._done(on_done)
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    def _done(on_done):
+        if on_done:
+            try:
+                on_done()
+            except Exception as e:
+                common.log(f"Batch done callback failed: {e}")
+
+    def _report_request(self, latency, ok):
+        if self.on_request_done:
+            try:
+                self.on_request_done(latency, ok)
+            except Exception:
+                pass
+
+    def _apply_cache(self, lines, skip_existing=False):
+        """命中分类缓存的行直接入库，返回仍需 AI 分类的行"""
+        if not self.cache:
+            return lines
+        remaining = []
+        cached = {}
+        # (行, 命中缓存时所属日期)：写入失败时据此找回尚未入库的行
+        sources = []
+        for line in lines:
+            parsed = classifier.parse_log_line(line)
+            category = None
+            if parsed:
+                category = self.cache.get(
+                    classifier.activity_signature(parsed["process"], parsed["url"], parsed["title"]))
+            if category:
+                cached.setdefault(parsed["date"], []).append(
+                    [parsed["start"], parsed["end"], category, parsed["title"] or parsed["process"]])
+                sources.append((line, parsed["date"]))
+            else:
+                remaining.append(line)
+                sources.append((line, None))
+        written = set()
+        for date_str, rows in cached.items():
+            try:
+                self._append_rows(date_str, rows, skip_existing)
+            except Exception as e:
+                common.log(f"Store write failed: {e}")
+                # 已入库日期的行不再交给 AI，否则会重复写入
+                return [line for line, day in sources if day not in written]
+            written.add(date_str)
+        if cached:
+            stats = self.cache.get_stats()
+            common.log(f"Cache: {len(lines) - len(remaining)}/{len(lines)} lines hit "
+                       f"(hits={stats['hits']}, misses={stats['misses']}, evictions={stats['evictions']})")
+        return remaining
+
+    def _messages(self, user_content):
+        return [
+            {'role': 'system', 'content': SYSTEM_PROMPT},
+            {'role': 'user', 'content': user_content}
+        ]
+
+    def _complete(self, user_content):
+        messages = self._messages(user_content)
+        if self.engine:
+            return self.engine.complete(messages, temperature=0.3)
+        response = self.client.chat.completions.create(
+            model=CONFIG["model"],
+            messages=messages,
+            temperature=0.3,
+            stream=False
+        )
+        return response.choices[0].message.content
+
+    def _stream_deltas(self, user_content):
+        messages = self._messages(user_content)
+        if self.engine:
+            yield from self.engine.stream(messages, temperature=0.3)
+            return
+        response = self.client.chat.completions.create(
+            model=CONFIG["model"],
+            messages=messages,
+            temperature=0.3,
+            stream=True
+        )
+        finish_reason = None
+        for chunk in response:
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            if chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        if finish_reason != "stop":
+            raise ai_engine.StreamIncomplete(f"stream ended with finish_reason={finish_reason}")
+
+    def _stream_to_store(self, user_content, date_str, written, skip_existing=False):
+        """流式请求：每收到完整的 CSV 行就写入存储，已写入的行追加到 written"""
+        parser = ai_engine.CSVRowStream()
+        t0 = time.monotonic()
+        first_row = None
+
+        def write(csv_lines):
+            nonlocal first_row
+            rows = [parsed for parsed in (self._parse_csv_line(line) for line in csv_lines) if parsed]
+            if not rows or self.abort_event.is_set():
+                return
+            written.extend(self._append_rows(date_str, rows, skip_existing))
+            if first_row is None:
+                first_row = time.monotonic() - t0
+
+        for delta in self._stream_deltas(user_content):
+            write(parser.feed(delta))
+            if self.abort_event.is_set():
+                return
+        write(parser.finish())
+        if not written:
+            common.log("AI response empty or invalid format")
+            return
+        common.log(f"AI done: {len(written)} records -> {date_str} ({self.store.name}), "
+                   f"first row {first_row:.2f}s, total {time.monotonic() - t0:.2f}s")
+
+    @staticmethod
+    def _uncovered_lines(date_str, lines, rows):
+        """流中途断开时，找出还没有被已入库结果行覆盖的日志行"""
+        parsed = [(line, classifier.parse_log_line(line)) for line in lines]
+        matched = classifier.match_rows_to_lines(date_str, [p for _, p in parsed if p], rows)
+        covered = {id(p) for p, _ in matched}
+        return [line for line, p in parsed if p is None or id(p) not in covered]
+
+    def is_busy(self):
+        with self.metrics_lock:
+            return bool(self.in_flight) or self.queue.qsize() > 0
+
+    def reprocess(self, lines):
+        """重试 failed/ 中的批次：只请求一次，失败不再另存（由重试队列退避）"""
+        return self._run_ai_task(lines, retry=False)
+
+    def _run_ai_task(self, lines, retry=True, recovered=False):
+        """recovered：journal 重放的批次，入库时跳过崩溃前已写入的行"""
+        lines = self._apply_cache(lines, recovered)
+        if not lines:
+            return True
+        common.log(f"AI request: {len(lines)} logs...")
+        user_content = "请分析以下日志并输出CSV格式结果:\n" + "\n".join(lines)
+        date_str = self._extract_date_from_log(lines[0])
+
+        # asyncio 引擎自己做退避重试，这里只调用一次
+        attempts = 1 if self.engine or not retry else self.retry_times
+        for attempt in range(attempts):
+            if self.abort_event.is_set():
+                return False
+            t0 = time.monotonic()
+            written = []
+            try:
+                if self.stream:
+                    self._stream_to_store(user_content, date_str, written, recovered)
+                    rows = written
+                else:
+                    content = self._complete(user_content)
+                self._report_request(time.monotonic() - t0, True)
+                if self.abort_event.is_set():
+                    # shutdown 已把该批次写入 failed/，避免重复入库
+                    return False
+                if not self.stream:
+                    date_str, rows = self._save_csv(content, lines, recovered)
+                if self.cache and rows:
+                    self.cache.learn(date_str, lines, rows)
+                return True
+            except Exception as e:
+                self._report_request(time.monotonic() - t0, False)
+                if self.abort_event.is_set():
+                    return False
+                if written:
+                    # 流中途断开：已入库的行保留，只重试没覆盖到的日志行
+                    if self.cache:
+                        self.cache.learn(date_str, lines, written)
+                    lines = self._uncovered_lines(date_str, lines, written)
+                    common.log(f"AI stream broken after {len(written)} rows, {len(lines)} logs left: {e}")
+                    if not lines:
+                        return True
+                    user_content = "请分析以下日志并输出CSV格式结果:\n" + "\n".join(lines)
+                if attempt < attempts - 1:
+                    with self.metrics_lock:
+                        self.retries += 1
+                    common.log(f"AI retry {attempt+1}: {e}")
+                    # 关闭时被中止的批次由 shutdown 统一落盘
+                    if self.abort_event.wait(self.retry_delay):
+                        return False
+                elif retry:
+                    common.log(f"AI failed: {e}")
+                    self._save_failed(lines, str(e))
+        return False
+
+    def process_logs_async(self, log_lines, on_done=None, recovered=False):
+        """提交一批日志；on_done 在批次入库或写入 failed/ 之后调用（工作线程中）"""
         if not log_lines:
+            self._done(on_done)
             return
 
         date_str = self._extract_date_from_log(log_lines[0]) if log_lines else None
-        self._save_raw(log_lines, date_str)
+        self._save_raw(log_lines, date_str, skip_existing=recovered)
 
         if not self.client:
             common.log("No API key, skipping AI")
+            self._done(on_done)
+            return
+
+        try:
+            self.queue.put((log_lines, on_done, recovered), timeout=self.queue_timeout)
+        except queue.Full:
+            common.log(f"AI queue full ({self.queue.maxsize}), batch saved for retry")
+            self._save_failed(log_lines, "queue full")
+            self._done(on_done)
+            return
+        metrics = self.get_metrics()
+        common.log(f"AI queued: depth={metrics['queue_depth']}, in-flight={metrics['in_flight']}")
+
+    def shutdown(self, timeout=None):
+        """停止接收新批次，等待队列排空；超时未完成的批次写入 failed/"""
+        if self.reprocessor:
+            self.reprocessor.stop_event.set()
+        if not self.workers:
             return
+        timeout = self.drain_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        common.log(f"AI draining: {self.get_metrics()}")
 
-        def run_ai_task(lines):
-            common.log(f"AI request: {len(lines)} logs...")
-            user_content = "请分析以下日志并输出CSV格式结果:\n" + "\n".join(lines)
+        try:
+            for _ in self.workers:
+                self.queue.put(None, timeout=max(deadline - time.monotonic(), 0.01))
+            for worker in self.workers:
+                worker.join(max(deadline - time.monotonic(), 0))
+        except queue.Full:
+            pass
 
-            for attempt in range(self.retry_times):
+        if any(worker.is_alive() for worker in self.workers):
+            self.abort_event.set()
+            pending = []
+            while True:
                 try:
-                    response = self.client.chat.completions.create(
-                        model=CONFIG["model"],
-                        messages=[
-                            {'role': 'system', 'content': SYSTEM_PROMPT},
-                            {'role': 'user', 'content': user_content}
-                        ],
-                        temperature=0.3,
-                        stream=False
-                    )
-                    self._save_csv(response.choices[0].message.content, lines)
-                    return
-                except Exception as e:
-                    if attempt < self.retry_times - 1:
-                        common.log(f"AI retry {attempt+1}: {e}")
-                        time.sleep(self.retry_delay)
-                    else:
-                        common.log(f"AI failed: {e}")
-                        self._save_failed(lines, str(e))
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item:
+                    pending.append(item)
+            with self.metrics_lock:
+                pending.extend(self.in_flight.values())
+                self.in_flight.clear()
+            for lines, on_done, _ in pending:
+                self._save_failed(lines, "shutdown before AI finished")
+                self._done(on_done)
+            common.log(f"AI drain timeout, {len(pending)} batches saved")
+
+        if self.reprocessor:
+            # 正在进行的重试请求会被 abort_event 中止，文件保留到下次启动
+            self.abort_event.set()
+            self.reprocessor.stop()
+        if self.engine:
+            # 工作线程已退出或已中止，引擎里剩下的请求直接取消并关闭连接池
+            self.engine.shutdown(timeout=0)
+
+        self.workers = []
+        common.log(f"AI stopped: {self.get_metrics()}")
+
+
+class AdaptiveBatcher:
+    """按 token 预算、最老记录等待时间和 API 延迟/错误率决定何时提交一批日志"""
+    PROMPT_OVERHEAD = 400  # 系统提示词 + 指令的大致 token 数
+
+    def __init__(self, clock=None):
+        self.clock = clock or desktop.SystemClock()
+        self.base_budget = CONFIG.get("batch_token_budget", 1500)
+        self.min_budget = max(self.base_budget // 4, 200)
+        self.max_budget = self.base_budget * 4
+        self.token_budget = self.base_budget
+        self.max_age = CONFIG.get("batch_max_age", 600)
+        self.max_lines = CONFIG.get("batch_max_lines", 50)
+        self.slow_latency = CONFIG.get("batch_slow_latency", 10)
+
+        self.lock = threading.Lock()
+        self.tokens = 0
+        self.lines = 0
+        self.oldest = None
+        self.date_str = None
+        self.latencies = []
+        self.results = []
+
+        self.started = self.clock.monotonic()
+        self.batch_count = 0
+        self.line_count = 0
+
+    @staticmethod
+    def estimate_tokens(text):
+        # 中文约 1 字 1 token，ASCII 约 4 字符 1 token
+        non_ascii = sum(1 for ch in text if ord(ch) > 127)
+        return non_ascii + (len(text) - non_ascii) // 4 + 1
+
+    def day_changed(self, date_str):
+        with self.lock:
+            return self.date_str is not None and date_str != self.date_str
 
-        thread = threading.Thread(target=run_ai_task, args=(log_lines,))
-        thread.daemon = True
-        thread.start()
+    def add(self, log_line, date_str):
+        """记录一行，返回 True 表示已达到预算应立即提交"""
+        with self.lock:
+            self.tokens += self.estimate_tokens(log_line)
+            self.lines += 1
+            self.date_str = date_str
+            if self.oldest is None:
+                self.oldest = self.clock.monotonic()
+            return self.tokens + self.PROMPT_OVERHEAD >= self.token_budget or self.lines >= self.max_lines
+
+    def is_due(self):
+        with self.lock:
+            return self.oldest is not None and self.clock.monotonic() - self.oldest >= self.max_age
+
+    def seconds_until_due(self):
+        """距离最老记录超时还有多少秒，缓冲为空时返回 None"""
+        with self.lock:
+            if self.oldest is None:
+                return None
+            return self.oldest + self.max_age - self.clock.monotonic()
+
+    def on_flush(self, line_count):
+        with self.lock:
+            self.batch_count += 1
+            self.line_count += line_count
+            self._reset()
+
+    def _reset(self):
+        self.tokens = 0
+        self.lines = 0
+        self.oldest = None
+        self.date_str = None
+
+    def record_result(self, latency, ok):
+        """AI 请求结果反馈：慢则加大批次摊薄开销，频繁出错则缩小批次"""
+        with self.lock:
+            self.latencies = (self.latencies + [latency])[-20:]
+            self.results = (self.results + [ok])[-20:]
+            error_rate = self.results.count(False) / len(self.results)
+            avg_latency = sum(self.latencies) / len(self.latencies)
+            if error_rate > 0.3:
+                self.token_budget = max(self.min_budget, int(self.token_budget * 0.7))
+            elif avg_latency > self.slow_latency:
+                self.token_budget = min(self.max_budget, int(self.token_budget * 1.25))
+            else:
+                # 恢复正常后逐步回到基准预算
+                self.token_budget += (self.base_budget - self.token_budget) // 4
+
+    def get_stats(self):
+        with self.lock:
+            hours = max((self.clock.monotonic() - self.started) / 3600, 1 / 60)
+            return {
+                "batches_per_hour": round(self.batch_count / hours, 2),
+                "avg_lines_per_batch": round(self.line_count / max(self.batch_count, 1), 2),
+                "token_budget": self.token_budget,
+                "avg_latency": round(sum(self.latencies) / len(self.latencies), 2) if self.latencies else 0,
+            }
 
 
 class SmartTracker:
-    def __init__(self):
-        self.collector = DataCollector()
-        self.input_monitor = InputMonitor()
-        self.ai = AsyncAISummarizer()
+    def __init__(self, backend=None, ai=None, journal=None, live=None, metrics=None):
+        """backend: desktop 平台后端（默认真实桌面）；ai: 可替换的分类提交端（回放基准用）
+        journal: 日志缓冲的预写日志（默认 logs/journal.log，journal_enabled=false 时不使用）
+        live: 向仪表盘推送新记录和当前活动的发布端（默认按 live_push 配置创建）
+        metrics: 运行指标注册表（默认新建，并按 metrics_* 配置启动 HTTP 端点和快照文件）"""
+        self.backend = backend or desktop.create_backend(CONFIG)
+        self.clock = self.backend.clock
+        self.collector = DataCollector(self.backend)
+        self.input_monitor = InputMonitor(self.backend)
+        self.ai = ai or AsyncAISummarizer()
         self.log_buffer = []
+        self.journal = journal
+        if journal is None and CONFIG.get("journal_enabled", True):
+            try:
+                self.journal = LogJournal(fsync_interval=CONFIG.get("journal_fsync_interval", 1.0))
+            except Exception as e:
+                common.log(f"Journal init failed: {e}")
+
+        self.live = live if live is not None else create_publisher(CONFIG)
+        if self.live:
+            self.ai.on_rows = self.live.publish_rows
 
         self.batch_size = CONFIG.get("batch_size", 5)
+        self.batcher = AdaptiveBatcher(self.clock) if CONFIG.get("adaptive_batching", True) else None
+        if self.batcher:
+            self.ai.on_request_done = self.batcher.record_result
+        self.rules = None
+        if CONFIG.get("local_classifier", True):
+            self.rules = classifier.RuleClassifier(CONFIG.get("local_rules"), self.collector.browser_processes)
         self.check_interval = CONFIG.get("check_interval", 30)
         self.idle_timeout = CONFIG.get("idle_timeout", 300)
         self.sleep_threshold = CONFIG.get("sleep_threshold", 120)
@@ -324,7 +813,7 @@ class SmartTracker:
         self.stable_process = ""
         self.stable_title = ""
         self.stable_url = ""
-        self.stable_start_time = time.time()
+        self.stable_start_time = self.clock.time()
 
         self.pending_process = None
         self.pending_title = None
@@ -333,14 +822,132 @@ class SmartTracker:
 
         self.is_idle = False
         self.idle_start_time = 0
-        self.last_loop_monotonic = time.monotonic()
+        self.last_loop_monotonic = self.clock.monotonic()
+
+        # 事件驱动主循环：窗口事件和输入唤醒都进入同一个队列，没有事件时睡到下一个截止时间
+        self.events = queue.Queue()
+        self.source = self.backend.create_window_source()
+        self.max_wait = CONFIG.get("event_max_wait", 30)
+        self.latest_window = None
+        self.wake_pending = False
+        self.wakeups = 0
+        self.stats_started = (self.clock.monotonic(), time.process_time())
+        self.input_monitor.on_activity = self._on_input_activity
+        self.collector.on_url = self.events.put
+
+        self.metrics = metrics or MetricsRegistry()
+        self.exporter = create_exporter(self.metrics, CONFIG) if metrics is None else None
+        self._register_metrics()
+        if self.journal:
+            self._replay_journal()
+
+    def _register_metrics(self):
+        m = self.metrics
+        m.histogram("tracker_loop_tick_seconds", "Main loop processing time per wakeup")
+        m.histogram("tracker_window_probe_seconds", "Resolving title / process / URL of a window event")
+        m.histogram("tracker_url_probe_seconds", "Browser address bar probe (background thread)")
+        m.histogram("tracker_ai_request_seconds", "AI classification request latency")
+        m.counter("tracker_ai_requests_total", "AI classification requests by result")
+        m.counter("tracker_bytes_written_total", "Bytes written per day and target (raw/records/journal/failed)")
+        m.counter("tracker_records_total", "Records committed, by classification path")
+        m.gauge("tracker_ai_queue_depth", "Batches waiting for an AI worker")
+        m.gauge("tracker_ai_in_flight", "Batches being classified")
+        m.counter("tracker_ai_retries_total", "AI request retries")
+        m.counter("tracker_ai_batches_total", "Finished AI batches by result")
+        m.gauge("tracker_buffer_lines", "Log lines buffered for the next batch")
+        m.gauge("tracker_journal_pending_lines", "Journal lines not yet handed to a batch")
+        m.gauge("tracker_url_cache_hit_ratio", "Browser URL cache hit ratio")
+        m.gauge("tracker_process_cache_hit_ratio", "Process name cache hit ratio")
+        m.gauge("tracker_live_clients", "Connected dashboard subscribers")
+        m.gauge("tracker_idle", "1 while the user is idle")
+        if self.exporter:
+            process_collector(m)
+        m.add_collector(self._collect_metrics)
+
+        self.collector.url_prober.on_latency = lambda s: m.observe("tracker_url_probe_seconds", s)
+        self.ai.on_bytes = self._on_bytes
+        batcher_done = self.ai.on_request_done
+
+        def on_request_done(latency, ok):
+            m.observe("tracker_ai_request_seconds", latency)
+            m.inc("tracker_ai_requests_total", result="ok" if ok else "error")
+            if batcher_done:
+                batcher_done(latency, ok)
+
+        self.ai.on_request_done = on_request_done
+
+    def _on_bytes(self, date_str, target, nbytes):
+        self.metrics.inc("tracker_bytes_written_total", nbytes, day=date_str, target=target)
+
+    def _collect_metrics(self, m):
+        """导出前读取各模块已有的统计"""
+        if hasattr(self.ai, "get_metrics"):
+            ai = self.ai.get_metrics()
+            m.set("tracker_ai_queue_depth", ai["queue_depth"])
+            m.set("tracker_ai_in_flight", ai["in_flight"])
+            m.set("tracker_ai_retries_total", ai["retries"])
+            m.set("tracker_ai_batches_total", ai["completed"], result="ok")
+            m.set("tracker_ai_batches_total", ai["failed"], result="error")
+        m.set("tracker_buffer_lines", len(self.log_buffer))
+        if self.journal:
+            m.set("tracker_journal_pending_lines", self.journal.get_stats()["pending_lines"])
+        m.set("tracker_url_cache_hit_ratio", self.collector.url_prober.get_stats()["hit_ratio"])
+        m.set("tracker_process_cache_hit_ratio", self.collector.process_cache.get_stats()["hit_ratio"])
+        if self.live:
+            m.set("tracker_live_clients", self.live.get_stats()["clients"])
+        m.set("tracker_idle", int(self.is_idle))
+        m.prune("tracker_bytes_written_total", "day", CONFIG.get("metrics_keep_days", 7))
+
+    def _replay_journal(self):
+        """重新提交上次退出前未处理完的日志行：按日期分组，每批不超过 batch_max_lines 行"""
+        recovered = self.journal.recovered
+        self.journal.recovered = []
+        max_lines = self.batcher.max_lines if self.batcher else self.batch_size
+        batch = []
+        for i, (seq, line) in enumerate(recovered):
+            batch.append(line)
+            next_line = recovered[i + 1][1] if i + 1 < len(recovered) else None
+            # 行首固定为 "[YYYY-MM-DD"，一个批次只包含同一天的记录
+            if next_line is None or len(batch) >= max_lines or next_line[1:11] != line[1:11]:
+                self._submit(batch, self.journal.take_batch(seq), recovered=True)
+                batch = []
+
+    def _submit(self, logs, batch, recovered=False):
+        on_done = (lambda: self.journal.ack(batch)) if batch else None
+        self.ai.process_logs_async(logs, on_done=on_done, recovered=recovered)
 
     def flush_buffer(self):
         if not self.log_buffer:
             return
         logs = self.log_buffer[:]
         self.log_buffer = []
-        self.ai.process_logs_async(logs)
+        batch = self.journal.take_batch() if self.journal else None
+        if self.batcher:
+            self.batcher.on_flush(len(logs))
+            stats = self.batcher.get_stats()
+            common.log(f"Batch: {len(logs)} lines, {stats['batches_per_hour']}/h, "
+                       f"avg {stats['avg_lines_per_batch']} lines, budget {stats['token_budget']}")
+        self._submit(logs, batch)
+        self._log_rule_stats()
+
+    def _publish_now(self):
+        """把当前活动推送给仪表盘的「正在进行」面板"""
+        if not self.live:
+            return
+        if self.is_idle:
+            self.live.publish_now("idle", "系统空闲", "", self.idle_start_time, idle=True)
+        else:
+            self.live.publish_now(self.stable_process, self.stable_title, self.stable_url,
+                                  self.stable_start_time)
+
+    def _log_rule_stats(self):
+        if not self.rules:
+            return
+        stats = self.rules.get_stats()
+        lines_per_call = self.batcher.get_stats()["avg_lines_per_batch"] if self.batcher else self.batch_size
+        saved = int(stats["hits"] / max(lines_per_call, 1))
+        common.log(f"Local rules: hit {stats['hit_ratio']:.0%} ({stats['hits']}/{stats['hits'] + stats['misses']}), "
+                   f"~{saved} API calls saved")
 
     def _is_same_task(self, proc1, url1, proc2, url2):
         if proc1 != proc2:
@@ -362,45 +969,193 @@ class SmartTracker:
             next_day = datetime.combine(dt_start.date() + timedelta(days=1), datetime.min.time())
             midnight_ts = next_day.timestamp()
             common.log(f"Day split: {dt_start.date()} -> {dt_end.date()}")
-            self._commit_log(process, title, url, start_ts, midnight_ts, force_idle)
+            # 前半段止于 23:59:59：按天存储的行只有 HH:MM:SS，表示不了 24:00:00，
+            # 写成 00:00:00 会被当作当天零点（时长变负）。每次跨天因此少记最后 1 秒。
+            self._commit_log(process, title, url, start_ts, midnight_ts - 1, force_idle)
             self._commit_log(process, title, url, midnight_ts, end_ts, force_idle)
             return
 
-        activity_level = "低" if force_idle else self.input_monitor.get_and_reset()
+        if force_idle:
+            activity_level = "低"
+        else:
+            stats = self.input_monitor.segment_stats(start_ts, end_ts)
+            # 有输入的秒数和每秒强度分布随原始日志行保存（logs/raw 与 journal），见 classifier.parse_activity
+            activity_level = (f"{stats.level} {stats.active_seconds}/{int(duration)}s "
+                              f"强度:{'/'.join(map(str, stats.histogram))}")
         url_part = f"[URL: {url}]" if url else ""
         log_content = f"<{process}> [活跃度:{activity_level}] {url_part} {title}"
         log_line = f"[{dt_start.strftime('%Y-%m-%d %H:%M:%S')} - {dt_end.strftime('%Y-%m-%d %H:%M:%S')}] {log_content}"
 
-        self.log_buffer.append(log_line)
-        common.log(f"Record: {process} ({int(duration)}s) [{activity_level}]")
+        if force_idle:
+            common.log(f"Record: {process} ({int(duration)}s) [{activity_level}]")
+        else:
+            common.log(f"Record: {process} ({int(duration)}s) [{activity_level}] events={stats.events}")
+
+        if self.rules:
+            category = self.rules.classify(process, url, title)
+            if category:
+                row = [dt_start.strftime('%H:%M:%S'), dt_end.strftime('%H:%M:%S'), category, title or process]
+                self.ai.save_local(log_line, dt_start.strftime('%Y-%m-%d'), row)
+                self.metrics.inc("tracker_records_total", path="local")
+                return
+        self.metrics.inc("tracker_records_total", path="ai")
+
+        if self.journal:
+            try:
+                seq = self.journal.append(log_line)
+                self._on_bytes(dt_start.strftime('%Y-%m-%d'), "journal", len(f"+ {seq} {log_line}\n".encode("utf-8")))
+            except (OSError, ValueError) as e:
+                common.log(f"Journal write failed: {e}")
+
+        if not self.batcher:
+            self.log_buffer.append(log_line)
+            if len(self.log_buffer) >= self.batch_size:
+                self.flush_buffer()
+            return
 
-        if len(self.log_buffer) >= self.batch_size:
+        date_str = dt_start.strftime('%Y-%m-%d')
+        if self.batcher.day_changed(date_str):
+            # 一个批次只包含同一天的记录，保证结果写入正确的日期
+            self.flush_buffer()
+        self.log_buffer.append(log_line)
+        if self.batcher.add(log_line, date_str):
             self.flush_buffer()
 
-    def _handle_idle(self):
+    def _on_input_activity(self):
+        # 只在空闲期间唤醒主循环，平时输入不产生额外唤醒
+        if self.is_idle and not self.wake_pending:
+            self.wake_pending = True
+            self.events.put(None)
+
+    def _handle_idle(self, now):
         idle_duration = self.input_monitor.get_idle_duration()
 
         if not self.is_idle and idle_duration > self.idle_timeout:
             self.is_idle = True
-            self.idle_start_time = time.time() - idle_duration
+            self.idle_start_time = now - idle_duration
             common.log(f"Idle start ({int(idle_duration)}s)")
             if self.stable_process:
                 self._commit_log(self.stable_process, self.stable_title, self.stable_url,
                                self.stable_start_time, self.idle_start_time)
+            self._publish_now()
             return True
 
         elif self.is_idle and idle_duration < 5:
             common.log("Idle end")
-            self._commit_log("idle", "系统空闲", "", self.idle_start_time, time.time(), force_idle=True)
+            idle_end = now - idle_duration
+            self._commit_log("idle", "系统空闲", "", self.idle_start_time, idle_end, force_idle=True)
             self.is_idle = False
-            self.stable_start_time = time.time()
+            self.pending_process = None
+            self.stable_start_time = idle_end
+            if self.latest_window:
+                self._on_window(idle_end, *self.latest_window)
+            self._publish_now()
             return False
 
         return self.is_idle
 
+    def _on_window(self, ts, raw_title, raw_process, raw_url):
+        """防抖状态机：新窗口先进入 pending，持续 check_interval 秒后才确认切换"""
+        raw_title = raw_title.strip()
+
+        if raw_process in self.collector.browser_processes and not raw_url:
+            if raw_process == self.stable_process:
+                raw_url = self.stable_url
+            elif raw_process == self.pending_process:
+                raw_url = self.pending_url
+
+        if self._is_same_task(self.stable_process, self.stable_url, raw_process, raw_url):
+            if self.pending_process:
+                common.log(f"Skip short switch: {self.pending_process}")
+                self.pending_process = None
+            changed = raw_title != self.stable_title or (raw_url and raw_url != self.stable_url)
+            self.stable_title = raw_title
+            if raw_url:
+                self.stable_url = raw_url
+            if changed:
+                self._publish_now()
+        elif self.pending_process and self._is_same_task(self.pending_process, self.pending_url,
+                                                         raw_process, raw_url):
+            # 后台探测到的 URL 晚于窗口事件到达
+            if raw_url and not self.pending_url:
+                self.pending_url = raw_url
+        else:
+            self.pending_process = raw_process
+            self.pending_title = raw_title
+            self.pending_url = raw_url
+            self.pending_start_time = ts
+
+    def _confirm_pending(self, now):
+        if self.pending_process and now - self.pending_start_time > self.check_interval:
+            self._commit_log(self.stable_process, self.stable_title, self.stable_url,
+                           self.stable_start_time, self.pending_start_time)
+            common.log(f"Switch: {self.stable_process} -> {self.pending_process}")
+            self.stable_process = self.pending_process
+            self.stable_title = self.pending_title
+            self.stable_url = self.pending_url
+            self.stable_start_time = self.pending_start_time
+            self.pending_process = None
+            self._publish_now()
+
+    def _next_timeout(self, now):
+        """距离最近一个截止时间（确认切换 / 进入空闲 / 批次超时）的秒数"""
+        deadlines = [self.max_wait]
+        if self.pending_process:
+            deadlines.append(self.pending_start_time + self.check_interval - now)
+        if not self.is_idle:
+            deadlines.append(self.idle_timeout - self.input_monitor.get_idle_duration())
+        if self.batcher:
+            due = self.batcher.seconds_until_due()
+            if due is not None:
+                deadlines.append(due)
+        # 略微越过截止时间，保证比较条件（>）成立
+        return max(min(deadlines), 0) + 0.05
+
+    def _next_events(self, timeout):
+        """等待事件；同一窗口连续的标题变化只保留最后一个"""
+        try:
+            events = [self.clock.wait(self.events, timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        merged = []
+        for event in events:
+            if event is None:
+                continue
+            if merged and event.hwnd and merged[-1].hwnd == event.hwnd and event.title is None:
+                merged[-1] = event
+            else:
+                merged.append(event)
+        return merged
+
+    def get_loop_stats(self):
+        started_mono, started_cpu = self.stats_started
+        hours = max((self.clock.monotonic() - started_mono) / 3600, 1 / 3600)
+        return {
+            "wakeups_per_hour": round(self.wakeups / hours, 1),
+            "cpu_seconds_per_hour": round((time.process_time() - started_cpu) / hours, 3),
+        }
+
+    def _start_source(self):
+        try:
+            self.source.start(self.events.put)
+        except Exception as e:
+            common.log(f"Window source failed, polling: {e}")
+            self.source = desktop.PollingSource(interval=CONFIG.get("poll_interval", 1))
+            self.source.start(self.events.put)
+        common.log(f"Window source: {type(self.source).__name__}")
+
     def run(self):
         common.log(f"Tracker started (PID: {os.getpid()})")
-        common.log(f"Config: interval={self.check_interval}s, batch={self.batch_size}")
+        if self.batcher:
+            common.log(f"Config: interval={self.check_interval}s, adaptive batch "
+                       f"(budget={self.batcher.token_budget} tokens, max_age={self.batcher.max_age}s)")
+        else:
+            common.log(f"Config: interval={self.check_interval}s, batch={self.batch_size}")
 
         while not self.stable_title:
             t, p, u = self.collector.get_active_window_info()
@@ -408,92 +1163,97 @@ class SmartTracker:
                 self.stable_title = t
                 self.stable_process = p
                 self.stable_url = u
-                self.stable_start_time = time.time()
+                self.stable_start_time = self.clock.time()
                 common.log(f"Initial: {self.stable_process}")
-            time.sleep(1)
+                self._publish_now()
+            else:
+                self.clock.sleep(1)
 
-        self.last_loop_monotonic = time.monotonic()
+        self._start_source()
+        self.last_loop_monotonic = self.clock.monotonic()
+        last_stats_log = self.last_loop_monotonic
+        timeout = 0
 
         try:
             while True:
-                time.sleep(1)
+                events = self._next_events(timeout)
+                tick_started = time.perf_counter()
+                self.wakeups += 1
+                self.wake_pending = False
 
-                now_monotonic = time.monotonic()
+                now_monotonic = self.clock.monotonic()
+                now = self.clock.time()
                 loop_gap = now_monotonic - self.last_loop_monotonic
 
-                if loop_gap > self.sleep_threshold:
+                if loop_gap - timeout > self.sleep_threshold:
                     common.log(f"Sleep detected ({int(loop_gap)}s)")
-                    self._commit_log(self.stable_process, self.stable_title, self.stable_url,
-                                   self.stable_start_time, time.time() - loop_gap)
-                    self.input_monitor.reset_counters()
+                    if self.is_idle:
+                        # 空闲开始时已提交过当前窗口，这里只补上睡眠前的空闲段
+                        self._commit_log("idle", "系统空闲", "", self.idle_start_time, now - loop_gap,
+                                         force_idle=True)
+                    else:
+                        self._commit_log(self.stable_process, self.stable_title, self.stable_url,
+                                       self.stable_start_time, now - loop_gap)
+                    self.input_monitor.restart_idle(now)
                     t, p, u = self.collector.get_active_window_info()
                     if t:
                         self.stable_title, self.stable_process, self.stable_url = t, p, u
-                    self.stable_start_time = time.time()
+                    self.stable_start_time = now
                     self.pending_process = None
                     self.is_idle = False
+                    self._publish_now()
                     self.last_loop_monotonic = now_monotonic
+                    timeout = self._next_timeout(now)
+                    self.metrics.observe("tracker_loop_tick_seconds", time.perf_counter() - tick_started)
                     continue
 
                 self.last_loop_monotonic = now_monotonic
 
-                if self._handle_idle():
-                    continue
-
-                raw_title, raw_process, raw_url = self.collector.get_active_window_info()
-                if not raw_title:
-                    continue
-
-                raw_title = raw_title.strip()
-
-                if raw_process in self.collector.browser_processes and not raw_url:
-                    if raw_process == self.stable_process:
-                        raw_url = self.stable_url
-                    elif raw_process == self.pending_process:
-                        raw_url = self.pending_url
-
-                is_stable = self._is_same_task(self.stable_process, self.stable_url, raw_process, raw_url)
-
-                if is_stable:
-                    if self.pending_process:
-                        common.log(f"Skip short switch: {self.pending_process}")
-                        self.pending_process = None
-                    self.stable_title = raw_title
-                    if raw_url:
-                        self.stable_url = raw_url
-                else:
-                    if not self.pending_process:
-                        self.pending_process = raw_process
-                        self.pending_title = raw_title
-                        self.pending_url = raw_url
-                        self.pending_start_time = time.time()
-                    else:
-                        if self._is_same_task(self.pending_process, self.pending_url, raw_process, raw_url):
-                            if time.time() - self.pending_start_time > self.check_interval:
-                                self._commit_log(self.stable_process, self.stable_title, self.stable_url,
-                                               self.stable_start_time, self.pending_start_time)
-                                common.log(f"Switch: {self.stable_process} -> {self.pending_process}")
-                                self.stable_process = self.pending_process
-                                self.stable_title = self.pending_title
-                                self.stable_url = self.pending_url
-                                self.stable_start_time = self.pending_start_time
-                                self.pending_process = None
-                        else:
-                            self.pending_process = raw_process
-                            self.pending_title = raw_title
-                            self.pending_url = raw_url
-                            self.pending_start_time = time.time()
-
-        except KeyboardInterrupt:
+                for event in events:
+                    t0 = time.perf_counter()
+                    title, process, url = self.collector.resolve(event)
+                    self.metrics.observe("tracker_window_probe_seconds", time.perf_counter() - t0)
+                    if title:
+                        self.latest_window = (title, process, url)
+                        if not self.is_idle:
+                            self._on_window(event.ts, title, process, url)
+
+                if self.batcher and self.batcher.is_due():
+                    self.flush_buffer()
+
+                if not self._handle_idle(now):
+                    self._confirm_pending(now)
+
+                if now_monotonic - last_stats_log >= 3600:
+                    last_stats_log = now_monotonic
+                    common.log(f"Loop: {self.get_loop_stats()}")
+                    common.log(f"URL probe: {self.collector.url_prober.get_stats()}")
+                    common.log(f"Process cache: {self.collector.process_cache.get_stats()}")
+                timeout = self._next_timeout(now)
+                self.metrics.observe("tracker_loop_tick_seconds", time.perf_counter() - tick_started)
+
+        except (KeyboardInterrupt, desktop.ReplayFinished):
             common.log("Stopping...")
+            self.source.stop()
+            self.collector.url_prober.stop()
             if self.stable_process:
                 self._commit_log(self.stable_process, self.stable_title, self.stable_url,
-                               self.stable_start_time, time.time())
+                               self.stable_start_time, self.clock.time())
             self.flush_buffer()
-            common.log("Tracker stopped")
+            self.ai.shutdown()
+            if self.journal:
+                common.log(f"Journal: {self.journal.get_stats()}")
+                self.journal.close()
+            if self.live:
+                common.log(f"Live push: {self.live.get_stats()}")
+                self.live.close()
+            if self.exporter:
+                self.exporter.close()
+            common.log(f"Tracker stopped: {self.get_loop_stats()}")
 
 
 if __name__ == "__main__":
+    os.chdir(SCRIPT_DIR)
     import socket
     try:
         lock_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -3,12 +3,16 @@
 
 import streamlit as st
 import pandas as pd
-import os
 import plotly.express as px
 from datetime import datetime, date, timedelta
 import common
+import storage
+import analysis
+import classifier
+import failed_queue
+import live
+import query
 import time
-import csv
 
 # ==========================================
 # 【修复】Streamlit 性能优化配置
@@ -42,95 +46,41 @@ st.markdown("""
 # ==========================================
 # 2. 数据处理函数（带缓存）
 # ==========================================
-@st.cache_data(ttl=30)
-def load_csv_file(file_path, date_str):
-    """读取单个CSV文件（带缓存）"""
-    try:
-        df = None
-        for encoding in ['utf-8-sig', 'utf-8', 'gbk']:
-            try:
-                df = pd.read_csv(file_path, encoding=encoding, on_bad_lines='skip')
-                break
-            except:
-                continue
-        
-        if df is None or df.empty:
-            return None
-        
-        if len(df.columns) >= 4:
-            df.columns = ['开始时间', '结束时间', '任务分类', '任务详情'][:len(df.columns)]
-        else:
-            return None
-        
-        return df
-    except:
-        return None
+@st.cache_resource
+def get_store():
+    """进程内共享的存储后端"""
+    return storage.get_store()
 
 
-def process_dataframe(df, date_str):
-    """处理DataFrame，添加时间列"""
-    if df is None or df.empty:
-        return None
-    
-    df = df.copy()
-    df['日期'] = date_str
-    base_date = datetime.strptime(date_str, "%Y-%m-%d")
-    
-    def parse_time(t_str):
-        if pd.isna(t_str):
-            return None
-        t_str = str(t_str).strip()
-        for fmt in ['%Y-%m-%d %H:%M:%S', '%H:%M:%S', '%H:%M']:
-            try:
-                if len(t_str) > 10:
-                    return pd.to_datetime(t_str)
-                t = datetime.strptime(t_str, fmt).time()
-                return datetime.combine(base_date, t)
-            except:
-                continue
-        return None
-    
-    df['Start_DT'] = df['开始时间'].apply(parse_time)
-    df['End_DT'] = df['结束时间'].apply(parse_time)
-    df = df.dropna(subset=['Start_DT', 'End_DT'])
-    
-    if df.empty:
+@st.cache_resource
+def get_live():
+    """tracker 实时推送的订阅端，所有会话共享；live_push=false 时为 None"""
+    config = common.load_config()
+    if not config.get("live_push", True):
         return None
-    
-    df['Duration_Min'] = (df['End_DT'] - df['Start_DT']).apply(
-        lambda x: max(x.total_seconds() / 60, 0) if pd.notna(x) else 0
-    )
-    
-    return df
-
-
-def load_data_by_range(start_date, end_date):
-    """加载日期范围内的数据"""
-    dfs = []
-    current = start_date
-    while current <= end_date:
-        d_str = current.strftime("%Y-%m-%d")
-        f_path = os.path.join(common.LOG_DIR, f"{d_str}.csv")
-        if os.path.exists(f_path):
-            raw_df = load_csv_file(f_path, d_str)
-            df = process_dataframe(raw_df, d_str)
-            if df is not None:
-                dfs.append(df)
-        current += timedelta(days=1)
-    
-    if dfs:
-        return pd.concat(dfs, ignore_index=True)
-    return pd.DataFrame()
+    # 端口和握手 token 由 tracker 每次启动时写入 logs/live_endpoint.json
+    return live.LiveSubscriber(endpoint_path=live.ENDPOINT_PATH)
+
+
+@st.cache_resource
+def get_query_service():
+    """所有会话共享的查询服务：数据在进程内只保留一份，相同查询并发时只计算一次"""
+    return query.QueryService(get_store(), get_live())
+
+
+@st.cache_data(ttl=60)
+def load_failed_backlog():
+    """failed/ 中等待后台重试的批次（一分钟刷新一次）"""
+    return failed_queue.backlog_summary()
 
 
-def calculate_goal_progress(df, goals):
-    """计算目标完成进度"""
-    if df.empty or not goals.get("enabled"):
+def calculate_goal_progress(category_minutes, goals):
+    """计算目标完成进度，category_minutes 为 {分类: 分钟}"""
+    if not category_minutes or not goals.get("enabled"):
         return {}
     
     targets = goals.get("targets", {})
     limits = goals.get("limits", [])
-    category_minutes = df.groupby('任务分类')['Duration_Min'].sum().to_dict()
     
     progress = {}
     for category, target in targets.items():
@@ -152,13 +102,70 @@ def calculate_goal_progress(df, goals):
     return progress
 
 
+EDITOR_PAGE_SIZES = [100, 200, 500, 1000]
+LIVE_PANEL_SECONDS = 5
+
+
+def editor_dirty():
+    """数据明细编辑器中是否有未保存的修改（有则不自动刷新，避免打断编辑）"""
+    for key, value in st.session_state.items():
+        if str(key).startswith("editor_") and isinstance(value, dict) and any(
+                value.get(k) for k in ("edited_rows", "added_rows", "deleted_rows")):
+            return True
+    return False
+
+
+def render_now_panel():
+    """「正在进行」面板：只读订阅端内存；有新记录推送时整页重跑以合并增量"""
+    subscriber = get_live()
+    now = subscriber.get_now() if subscriber else None
+    if not now:
+        st.caption("⚪ 未连接 Tracker 实时推送")
+        return
+    elapsed = max(int(time.time() - now["start"]), 0)
+    duration = f"{elapsed // 3600}小时{elapsed % 3600 // 60}分" if elapsed >= 3600 else f"{elapsed // 60}分{elapsed % 60}秒"
+    if now["idle"]:
+        st.markdown(f"**💤 空闲中** · {duration}")
+    else:
+        st.markdown(f"**🟢 正在进行：{now['process']}** · {duration}")
+        st.caption(now["url"] or now["title"])
+    # 查询服务每次查询时合并推送，这里只负责在有新记录时触发重跑
+    rendered = st.session_state.get("live_rendered")
+    if rendered and subscriber.position() != rendered and not editor_dirty():
+        st.rerun()
+
+
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+if _fragment:
+    render_now_panel = _fragment(run_every=LIVE_PANEL_SECONDS)(render_now_panel)
+
+
+def learn_corrections(original_df, edited_df):
+    """把用户修改过的分类写回分类缓存，之后同类活动不再走 AI"""
+    common_index = original_df.index.intersection(edited_df.index)
+    before = original_df.loc[common_index, '任务分类']
+    after = edited_df.loc[common_index, '任务分类']
+    changed = edited_df.loc[common_index[(before != after).values]]
+    changed = changed[changed['任务分类'].notna() & (changed['任务分类'] != '')]
+    if changed.empty:
+        return 0
+
+    cache = classifier.ClassificationCache()
+    learned = 0
+    for date_key, group_data in changed.groupby('日期'):
+        rows = group_data[['开始时间', '结束时间', '任务分类']].astype(str).values.tolist()
+        learned += cache.learn(date_key, classifier.read_raw_lines(date_key), rows, source="user")
+    return learned
+
+
 # ==========================================
 # 3. 侧边栏
 # ==========================================
 st.sidebar.title("🎛️ 控制面板")
 
 if st.sidebar.button("🔄 刷新数据", type="primary", use_container_width=True):
-    st.cache_data.clear()
+    # 平时查询服务按数据版本只重读磁盘上变化的日期，这里全部重读
+    get_query_service().refresh()
     st.rerun()
 
 st.sidebar.divider()
@@ -181,17 +188,43 @@ else:
 
 st.sidebar.caption(f"📆 {start_date} 至 {end_date}")
 
-# 加载数据
-df = load_data_by_range(start_date, end_date)
+backlog = load_failed_backlog()
+if backlog["batches"]:
+    next_retry = backlog["next_retry"]
+    next_text = f"，下次重试 {datetime.fromtimestamp(next_retry).strftime('%H:%M')}" if next_retry else ""
+    st.sidebar.warning(f"⏳ 待重新分类: {backlog['batches']} 批 / {backlog['lines']} 条记录{next_text}")
+elif backlog["recovered_batches"]:
+    st.sidebar.caption(f"✅ 已自动补回 {backlog['recovered_lines']} 条失败记录")
+if backlog["unparsed_lines"]:
+    st.sidebar.caption(f"⚠️ {backlog['unparsed_lines']} 条失败记录无法解析，保留在 logs/failed/unparsed_*.txt")
+
+with st.sidebar:
+    render_now_panel()
+
+# 加载数据：查询服务在进程内共享，推送的新记录已合并；返回的 DataFrame 只读
+start_str, end_str = start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+service = get_query_service()
+if get_live() is not None and end_str >= common.get_today_str():
+    # 先记下推送位置再查询，之后到达的记录由「正在进行」面板触发重跑
+    st.session_state.live_rendered = get_live().position()
+else:
+    st.session_state.pop("live_rendered", None)
+data = service.range(start_str, end_str)
+df = data.frame
 
 # 分类过滤
-if not df.empty and '任务分类' in df.columns:
+if data.categories:
     st.sidebar.divider()
-    all_categories = sorted(df['任务分类'].unique())
-    selected_categories = st.sidebar.multiselect("🏷️ 筛选分类", all_categories, default=all_categories)
-    filtered_df = df[df['任务分类'].isin(selected_categories)]
-else:
-    filtered_df = df
+    selected_categories = st.sidebar.multiselect("🏷️ 筛选分类", data.categories, default=data.categories)
+    data = service.select(data, selected_categories)
+filtered_df = data.frame
+
+# 汇总视图只读按天预聚合的数据：O(天数 × 分类数)
+category_minutes = service.totals(data)
+
+stats = service.get_stats()
+st.sidebar.caption(f"🗄️ 共享数据 {stats['rows']} 条 / {stats['memory_mb']} MB · "
+                   f"{stats['queries_per_min']:.0f} 次查询/分钟")
 
 
 # ==========================================
@@ -207,7 +240,7 @@ title_suffix = f"({start_date})" if days_count == 1 else f"({start_date} ~ {end_
 st.title(f"📊 时间追踪报告 {title_suffix}")
 
 # 核心指标
-total_minutes = filtered_df['Duration_Min'].sum() if not filtered_df.empty else 0
+total_minutes = sum(category_minutes.values())
 total_hours = total_minutes / 60
 total_sessions = len(filtered_df)
 avg_session = total_minutes / max(total_sessions, 1)
@@ -230,11 +263,10 @@ st.divider()
 tab1, tab2, tab3, tab4 = st.tabs(["📊 总览", "🗓️ 时间轴", "🎯 目标追踪", "📝 数据明细"])
 
 with tab1:
-    if not filtered_df.empty and '任务分类' in filtered_df.columns:
+    if category_minutes:
         chart_col1, chart_col2 = st.columns(2)
         
-        category_time = filtered_df.groupby('任务分类')['Duration_Min'].sum().reset_index()
-        category_time.columns = ['分类', '分钟']
+        category_time = pd.DataFrame(list(category_minutes.items()), columns=['分类', '分钟'])
         category_time['小时'] = category_time['分钟'] / 60
         
         with chart_col1:
@@ -253,6 +285,16 @@ with tab1:
             fig_bar.update_layout(showlegend=False, margin=dict(t=20, b=20, l=20, r=20))
             fig_bar.update_traces(textposition='outside')
             st.plotly_chart(fig_bar, use_container_width=True)
+        
+        hourly_df = data.hourly
+        if not hourly_df.empty:
+            st.subheader("⏰ 时段分布")
+            hour_time = hourly_df.groupby(['小时', '分类'], as_index=False)['分钟'].sum()
+            fig_hour = px.bar(hour_time, x='小时', y='分钟', color='分类',
+                            color_discrete_sequence=px.colors.qualitative.Set2)
+            fig_hour.update_layout(xaxis=dict(dtick=1, range=[-0.5, 23.5]), legend=dict(orientation="h", y=1.1),
+                                   margin=dict(t=20, b=20, l=20, r=20))
+            st.plotly_chart(fig_hour, use_container_width=True)
 
 with tab2:
     st.subheader("🗓️ 活动时间轴")
@@ -260,12 +302,25 @@ with tab2:
     
     if not filtered_df.empty:
         try:
-            timeline_df = filtered_df.sort_values("Start_DT")
+            # 服务端按可见范围合并片段，只有范围内记录足够少时才发送完整明细
+            view_start = filtered_df['Start_DT'].min().to_pydatetime()
+            view_end = filtered_df['End_DT'].max().to_pydatetime()
+            if len(filtered_df) > analysis.TIMELINE_FULL_ROWS and view_end - view_start > timedelta(hours=1):
+                view_start, view_end = st.slider("🔍 显示范围", min_value=view_start, max_value=view_end,
+                                                 value=(view_start, view_end), step=timedelta(minutes=15),
+                                                 format="MM-DD HH:mm")
+            timeline_df, resolution = analysis.downsample_timeline(
+                filtered_df, pd.Timestamp(view_start), pd.Timestamp(view_end))
+            if resolution:
+                st.caption(f"已将 {timeline_df['记录数'].sum()} 条记录合并为 {len(timeline_df)} 段"
+                           f"（精度约 {resolution / 60:.0f} 分钟），缩小显示范围可查看明细")
             y_categories = sorted(filtered_df['任务分类'].unique())
-            tick_format = "%m-%d %H:%M" if days_count > 1 else "%H:%M"
+            tick_format = "%m-%d %H:%M" if view_end - view_start > timedelta(days=1) else "%H:%M"
+            hover = ["日期", "任务详情", "Duration_Min"] + (["记录数"] if resolution else [])
             
             fig_timeline = px.timeline(timeline_df, x_start="Start_DT", x_end="End_DT", y="任务分类",
-                                      color="任务分类", hover_data=["日期", "任务详情", "Duration_Min"],
+                                      color="任务分类", hover_data=hover,
+                                      category_orders={"任务分类": y_categories},
                                       height=max(400, len(y_categories) * 60),
                                       color_discrete_sequence=px.colors.qualitative.Set2)
             fig_timeline.update_layout(
@@ -313,7 +368,7 @@ with tab3:
     
     if goals.get("enabled") and days_count == 1:
         st.divider()
-        progress = calculate_goal_progress(filtered_df, goals)
+        progress = calculate_goal_progress(category_minutes, goals)
         if progress:
             cols = st.columns(len(progress))
             for i, (cat, data) in enumerate(progress.items()):
@@ -336,25 +391,51 @@ with tab4:
         
         st.divider()
         
-        df_to_edit = filtered_df[['日期', '开始时间', '结束时间', '任务分类', '任务详情']].copy()
+        # 分页编辑：编辑器只载入当前页，保存时只写入有变化的行
+        page_col, size_col, info_col = st.columns([2, 2, 6])
+        with size_col:
+            page_size = st.selectbox("每页条数", EDITOR_PAGE_SIZES, index=1)
+        page_count = max((len(filtered_df) - 1) // page_size + 1, 1)
+        with page_col:
+            page = st.number_input("页码", min_value=1, max_value=page_count, value=1, step=1)
+        with info_col:
+            st.caption(f"共 {len(filtered_df)} 条 / {page_count} 页，切换页面前请先保存当前页的修改")
+
+        page_df = filtered_df.iloc[(page - 1) * page_size:page * page_size]
+        df_to_edit = page_df[analysis.EDIT_COLUMNS]
         edited_df = st.data_editor(df_to_edit, num_rows="dynamic", use_container_width=True, hide_index=True,
+            key=f"editor_{start_str}_{end_str}_{page}_{page_size}",
             column_config={
-                "日期": st.column_config.TextColumn(disabled=True, width="small"),
+                "日期": st.column_config.TextColumn(disabled=True, width="small", default=end_str),
                 "任务分类": st.column_config.SelectboxColumn(
                     options=["开发", "AI", "知识库", "学习", "办公", "社交", "娱乐", "系统", "休息"], width="small")
             })
         
         if st.button("💾 保存修改", type="primary"):
-            try:
-                for date_key, group_data in edited_df.groupby('日期'):
-                    save_df = group_data[['开始时间', '结束时间', '任务分类', '任务详情']]
-                    save_df.to_csv(os.path.join(common.LOG_DIR, f"{date_key}.csv"), index=False, encoding="utf-8-sig")
-                st.cache_data.clear()
-                st.success("✅ 保存成功")
+            changes, invalid = analysis.diff_edits(page_df, edited_df, default_date=end_str)
+            store = get_store()
+            saved, failed = [], []
+            for date_key, (deleted, inserted) in sorted(changes.items()):
+                try:
+                    store.apply_changes(date_key, deleted, inserted)
+                    saved.append(date_key)
+                except Exception as e:
+                    failed.append(f"{date_key}: {e}")
+            # 只让改动过的日期在查询服务中重读，其他日期和会话的数据不受影响
+            service.invalidate(changes.keys())
+            learned = learn_corrections(df_to_edit, edited_df) if saved else 0
+
+            if invalid:
+                st.warning(f"⚠️ {invalid} 条新增/修改的记录时间格式无效，未保存")
+            if failed:
+                st.error("❌ 以下日期保存失败（数据可能已被其他进程修改，请刷新后重试）: " + "; ".join(failed))
+            elif not changes:
+                st.info("没有需要保存的修改")
+            else:
+                st.success(f"✅ 已保存 {len(saved)} 天的修改（{learned} 条分类修正已记入缓存）" if learned
+                           else f"✅ 已保存 {len(saved)} 天的修改")
                 time.sleep(1)
                 st.rerun()
-            except Exception as e:
-                st.error(f"❌ 保存失败: {e}")
     else:
         st.info("暂无数据")
 